@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import numpy as np
+import tenseal as ts
+from typing import List, Optional, Sequence
+
+import instrumentation
+from compaction import encrypt_compact
+from encrypted_matrix import EncryptedMatrix, PackingLayout
+from keystore import default_store
+from wire_format import (CHUNK_LENGTH, COMPRESSION_CODES, HEADER, MAX_CHUNK_LENGTH, WireFormatError,
+                         check_chunk_length, decode_chunk, decode_header, deserialize_chunk, encode_chunk,
+                         encode_header)
+
+DEFAULT_TIMEOUT = 30.0
+
+
+class AggregationServer:
+    """Servidor asyncio que recibe las matrices cifradas (ya ponderadas) de los hospitales.
+
+    Cada conexión envía un contenedor de wire_format; cada cifrado se deserializa y se suma
+    a la suma acumulada en cuanto llega, sin esperar al resto de la matriz. Como mucho
+    `max_active_uploads` subidas se procesan a la vez: el resto espera sin leer, de modo que
+    el control de flujo del socket frena a esos clientes (backpressure). Cada lectura tiene
+    un plazo de `timeout` segundos y cada bloque declarado se limita a `max_chunk_length`
+    bytes. Si una subida falla a medias, por el motivo que sea, sus cifrados ya sumados se
+    restan, no cuenta como contribución y el cliente recibe una respuesta de error.
+    """
+
+    def __init__(self, context: ts.Context, timeout: float = DEFAULT_TIMEOUT,
+                 max_active_uploads: Optional[int] = None, max_chunk_length: int = MAX_CHUNK_LENGTH):
+        self.context = context
+        self.timeout = timeout
+        self.max_chunk_length = max_chunk_length
+        self.layout: Optional[PackingLayout] = None
+        self.scale = None
+        self.level = None
+        self.num_contributions = 0
+        self.num_failed = 0
+        self.bytes_received = 0
+        self.num_receiving = 0
+        self._sum: Optional[List[Optional[ts.CKKSVector]]] = None
+        self._slots = asyncio.Semaphore(max_active_uploads) if max_active_uploads else None
+        self._changed = asyncio.Condition()
+        self._servers: List[asyncio.AbstractServer] = []
+
+    # ======= Arranque y parada =======
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Escucha en TCP y devuelve el puerto asignado (útil con port=0)"""
+        server = await asyncio.start_server(self._handle, host, port)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def start_unix(self, path: str):
+        """Escucha en un socket Unix"""
+        self._servers.append(await asyncio.start_unix_server(self._handle, path))
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+
+    async def wait_for_contributions(self, count: int, timeout: Optional[float] = None):
+        """Espera hasta haber incorporado `count` contribuciones completas"""
+        async with self._changed:
+            await asyncio.wait_for(self._changed.wait_for(lambda: self.num_contributions >= count), timeout)
+
+    def result(self) -> EncryptedMatrix:
+        """Suma de las contribuciones completas. Los cifrados son copias: las subidas
+        posteriores no modifican una matriz ya entregada.
+
+        Las subidas en curso se suman a medida que llegan, así que con alguna a medias la
+        suma no corresponde a contribuciones completas: en ese caso lanza RuntimeError.
+        """
+        if self.num_contributions == 0:
+            raise RuntimeError("El servidor no ha recibido ninguna contribución completa")
+        if self.num_receiving:
+            raise RuntimeError(f"Hay {self.num_receiving} subidas en curso sumadas a medias")
+        return EncryptedMatrix(self.layout, [vec.copy() for vec in self._sum])
+
+    # ======= Recepción =======
+
+    async def _read(self, reader: asyncio.StreamReader, size: int) -> bytes:
+        data = await asyncio.wait_for(reader.readexactly(size), self.timeout)
+        self.bytes_received += size
+        return data
+
+    def _check_header(self, layout: PackingLayout, scale: float, level: int):
+        if self.layout is None:
+            self.layout, self.scale, self.level = layout, scale, level
+            self._sum = [None] * layout.num_ciphertexts
+        elif layout != self.layout:
+            raise WireFormatError(f"Layout {layout!r} distinto del de la agregación {self.layout!r}")
+        elif scale != self.scale or level != self.level:
+            raise WireFormatError(
+                f"Escala/nivel ({scale}, {level}) distintos de los de la agregación ({self.scale}, {self.level})"
+            )
+
+    def _deserialize(self, blob: bytes) -> ts.CKKSVector:
+        with instrumentation.stage(instrumentation.DESERIALIZE, ciphertexts=1) as stage:
+            stage.add_bytes(len(blob))
+            return deserialize_chunk(self.context, blob)
+
+    def _fold(self, index: int, vec: ts.CKKSVector):
+        with instrumentation.stage(instrumentation.ADD, ciphertexts=1):
+            if self._sum[index] is None:
+                self._sum[index] = vec
+            else:
+                self._sum[index].add_(vec)
+
+    async def _receive(self, reader: asyncio.StreamReader, folded: List[bytes]):
+        """Lee un contenedor completo sumando cada cifrado según llega"""
+        loop = asyncio.get_running_loop()
+        compression, layout, scale, level = decode_header(await self._read(reader, HEADER.size))
+        self._check_header(layout, scale, level)
+        for index in range(layout.num_ciphertexts):
+            (length,) = CHUNK_LENGTH.unpack(await self._read(reader, CHUNK_LENGTH.size))
+            check_chunk_length(length, self.max_chunk_length)
+            blob = decode_chunk(compression, await self._read(reader, length), self.max_chunk_length)
+            # La deserialización no toca estado compartido y puede ir a un hilo;
+            # la suma se hace en el bucle de eventos, que serializa el acceso a la suma
+            vec = await loop.run_in_executor(None, self._deserialize, blob)
+            self._fold(index, vec)
+            folded.append(blob)
+
+    def _rollback(self, folded: List[bytes]):
+        """Resta los cifrados ya sumados de una subida que no ha terminado"""
+        for index, blob in enumerate(folded):
+            self._sum[index].sub_(self._deserialize(blob))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        folded: List[bytes] = []
+        try:
+            if self._slots is not None:
+                await self._slots.acquire()
+            try:
+                self.num_receiving += 1
+                await self._receive(reader, folded)
+            finally:
+                if self._slots is not None:
+                    self._slots.release()
+        except Exception as e:
+            # Cualquier fallo (red, formato, descompresión o un cifrado que SEAL rechaza) deja
+            # la suma como estaba antes de la subida
+            self._rollback(folded)
+            self.num_receiving -= 1
+            self.num_failed += 1
+            message = "timeout" if isinstance(e, asyncio.TimeoutError) else str(e) or type(e).__name__
+            await self._reply(writer, f"ERROR {message}")
+            return
+
+        async with self._changed:
+            self.num_receiving -= 1
+            self.num_contributions += 1
+            count = self.num_contributions
+            self._changed.notify_all()
+        await self._reply(writer, f"OK {count}")
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, message: str):
+        try:
+            writer.write(message.encode() + b"\n")
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+# ======= Cliente =======
+
+async def _open(host: Optional[str], port: Optional[int], path: Optional[str]):
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    if port is None:
+        raise ValueError("Se necesita un puerto TCP o la ruta de un socket Unix")
+    return await asyncio.open_connection(host or "127.0.0.1", port)
+
+
+async def upload_serialized(layout: PackingLayout, scale: float, level: int, ciphertexts: Sequence[bytes],
+                            host: Optional[str] = None, port: Optional[int] = None, path: Optional[str] = None,
+                            compression: str = "none", timeout: Optional[float] = DEFAULT_TIMEOUT) -> int:
+    """Envía cifrados ya serializados y devuelve el número de contribuciones del servidor tras la subida.
+
+    Se espera a que el socket vacíe su búfer tras cada cifrado (drain), así un servidor
+    saturado frena al cliente en lugar de acumular la matriz entera en memoria.
+    """
+    if len(ciphertexts) != layout.num_ciphertexts:
+        raise ValueError(f"El layout requiere {layout.num_ciphertexts} cifrados y se recibieron {len(ciphertexts)}")
+    reader, writer = await asyncio.wait_for(_open(host, port, path), timeout)
+    try:
+        writer.write(encode_header(layout, scale, level, compression))
+        code = COMPRESSION_CODES[compression]
+        for blob in ciphertexts:
+            writer.write(encode_chunk(code, blob))
+            await asyncio.wait_for(writer.drain(), timeout)
+        status, _, detail = (await asyncio.wait_for(reader.readline(), timeout)).decode().strip().partition(" ")
+    finally:
+        writer.close()
+    if status != "OK":
+        raise ConnectionError(f"El servidor rechazó la subida: {detail or status or 'conexión cerrada'}")
+    return int(detail)
+
+
+async def upload(matrix: EncryptedMatrix, host: Optional[str] = None, port: Optional[int] = None,
+                 path: Optional[str] = None, compression: str = "none",
+                 timeout: Optional[float] = DEFAULT_TIMEOUT) -> int:
+    """Serializa y envía una matriz cifrada al servidor de agregación"""
+    return await upload_serialized(matrix.layout, matrix.scale, matrix.level, matrix.serialize(),
+                                   host, port, path, compression, timeout)
+
+
+# ======= Simulación de muchos hospitales en una máquina =======
+
+async def simulate(num_clients: int, shape, use_tcp: bool = False, max_active_uploads: Optional[int] = None,
+                   compression: str = "none", compact: bool = False):
+    """Lanza un servidor y `num_clients` subidas concurrentes de la misma matriz cifrada"""
+    context = default_store().load_or_create(8192, [40, 20, 20, 20, 40], 2 ** 20)
+    data = np.random.default_rng(0).random(shape)
+    if compact:
+        # El servidor sólo suma: último nivel y cifrado con semilla
+        matrix = encrypt_compact(context, data, level=0)
+    else:
+        matrix = EncryptedMatrix.encrypt(context, data)
+    blobs = matrix.serialize() if isinstance(matrix, EncryptedMatrix) else matrix.ciphertexts
+
+    server = AggregationServer(context, max_active_uploads=max_active_uploads)
+    with tempfile.TemporaryDirectory() as tmp:
+        target = dict(path=os.path.join(tmp, "aggregation.sock"))
+        if use_tcp:
+            target = dict(port=await server.start_tcp())
+        else:
+            await server.start_unix(target["path"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            upload_serialized(matrix.layout, matrix.scale, matrix.level, blobs, compression=compression, **target)
+            for _ in range(num_clients)
+        ))
+        elapsed = time.perf_counter() - start
+        await server.close()
+
+    error = np.abs(server.result().decrypt() - num_clients * data).max()
+    print(f"Clientes: {num_clients}, cifrados por matriz: {len(blobs)}, "
+          f"bytes por subida: {sum(len(blob) for blob in blobs)}")
+    print(f"Tiempo total: {elapsed:.3f} s ({num_clients / elapsed:.1f} subidas/s, "
+          f"{server.bytes_received / elapsed / 2 ** 20:.1f} MB/s)")
+    print(f"Error máximo de la suma: {error:.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulación de subidas concurrentes al servidor de agregación")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=64)
+    parser.add_argument("--cols", type=int, default=64)
+    parser.add_argument("--tcp", action="store_true", help="Usar TCP en localhost en lugar de un socket Unix")
+    parser.add_argument("--max-active-uploads", type=int, default=None)
+    parser.add_argument("--compression", choices=list(COMPRESSION_CODES), default="none")
+    parser.add_argument("--compact", action="store_true", help="Subir en el último nivel con cifrados con semilla")
+    args = parser.parse_args()
+    asyncio.run(simulate(args.clients, (args.rows, args.cols), args.tcp, args.max_active_uploads, args.compression,
+                         args.compact))
@@ -0,0 +1,189 @@
+import argparse
+import os
+import time
+import numpy as np
+import tenseal as ts
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from backends import Backend, PackedVectorBackend
+from encrypted_matrix import EncryptedMatrix, PackingLayout
+from error_budget import ErrorBudget
+
+# Contexto público deserializado una sola vez en cada proceso trabajador
+_worker_context = None
+
+
+def _init_worker(serialized_context: bytes):
+    """Inicializador del pool: deserializa el contexto público en el trabajador"""
+    global _worker_context
+    _worker_context = ts.context_from(serialized_context)
+
+
+def _reduce_group(layout: PackingLayout, groups: List[List[bytes]], budgets: List[Optional[ErrorBudget]],
+                  weights: Optional[List[float]]) -> Tuple[List[bytes], Optional[ErrorBudget]]:
+    """Reduce en el trabajador un grupo de matrices serializadas y devuelve la suma serializada"""
+    matrices = [EncryptedMatrix.from_serialized(_worker_context, layout, blobs, budget)
+                for blobs, budget in zip(groups, budgets)]
+    result = EncryptedAggregator._reduce_serial(matrices, weights, PackedVectorBackend())
+    return result.serialize(), result.budget
+
+
+class EncryptedAggregator:
+    """Suma ponderada incremental de las matrices cifradas que envían los hospitales.
+
+    El agregador toma posesión de cada contribución: la pondera y la suma en sitio,
+    de modo que sólo la suma acumulada permanece viva entre contribuciones.
+    Las operaciones se delegan en un Backend (por defecto, filas empaquetadas).
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, backend: Optional[Backend] = None):
+        self.max_workers = max_workers
+        self.backend = backend or PackedVectorBackend()
+        self.num_contributions = 0
+        self._sum = None
+
+    @classmethod
+    def with_zeros(cls, context: ts.Context, layout: PackingLayout,
+                   max_workers: Optional[int] = None) -> "EncryptedAggregator":
+        """Crea un agregador cuya suma parte de un cifrado de ceros recién generado"""
+        aggregator = cls(max_workers)
+        aggregator._sum = EncryptedMatrix.zeros(context, layout)
+        return aggregator
+
+    def add(self, matrix: EncryptedMatrix, weight: Optional[float] = None, copy: bool = False):
+        """Incorpora la contribución de un hospital a la suma acumulada.
+
+        Con copy=False la matriz se pondera en sitio y, si es la primera, pasa a ser la suma.
+        Con copy=True la matriz del llamante no se modifica y nunca se copia con deepcopy:
+        se pondera en un cifrado nuevo o se suma sobre una matriz de ceros. Sólo está
+        disponible para EncryptedMatrix.
+        """
+        if copy and not isinstance(matrix, EncryptedMatrix):
+            raise ValueError(f"copy=True requiere EncryptedMatrix, recibido {type(matrix).__name__}")
+        if weight is not None:
+            matrix = matrix * weight if copy else self.backend.mul_(matrix, weight)
+            copy = False
+        if self._sum is None:
+            if copy:
+                self._sum = EncryptedMatrix.zeros(matrix.context, matrix.layout)
+                self._sum.add_(matrix)
+            else:
+                self._sum = matrix
+        else:
+            self.backend.add_(self._sum, matrix)
+        self.num_contributions += 1
+
+    def add_stream(self, matrices: Iterable[EncryptedMatrix], weights: Optional[Iterable[float]] = None):
+        """Consume contribuciones a medida que llegan sin mantenerlas todas en memoria"""
+        if weights is None:
+            for matrix in matrices:
+                self.add(matrix)
+        else:
+            for matrix, weight in zip(matrices, weights):
+                self.add(matrix, weight)
+
+    def add_batch(self, matrices: List[EncryptedMatrix], weights: Optional[Sequence[float]] = None):
+        """Reduce un lote en árbol por parejas y suma el resultado. La lista se vacía al terminar"""
+        if not matrices:
+            return
+        count = len(matrices)
+        batch_sum = self.tree_reduce(matrices, weights, self.max_workers, self.backend)
+        self.add(batch_sum)
+        self.num_contributions += count - 1
+
+    @staticmethod
+    def tree_reduce(matrices: List[EncryptedMatrix], weights: Optional[Sequence[float]] = None,
+                    max_workers: Optional[int] = None, backend: Optional[Backend] = None) -> EncryptedMatrix:
+        """Suma por parejas en log2(N) niveles. La lista se vacía al terminar.
+
+        Las operaciones de TenSEAL no liberan el GIL, así que el paralelismo es por procesos:
+        con max_workers > 1 (por defecto, un trabajador por núcleo) y matrices EncryptedMatrix
+        con el backend por defecto, el lote se reparte en grupos contiguos que cada trabajador
+        pondera y reduce a partir de los cifrados serializados; el proceso principal suma las
+        sumas parciales. Cada matriz se serializa una vez a la ida y cada suma parcial una vez
+        a la vuelta, así que compensa con lotes grandes y con pesos (el producto reescalado es
+        mucho más caro que la suma). Con un solo núcleo, o con otros backends, se reduce en serie.
+        """
+        if not matrices:
+            raise ValueError("No hay matrices que reducir")
+        if weights is not None and len(weights) != len(matrices):
+            raise ValueError(f"Se recibieron {len(matrices)} matrices y {len(weights)} pesos")
+
+        backend = backend or PackedVectorBackend()
+        workers = min(max_workers or os.cpu_count() or 1, len(matrices) // 2)
+        if workers <= 1 or type(backend) is not PackedVectorBackend \
+                or not all(isinstance(matrix, EncryptedMatrix) for matrix in matrices):
+            return EncryptedAggregator._reduce_serial(matrices, weights, backend)
+
+        context = matrices[0].context
+        layout = matrices[0].layout
+        # Los trabajadores sólo suman y multiplican por escalares: basta el contexto público sin claves de evaluación
+        serialized_context = context.serialize(save_public_key=True, save_secret_key=False,
+                                               save_galois_keys=False, save_relin_keys=False)
+        bounds = [len(matrices) * k // workers for k in range(workers + 1)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(serialized_context,)) as executor:
+            futures = []
+            for start, stop in zip(bounds, bounds[1:]):
+                group = matrices[start:stop]
+                futures.append(executor.submit(
+                    _reduce_group, layout, [matrix.serialize() for matrix in group],
+                    [matrix.budget for matrix in group],
+                    None if weights is None else [float(w) for w in weights[start:stop]]))
+            # Los cifrados ya viajan serializados: se liberan mientras trabajan los procesos
+            matrices.clear()
+            partials = [EncryptedMatrix.from_serialized(context, layout, *future.result()) for future in futures]
+        return EncryptedAggregator._reduce_serial(partials, None, backend)
+
+    @staticmethod
+    def _reduce_serial(matrices: List[EncryptedMatrix], weights: Optional[Sequence[float]],
+                       backend: Backend) -> EncryptedMatrix:
+        if weights is not None:
+            for matrix, weight in zip(matrices, weights):
+                backend.mul_(matrix, weight)
+        while len(matrices) > 1:
+            for index in range(0, len(matrices) - 1, 2):
+                backend.add_(matrices[index], matrices[index + 1])
+            # Los sumandos de la derecha ya están incorporados y se liberan
+            del matrices[1::2]
+        return matrices.pop()
+
+    def result(self) -> EncryptedMatrix:
+        """Devuelve la suma acumulada"""
+        if self._sum is None:
+            raise RuntimeError("El agregador no ha recibido ninguna contribución")
+        return self._sum
+
+    def reset(self):
+        """Descarta la suma acumulada para empezar una nueva ronda"""
+        self._sum = None
+        self.num_contributions = 0
+
+
+# ======= Reducción en serie frente a procesos =======
+
+if __name__ == "__main__":
+    from keystore import default_store
+
+    parser = argparse.ArgumentParser(description="tree_reduce en serie frente a un pool de procesos")
+    parser.add_argument("--hospitals", type=int, default=32)
+    parser.add_argument("--rows", type=int, default=448)
+    parser.add_argument("--cols", type=int, default=448)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    context = default_store().load_or_create(8192, [40, 20, 20, 20, 40], 2 ** 20)
+    rng = np.random.default_rng()
+    data = [rng.random((args.rows, args.cols)) for _ in range(args.hospitals)]
+    weights = rng.dirichlet(np.ones(args.hospitals))
+    expected = np.tensordot(weights, np.stack(data), axes=1)
+
+    print(f"Núcleos disponibles: {os.cpu_count()}")
+    for workers in (1, args.workers or os.cpu_count() or 1):
+        matrices = [EncryptedMatrix.encrypt(context, matrix) for matrix in data]
+        start = time.perf_counter()
+        result = EncryptedAggregator.tree_reduce(matrices, weights, max_workers=workers)
+        elapsed = time.perf_counter() - start
+        error = np.abs(result.decrypt() - expected).max()
+        print(f"max_workers={workers}: {elapsed:.2f} s, error máximo {error:.2e}")
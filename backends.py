@@ -0,0 +1,323 @@
+import time
+import numpy as np
+import tenseal as ts
+import tenseal.sealapi as sealapi
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from encrypted_matrix import EncryptedMatrix, PackingLayout, auto_rescale_disabled, weighted_sums
+from keystore import context_parameters, parameter_key
+
+
+class Backend:
+    """Interfaz común de representación cifrada de una matriz usada por la agregación"""
+
+    name = None
+
+    def encrypt(self, context: ts.Context, matrix: np.ndarray):
+        raise NotImplementedError
+
+    def add_(self, acc, other):
+        """Suma `other` sobre `acc` en sitio y devuelve `acc`"""
+        raise NotImplementedError
+
+    def mul_(self, encrypted, scalar: float):
+        """Multiplica por un escalar en sitio y devuelve el mismo objeto"""
+        raise NotImplementedError
+
+    def weighted_sum(self, encrypted: Sequence, weights: Sequence[float]):
+        raise NotImplementedError
+
+    def decrypt(self, encrypted) -> np.ndarray:
+        raise NotImplementedError
+
+    def serialize(self, encrypted) -> List[bytes]:
+        raise NotImplementedError
+
+    def nbytes(self, encrypted) -> int:
+        return sum(len(blob) for blob in self.serialize(encrypted))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+class RowVectorBackend(Backend):
+    """Un CKKSVector por fila, como en los scripts originales"""
+
+    name = "vector"
+
+    def encrypt(self, context: ts.Context, matrix: np.ndarray) -> List[ts.CKKSVector]:
+        return [ts.ckks_vector(context, row.tolist()) for row in np.asarray(matrix, dtype=np.float64)]
+
+    def add_(self, acc: List[ts.CKKSVector], other: List[ts.CKKSVector]) -> List[ts.CKKSVector]:
+        for a, b in zip(acc, other):
+            a.add_(b)
+        return acc
+
+    def mul_(self, encrypted: List[ts.CKKSVector], scalar: float) -> List[ts.CKKSVector]:
+        for vec in encrypted:
+            vec.mul_(float(scalar))
+        return encrypted
+
+    def weighted_sum(self, encrypted: Sequence[List[ts.CKKSVector]], weights: Sequence[float]) -> List[ts.CKKSVector]:
+        return weighted_sums([[rows[i] for rows in encrypted] for i in range(len(encrypted[0]))], weights)
+
+    def decrypt(self, encrypted: List[ts.CKKSVector]) -> np.ndarray:
+        return np.array([vec.decrypt() for vec in encrypted])
+
+    def serialize(self, encrypted: List[ts.CKKSVector]) -> List[bytes]:
+        return [vec.serialize() for vec in encrypted]
+
+
+class TensorBackend(Backend):
+    """CKKSTensor con las filas en los slots (batch=True): un cifrado por columna"""
+
+    name = "tensor"
+
+    def encrypt(self, context: ts.Context, matrix: np.ndarray) -> ts.CKKSTensor:
+        return ts.ckks_tensor(context, ts.plain_tensor(np.asarray(matrix, dtype=np.float64)), batch=True)
+
+    def add_(self, acc: ts.CKKSTensor, other: ts.CKKSTensor) -> ts.CKKSTensor:
+        acc.add_(other)
+        return acc
+
+    def mul_(self, encrypted: ts.CKKSTensor, scalar: float) -> ts.CKKSTensor:
+        encrypted.mul_(float(scalar))
+        return encrypted
+
+    def weighted_sum(self, encrypted: Sequence[ts.CKKSTensor], weights: Sequence[float]) -> ts.CKKSTensor:
+        with auto_rescale_disabled(encrypted[0].context()):
+            result = encrypted[0].mul(float(weights[0]))
+            for tensor, weight in zip(encrypted[1:], weights[1:]):
+                result.add_(tensor.mul(float(weight)))
+        return result
+
+    def decrypt(self, encrypted: ts.CKKSTensor) -> np.ndarray:
+        return np.array(encrypted.decrypt().tolist())
+
+    def serialize(self, encrypted: ts.CKKSTensor) -> List[bytes]:
+        return [encrypted.serialize()]
+
+
+class PackedVectorBackend(Backend):
+    """Varias filas por CKKSVector mediante EncryptedMatrix"""
+
+    name = "packed"
+
+    def encrypt(self, context: ts.Context, matrix: np.ndarray) -> EncryptedMatrix:
+        return EncryptedMatrix.encrypt(context, matrix)
+
+    def add_(self, acc: EncryptedMatrix, other: EncryptedMatrix) -> EncryptedMatrix:
+        return acc.add_(other)
+
+    def mul_(self, encrypted: EncryptedMatrix, scalar: float) -> EncryptedMatrix:
+        return encrypted.mul_(scalar)
+
+    def weighted_sum(self, encrypted: Sequence[EncryptedMatrix], weights: Sequence[float]) -> EncryptedMatrix:
+        return EncryptedMatrix.weighted_sum(encrypted, weights)
+
+    def decrypt(self, encrypted: EncryptedMatrix) -> np.ndarray:
+        return encrypted.decrypt()
+
+    def serialize(self, encrypted: EncryptedMatrix) -> List[bytes]:
+        return encrypted.serialize()
+
+
+# ======= BFV con valores cuantizados =======
+
+BFV_PLAIN_MODULUS_BITS = 40
+
+
+def bfv_context(poly_modulus_degree: int, plain_modulus_bits: int = BFV_PLAIN_MODULUS_BITS,
+                coeff_mod_bit_sizes: Optional[List[int]] = None) -> ts.Context:
+    """Contexto BFV con batching (módulo de texto plano primo y congruente con 1 mod 2N).
+
+    Sólo se hacen sumas y productos por enteros en claro, que gastan poco presupuesto de
+    ruido: con N >= 8192 bastan tres primos de 60 bits en lugar del módulo por defecto.
+    """
+    plain_modulus = sealapi.PlainModulus.Batching(poly_modulus_degree, plain_modulus_bits).value()
+    if coeff_mod_bit_sizes is None:
+        coeff_mod_bit_sizes = [60, 60, 60] if poly_modulus_degree >= 8192 else []
+    return ts.context(ts.SCHEME_TYPE.BFV, poly_modulus_degree=poly_modulus_degree,
+                      plain_modulus=plain_modulus, coeff_mod_bit_sizes=coeff_mod_bit_sizes)
+
+
+def _parms(context: ts.Context):
+    return context.seal_context().data.first_context_data().parms()
+
+
+def is_bfv(context: ts.Context) -> bool:
+    return _parms(context).scheme() == sealapi.SCHEME_TYPE.BFV
+
+
+class QuantizedMatrix:
+    """Matriz de enteros de punto fijo (valor * scale) cifrada con BFV, una fila tras otra en los slots.
+
+    `bound` es la cota del valor absoluto de cualquier entero empaquetado; mientras sea
+    menor que plain_modulus / 2 el resultado descifrado es exacto.
+    """
+
+    def __init__(self, layout: PackingLayout, vectors: List[ts.BFVVector], scale: int, bound: int):
+        self.layout = layout
+        self.vectors = vectors
+        self.scale = scale
+        self.bound = bound
+
+    @property
+    def plain_modulus(self) -> int:
+        return _parms(self.vectors[0].context()).plain_modulus().value()
+
+    def __repr__(self) -> str:
+        return (f"QuantizedMatrix(shape={self.layout.shape}, num_ciphertexts={len(self.vectors)}, "
+                f"scale=2**{self.scale.bit_length() - 1}, bound={self.bound})")
+
+
+class QuantizedBFVBackend(Backend):
+    """Valores y pesos cuantizados a punto fijo y agregados con BFV: sumas exactas.
+
+    Los valores se cuantizan con value_bits bits fraccionarios y los pesos con weight_bits;
+    el único error es el de redondeo (2**-(value_bits + 1) por valor y 2**-(weight_bits + 1)
+    por peso). Cada suma comprueba que la cota de los enteros no desborde el módulo.
+    Si recibe un contexto CKKS usa un contexto BFV propio con el mismo grado.
+    """
+
+    name = "bfv"
+
+    def __init__(self, value_bits: int = 16, weight_bits: int = 16, plain_modulus_bits: int = BFV_PLAIN_MODULUS_BITS):
+        self.value_bits = value_bits
+        self.weight_bits = weight_bits
+        self.plain_modulus_bits = plain_modulus_bits
+        self._contexts: Dict[int, ts.Context] = {}
+
+    def context_for(self, context: ts.Context) -> ts.Context:
+        if is_bfv(context):
+            return context
+        degree = _parms(context).poly_modulus_degree()
+        if degree not in self._contexts:
+            self._contexts[degree] = bfv_context(degree, self.plain_modulus_bits)
+        return self._contexts[degree]
+
+    @staticmethod
+    def _check_bound(bound: int, plain_modulus: int):
+        if bound >= plain_modulus // 2:
+            raise ValueError(f"Desbordamiento BFV: la cota {bound} alcanza plain_modulus / 2 = {plain_modulus // 2}; "
+                             f"reduce value_bits/weight_bits o aumenta plain_modulus_bits")
+
+    def max_hospitals(self, context: ts.Context, max_abs_value: float = 1.0, max_weight: float = 1.0) -> int:
+        """Contribuciones ponderadas que se pueden sumar sin desbordar, en el peor caso"""
+        plain_modulus = _parms(self.context_for(context)).plain_modulus().value()
+        per_hospital = round(max_abs_value * 2 ** self.value_bits) * round(max_weight * 2 ** self.weight_bits)
+        return (plain_modulus // 2 - 1) // per_hospital
+
+    def encrypt(self, context: ts.Context, matrix: np.ndarray) -> QuantizedMatrix:
+        context = self.context_for(context)
+        matrix = np.asarray(matrix, dtype=np.float64)
+        scale = 2 ** self.value_bits
+        quantized = np.rint(matrix * scale)
+        bound = int(np.abs(quantized).max())
+        self._check_bound(bound, _parms(context).plain_modulus().value())
+        layout = PackingLayout(matrix.shape[0], matrix.shape[1], _parms(context).poly_modulus_degree())
+        vectors = [ts.bfv_vector(context, chunk.astype(np.int64).tolist()) for chunk in layout.pack(quantized)]
+        return QuantizedMatrix(layout, vectors, scale, bound)
+
+    def add_(self, acc: QuantizedMatrix, other: QuantizedMatrix) -> QuantizedMatrix:
+        if acc.layout != other.layout or acc.scale != other.scale:
+            raise ValueError(f"Matrices cuantizadas incompatibles: {acc} vs {other}")
+        bound = acc.bound + other.bound
+        self._check_bound(bound, acc.plain_modulus)
+        for a, b in zip(acc.vectors, other.vectors):
+            a.add_(b)
+        acc.bound = bound
+        return acc
+
+    def _quantize_weight(self, encrypted: QuantizedMatrix, scalar: float) -> int:
+        weight = round(float(scalar) * 2 ** self.weight_bits)
+        if weight == 0:
+            # SEAL rechaza el producto por un texto plano nulo (cifrado transparente)
+            raise ValueError(f"El peso {scalar} se cuantiza a 0 con {self.weight_bits} bits")
+        self._check_bound(encrypted.bound * abs(weight), encrypted.plain_modulus)
+        return weight
+
+    def mul_(self, encrypted: QuantizedMatrix, scalar: float) -> QuantizedMatrix:
+        weight = self._quantize_weight(encrypted, scalar)
+        for vec in encrypted.vectors:
+            vec.mul_(weight)
+        encrypted.scale *= 2 ** self.weight_bits
+        encrypted.bound *= abs(weight)
+        return encrypted
+
+    def weighted_sum(self, encrypted: Sequence[QuantizedMatrix], weights: Sequence[float]) -> QuantizedMatrix:
+        result = None
+        for matrix, scalar in zip(encrypted, weights):
+            weight = self._quantize_weight(matrix, scalar)
+            term = QuantizedMatrix(matrix.layout, [vec.mul(weight) for vec in matrix.vectors],
+                                   matrix.scale * 2 ** self.weight_bits, matrix.bound * abs(weight))
+            result = term if result is None else self.add_(result, term)
+        return result
+
+    def decrypt(self, encrypted: QuantizedMatrix) -> np.ndarray:
+        return encrypted.layout.unpack([vec.decrypt() for vec in encrypted.vectors]) / encrypted.scale
+
+    def serialize(self, encrypted: QuantizedMatrix) -> List[bytes]:
+        return [vec.serialize() for vec in encrypted.vectors]
+
+
+BACKENDS: Dict[str, Backend] = {
+    backend.name: backend
+    for backend in (RowVectorBackend(), TensorBackend(), PackedVectorBackend(), QuantizedBFVBackend())
+}
+
+# La calibración automática sólo compara representaciones CKKS: BFV cambia el error (cuantización)
+CKKS_BACKENDS = ("vector", "tensor", "packed")
+
+# Backend elegido por calibración para cada (forma, parámetros)
+_selection_cache: Dict[Tuple[Tuple[int, int], str], str] = {}
+
+
+def calibrate(context: ts.Context, shape: Tuple[int, int], candidates: Optional[Sequence[str]] = None,
+              num_hospitals: int = 2, seed: int = 0) -> Dict[str, float]:
+    """Mide cifrado + suma ponderada + suma de num_hospitals matrices aleatorias con cada backend.
+
+    Devuelve {nombre: segundos}. Los backends que no pueden ejecutarse con este contexto
+    (p. ej. CKKSTensor sin claves de relinealización) se omiten.
+    """
+    rng = np.random.default_rng(seed)
+    matrices = [rng.random(shape) for _ in range(num_hospitals)]
+    weights = rng.dirichlet(np.ones(num_hospitals))
+    timings = {}
+    for name in candidates or CKKS_BACKENDS:
+        backend = BACKENDS[name]
+        start = time.perf_counter()
+        try:
+            encrypted = [backend.encrypt(context, matrix) for matrix in matrices]
+            backend.weighted_sum(encrypted, weights)
+            result = encrypted[0]
+            for other in encrypted[1:]:
+                backend.add_(result, other)
+        except ValueError:
+            continue
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def select_backend(context: ts.Context, shape: Tuple[int, int],
+                   candidates: Optional[Sequence[str]] = None) -> Backend:
+    """Devuelve el backend más rápido para esta forma y parámetros, calibrando sólo la primera vez"""
+    key = (tuple(shape), parameter_key(*context_parameters(context)))
+    if key not in _selection_cache:
+        timings = calibrate(context, shape, candidates)
+        if not timings:
+            raise RuntimeError(f"Ningún backend puede ejecutarse con la forma {shape} y este contexto")
+        _selection_cache[key] = min(timings, key=timings.get)
+    return BACKENDS[_selection_cache[key]]
+
+
+def get_backend(name: str, context: Optional[ts.Context] = None,
+                shape: Optional[Tuple[int, int]] = None) -> Backend:
+    """Backend por nombre; 'auto' calibra para (shape, parámetros del contexto)"""
+    if name == "auto":
+        if context is None or shape is None:
+            raise ValueError("El backend 'auto' necesita el contexto y la forma de las matrices")
+        return select_backend(context, shape)
+    if name not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {name} (disponibles: {', '.join(BACKENDS)}, auto)")
+    return BACKENDS[name]
@@ -0,0 +1,261 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import sys
+import time
+import numpy as np
+import tenseal as ts
+from typing import Dict, List, Tuple
+
+from backends import BACKENDS, get_backend
+from compaction import encrypt_compact, memory_bytes, mod_switch
+from encrypted_matrix import EncryptedMatrix
+from keystore import default_store
+
+ORDERINGS = ("weight_then_encrypt", "encrypt_then_weight")
+# Compactación de la subida (sólo backend packed): bajar de nivel o además cifrar con semilla
+COMPACTIONS = ("none", "modswitch", "seeded")
+# 4096:31,31:28 no admite encrypt_then_weight (falla con "scale out of bounds"); se puede pasar con --params
+DEFAULT_PARAMS = ("8192:40,20,20,20,40:20",)
+
+
+def parse_params(spec: str) -> Tuple[int, List[int], int]:
+    """Convierte 'degree:bits,bits,...:scale_bits' en (degree, coeff_mod_bit_sizes, scale_bits)"""
+    try:
+        degree, bits, scale_bits = spec.split(":")
+        return int(degree), [int(b) for b in bits.split(",")], int(scale_bits)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Parámetros CKKS no válidos: {spec!r} (formato degree:bits,...:scale_bits)")
+
+
+def parse_shape(spec: str) -> Tuple[int, int]:
+    try:
+        rows, cols = spec.lower().split("x")
+        return int(rows), int(cols)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Forma no válida: {spec!r} (formato ROWSxCOLS)")
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso en MB (ru_maxrss está en KB en Linux y en bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ======= Ejecución de un caso =======
+
+def _sum(backend, encrypted: List) -> object:
+    result = encrypted[0]
+    for other in encrypted[1:]:
+        backend.add_(result, other)
+    return result
+
+
+def _encrypt_all(ops, context: ts.Context, matrices: List[np.ndarray], compaction: str, level: int):
+    """Cifra las matrices (compactando la subida si se pide) y devuelve (cifrados, bytes subidos por hospital).
+
+    Con "seeded" el tiempo incluye la carga en el servidor, que regenera la semilla.
+    """
+    if compaction == "seeded":
+        uploads = [encrypt_compact(context, matrix, level) for matrix in matrices]
+        return [upload.to_matrix(context) for upload in uploads], uploads[0].nbytes
+    encrypted = [ops.encrypt(context, matrix) for matrix in matrices]
+    if compaction == "modswitch":
+        encrypted = [mod_switch(matrix, level) for matrix in encrypted]
+    return encrypted, ops.nbytes(encrypted[0])
+
+
+def run_once(context: ts.Context, backend: str, ordering: str, matrices: List[np.ndarray],
+             weights: np.ndarray, compaction: str = "none") -> Dict[str, float]:
+    """Ejecuta una vez el pipeline completo y devuelve tiempos por etapa, tamaño y error"""
+    ops = get_backend(backend, context, matrices[0].shape)
+    timings = {}
+
+    start = time.perf_counter()
+    if ordering == "weight_then_encrypt":
+        weighted = [matrix * weight for matrix, weight in zip(matrices, weights)]
+        timings["weight_plain"] = time.perf_counter() - start
+        t = time.perf_counter()
+        # El servidor sólo suma: basta el último nivel
+        encrypted, ciphertext_bytes = _encrypt_all(ops, context, weighted, compaction, level=0)
+        timings["encrypt"] = time.perf_counter() - t
+        server_bytes = memory_bytes(encrypted[0]) if isinstance(encrypted[0], EncryptedMatrix) else None
+        t = time.perf_counter()
+        result = _sum(ops, encrypted)
+        timings["aggregate"] = time.perf_counter() - t
+    else:
+        t = time.perf_counter()
+        # El servidor multiplica por el peso: hace falta un primo más para reescalar
+        encrypted, ciphertext_bytes = _encrypt_all(ops, context, matrices, compaction, level=1)
+        timings["encrypt"] = time.perf_counter() - t
+        server_bytes = memory_bytes(encrypted[0]) if isinstance(encrypted[0], EncryptedMatrix) else None
+        t = time.perf_counter()
+        result = ops.weighted_sum(encrypted, weights)
+        timings["aggregate"] = time.perf_counter() - t
+    timings["total"] = time.perf_counter() - start
+
+    t = time.perf_counter()
+    decrypted = ops.decrypt(result)
+    timings["decrypt"] = time.perf_counter() - t
+
+    expected = np.tensordot(weights, np.stack(matrices), axes=1)
+    error = np.abs(decrypted - expected)
+    return dict(timings=timings, ciphertext_bytes=ciphertext_bytes, server_bytes=server_bytes,
+                max_error=float(error.max()), mean_error=float(error.mean()))
+
+
+def run_case(num_hospitals: int, shape: Tuple[int, int], backend: str, params: str, ordering: str,
+             warmup: int, repeats: int, seed: int, compaction: str = "none") -> Dict:
+    """Ejecuta warmup + repeats repeticiones de un caso y resume los resultados"""
+    degree, bits, scale_bits = parse_params(params)
+    context = default_store().load_or_create(degree, bits, 2 ** scale_bits)
+    if backend in ("tensor", "auto"):
+        # CKKSTensor exige claves de relinealización incluso para productos por escalar
+        context = default_store().require_relin_keys(context)
+    rng = np.random.default_rng(seed)
+    matrices = [rng.random(shape) for _ in range(num_hospitals)]
+    weights = rng.dirichlet(np.ones(num_hospitals))
+
+    key = case_key(num_hospitals, shape, backend, params, ordering, compaction)
+    # Pico del proceso antes de ejecutar: imports, contexto y datos de entrada
+    baseline_rss = peak_rss_mb()
+    try:
+        for _ in range(warmup):
+            run_once(context, backend, ordering, matrices, weights, compaction)
+        runs = [run_once(context, backend, ordering, matrices, weights, compaction) for _ in range(repeats)]
+    except ValueError as e:
+        # p. ej. "scale out of bounds" cuando los parámetros no admiten la ponderación cifrada
+        return dict(key=key, failed=str(e))
+
+    stages = runs[0]["timings"].keys()
+    timings = {stage: statistics.median(run["timings"][stage] for run in runs) for stage in stages}
+    values = num_hospitals * shape[0] * shape[1]
+    return dict(
+        key=key,
+        num_hospitals=num_hospitals,
+        shape=list(shape),
+        backend=backend,
+        params=params,
+        ordering=ordering,
+        compaction=compaction,
+        repeats=repeats,
+        timings_median_s=timings,
+        total_min_s=min(run["timings"]["total"] for run in runs),
+        throughput_values_per_s=values / timings["total"],
+        ciphertext_bytes_per_hospital=runs[0]["ciphertext_bytes"],
+        server_bytes_per_hospital=runs[0]["server_bytes"],
+        max_error=max(run["max_error"] for run in runs),
+        mean_error=statistics.mean(run["mean_error"] for run in runs),
+        peak_rss_mb=peak_rss_mb(),
+        peak_rss_delta_mb=peak_rss_mb() - baseline_rss,
+    )
+
+
+def run_case_isolated(*args) -> Dict:
+    """run_case en un proceso nuevo, para que peak_rss_mb sea el pico de ese caso.
+
+    ru_maxrss es el máximo de todo el proceso y nunca baja: ejecutados en el mismo proceso,
+    cada caso heredaría el pico de los anteriores.
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_case, args)
+
+
+def case_key(num_hospitals: int, shape: Tuple[int, int], backend: str, params: str, ordering: str,
+             compaction: str = "none") -> str:
+    key = f"h{num_hospitals}/{shape[0]}x{shape[1]}/{backend}/{params}/{ordering}"
+    # Sin compactación la clave no cambia, para seguir comparando con líneas base anteriores
+    return key if compaction == "none" else f"{key}/{compaction}"
+
+
+# ======= Comparación con la línea base =======
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float, error_tolerance: float) -> List[str]:
+    """Devuelve la lista de regresiones frente a la línea base (tiempo total o error)"""
+    previous = {case["key"]: case for case in baseline.get("results", [])}
+    regressions = []
+    for case in results:
+        old = previous.get(case["key"])
+        if old is None or "failed" in old:
+            continue
+        if "failed" in case:
+            regressions.append(f"{case['key']}: failed ({case['failed']})")
+            continue
+        old_time = old["timings_median_s"]["total"]
+        new_time = case["timings_median_s"]["total"]
+        if new_time > old_time * (1 + tolerance):
+            regressions.append(f"{case['key']}: total {old_time:.4f}s -> {new_time:.4f}s")
+        if case["max_error"] > old["max_error"] * (1 + error_tolerance):
+            regressions.append(f"{case['key']}: max_error {old['max_error']:.3e} -> {case['max_error']:.3e}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline ponderación/cifrado/agregación CKKS")
+    parser.add_argument("--hospitals", type=int, nargs="+", default=[2, 10])
+    parser.add_argument("--shapes", type=parse_shape, nargs="+", default=[(8, 8), (448, 448)])
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS) + ["auto"], default=list(BACKENDS))
+    parser.add_argument("--params", nargs="+", default=list(DEFAULT_PARAMS),
+                        help="Conjuntos CKKS como degree:bits,...:scale_bits (el backend bfv sólo usa degree)")
+    parser.add_argument("--orderings", nargs="+", choices=ORDERINGS, default=list(ORDERINGS))
+    parser.add_argument("--compactions", nargs="+", choices=COMPACTIONS, default=["none"],
+                        help="Compactación de la subida; modswitch/seeded sólo se aplican al backend packed")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--in-process", action="store_true",
+                        help="Ejecuta los casos en este proceso (más rápido; peak_rss_mb deja de ser por caso)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con la que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Empeoramiento relativo del tiempo permitido antes de marcar una regresión")
+    parser.add_argument("--error-tolerance", type=float, default=1.0,
+                        help="Empeoramiento relativo del error máximo permitido (el ruido CKKS varía entre ejecuciones)")
+    args = parser.parse_args(argv)
+
+    for spec in args.params:
+        parse_params(spec)
+
+    results = []
+    for num_hospitals, shape, backend, params, ordering, compaction in itertools.product(
+            args.hospitals, args.shapes, args.backends, args.params, args.orderings, args.compactions):
+        if compaction != "none" and backend != "packed":
+            continue
+        execute = run_case if args.in_process else run_case_isolated
+        case = execute(num_hospitals, shape, backend, params, ordering, args.warmup, args.repeats, args.seed,
+                       compaction)
+        results.append(case)
+        if "failed" in case:
+            print(f"{case['key']:<60} FAILED: {case['failed']}")
+            continue
+        print(f"{case['key']:<60} total={case['timings_median_s']['total']:.4f}s "
+              f"thr={case['throughput_values_per_s']:.3e}/s bytes={case['ciphertext_bytes_per_hospital']} "
+              f"server={case['server_bytes_per_hospital']} "
+              f"max_err={case['max_error']:.2e} rss={case['peak_rss_mb']:.0f}MB "
+              f"(+{case['peak_rss_delta_mb']:.0f}MB)")
+
+    report = dict(
+        created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        results=results,
+    )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.error_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
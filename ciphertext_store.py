@@ -0,0 +1,264 @@
+import argparse
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import tenseal as ts
+
+import instrumentation
+from compaction import memory_bytes
+from encrypted_matrix import EncryptedMatrix, PackingLayout
+from error_budget import ErrorBudget
+
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+# Espacio muerto del fichero (entradas borradas o reescritas) que dispara una compactación
+MIN_COMPACTION_BYTES = 64 * 2 ** 20
+
+
+class _Spilled:
+    """Posición en el fichero de los cifrados serializados de una matriz"""
+
+    __slots__ = ("layout", "extents", "budget")
+
+    def __init__(self, layout: PackingLayout, extents: List[Tuple[int, int]], budget: Optional[ErrorBudget]):
+        self.layout = layout
+        self.extents = extents
+        self.budget = budget
+
+    @property
+    def nbytes(self) -> int:
+        return sum(length for _, length in self.extents)
+
+
+class CiphertextStore:
+    """Matrices cifradas por clave con un conjunto LRU acotado en memoria y el resto en disco.
+
+    Las matrices vivas (objetos TenSEAL) ocupan como mucho `memory_budget` bytes; al
+    superarse, las menos usadas se serializan al final de un fichero de volcado y se liberan.
+    get() las vuelve a cargar desde el fichero mapeado en memoria de forma transparente.
+    Una matriz devuelta por get() puede modificarse en sitio (p. ej. el agregador la pondera),
+    así que al expulsarla se vuelve a escribir; pop() la saca del almacén sin escribir nada.
+    """
+
+    def __init__(self, context: Optional[ts.Context] = None, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 directory: Optional[str] = None):
+        if memory_budget <= 0:
+            raise ValueError(f"memory_budget debe ser positivo, recibido {memory_budget}")
+        self.context = context
+        self.memory_budget = memory_budget
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix="ciphertexts-", suffix=".spill")
+        self._file = os.fdopen(fd, "r+b")
+        self._map: Optional[mmap.mmap] = None
+        self._live: "OrderedDict[Hashable, Tuple[EncryptedMatrix, int]]" = OrderedDict()
+        self._spilled: Dict[Hashable, _Spilled] = {}
+        self._lock = threading.RLock()
+        self.live_bytes = 0
+        self.file_bytes = 0
+        self.dead_bytes = 0
+        self.spills = 0
+        self.reloads = 0
+
+    # ======= Acceso =======
+
+    def put(self, key: Hashable, matrix: EncryptedMatrix):
+        """Guarda (o reemplaza) la matriz de `key` como la usada más recientemente"""
+        with self._lock:
+            if self.context is None:
+                self.context = matrix.context
+            self._forget(key)
+            nbytes = memory_bytes(matrix)
+            self._live[key] = (matrix, nbytes)
+            self.live_bytes += nbytes
+            self._evict(keep=key)
+
+    def get(self, key: Hashable) -> EncryptedMatrix:
+        """Devuelve la matriz de `key`, cargándola del disco si estaba volcada"""
+        with self._lock:
+            if key in self._live:
+                self._live.move_to_end(key)
+                return self._live[key][0]
+            if key not in self._spilled:
+                raise KeyError(key)
+            matrix = self._load(self._spilled.pop(key))
+            self.put(key, matrix)
+            return matrix
+
+    def pop(self, key: Hashable) -> EncryptedMatrix:
+        """Saca la matriz del almacén y la devuelve; el llamante pasa a ser su dueño"""
+        with self._lock:
+            if key in self._spilled:
+                # Sale del almacén: se carga sin pasar por el LRU ni expulsar a otra matriz
+                return self._load(self._spilled.pop(key))
+            if key not in self._live:
+                raise KeyError(key)
+            matrix, nbytes = self._live.pop(key)
+            self.live_bytes -= nbytes
+            return matrix
+
+    def __delitem__(self, key: Hashable):
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            self._forget(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._live or key in self._spilled
+
+    def __len__(self) -> int:
+        return len(self._live) + len(self._spilled)
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._live) + list(self._spilled)
+
+    def values(self) -> Iterator[EncryptedMatrix]:
+        """Recorre las matrices de una en una; las ya visitadas pueden volver al disco"""
+        for key in self.keys():
+            if key in self:
+                yield self.get(key)
+
+    # ======= Volcado y carga =======
+
+    def _forget(self, key: Hashable):
+        if key in self._live:
+            self.live_bytes -= self._live.pop(key)[1]
+        spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            self.dead_bytes += spilled.nbytes
+
+    def _evict(self, keep: Hashable):
+        while self.live_bytes > self.memory_budget and len(self._live) > 1:
+            key = next(iter(self._live))
+            if key == keep:
+                self._live.move_to_end(key)
+                continue
+            matrix, nbytes = self._live.pop(key)
+            self.live_bytes -= nbytes
+            self._spilled[key] = self._write(matrix)
+            self.spills += 1
+        if self.dead_bytes > max(MIN_COMPACTION_BYTES, self.file_bytes - self.dead_bytes):
+            self.compact()
+
+    def _write(self, matrix: EncryptedMatrix) -> _Spilled:
+        extents = []
+        self._file.seek(self.file_bytes)
+        for blob in matrix.serialize():
+            self._file.write(blob)
+            extents.append((self.file_bytes, len(blob)))
+            self.file_bytes += len(blob)
+        return _Spilled(matrix.layout, extents, matrix.budget)
+
+    def _mapped(self) -> mmap.mmap:
+        """Mapa de sólo lectura del fichero, rehecho si ha crecido desde el último"""
+        if self._map is None or len(self._map) < self.file_bytes:
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), self.file_bytes, access=mmap.ACCESS_READ)
+        return self._map
+
+    @staticmethod
+    def _release(data: mmap.mmap, spilled: _Spilled):
+        # Las páginas leídas del mapa cuentan en la memoria residente hasta que se descartan
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start = spilled.extents[0][0] // mmap.PAGESIZE * mmap.PAGESIZE
+        end = spilled.extents[-1][0] + spilled.extents[-1][1]
+        data.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def _load(self, spilled: _Spilled) -> EncryptedMatrix:
+        data = self._mapped()
+        with instrumentation.stage(instrumentation.DESERIALIZE, ciphertexts=len(spilled.extents)) as stage:
+            stage.add_bytes(spilled.nbytes)
+            ciphertexts = [ts.ckks_vector_from(self.context, data[offset:offset + length])
+                           for offset, length in spilled.extents]
+        self._release(data, spilled)
+        self.dead_bytes += spilled.nbytes
+        self.reloads += 1
+        return EncryptedMatrix(spilled.layout, ciphertexts, spilled.budget)
+
+    def compact(self):
+        """Reescribe el fichero sólo con las matrices volcadas vigentes"""
+        with self._lock:
+            data = self._mapped() if self.file_bytes else None
+            fd, path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix="ciphertexts-", suffix=".spill")
+            new_file = os.fdopen(fd, "r+b")
+            offset = 0
+            for spilled in self._spilled.values():
+                extents = []
+                for start, length in spilled.extents:
+                    new_file.write(data[start:start + length])
+                    extents.append((offset, length))
+                    offset += length
+                spilled.extents = extents
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+            os.replace(path, self.path)
+            self._file = new_file
+            self.file_bytes = offset
+            self.dead_bytes = 0
+
+    def close(self):
+        """Libera el mapa y borra el fichero de volcado"""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if not self._file.closed:
+                self._file.close()
+                os.unlink(self.path)
+            self._live.clear()
+            self._spilled.clear()
+            self.live_bytes = self.file_bytes = self.dead_bytes = 0
+
+    def __enter__(self) -> "CiphertextStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __repr__(self) -> str:
+        return (f"CiphertextStore(live={len(self._live)}, spilled={len(self._spilled)}, "
+                f"live_bytes={self.live_bytes}, file_bytes={self.file_bytes}, budget={self.memory_budget})")
+
+
+# ======= Agregación de una federación grande con memoria acotada =======
+
+if __name__ == "__main__":
+    from aggregator import EncryptedAggregator
+    from benchmark import peak_rss_mb
+    from keystore import default_store
+
+    parser = argparse.ArgumentParser(description="Cifrado y agregación de muchos hospitales con memoria acotada")
+    parser.add_argument("--hospitals", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=448)
+    parser.add_argument("--cols", type=int, default=448)
+    parser.add_argument("--budget-mb", type=float, default=128)
+    args = parser.parse_args()
+
+    context = default_store().load_or_create(8192, [40, 20, 20, 20, 40], 2 ** 20)
+    rng = np.random.default_rng(0)
+    expected = np.zeros((args.rows, args.cols))
+
+    start = time.perf_counter()
+    with CiphertextStore(context, memory_budget=int(args.budget_mb * 2 ** 20)) as store:
+        for h in range(args.hospitals):
+            data = rng.random((args.rows, args.cols))
+            expected += data / args.hospitals
+            store.put(h, EncryptedMatrix.encrypt(context, data))
+        print(f"Cifrado: {time.perf_counter() - start:.2f} s, {store}")
+
+        aggregator = EncryptedAggregator()
+        for h in range(args.hospitals):
+            aggregator.add(store.pop(h), 1 / args.hospitals)
+        print(f"Total: {time.perf_counter() - start:.2f} s, {store.spills} volcados, {store.reloads} recargas")
+
+    error = np.abs(aggregator.result().decrypt() - expected).max()
+    print(f"Error máximo {error:.2e}, pico de memoria {peak_rss_mb():.0f} MB")
@@ -0,0 +1,145 @@
+import argparse
+import numpy as np
+import tenseal as ts
+import tenseal.sealapi as sealapi
+from typing import List, Optional
+
+import instrumentation
+from encrypted_matrix import EncryptedMatrix, PackingLayout, slot_count
+from seal_io import ckks_vector_from_ciphertext, ckks_vector_proto, seal_bytes
+
+
+def level_parms_id(context: ts.Context, level: int) -> List[int]:
+    """parms_id del nivel `level` de la cadena de módulos (0 = último primo de datos)"""
+    seal_context = context.seal_context().data
+    data = seal_context.first_context_data()
+    if not 0 <= level <= data.chain_index():
+        raise ValueError(f"Nivel {level} fuera de la cadena de módulos (0..{data.chain_index()})")
+    while data.chain_index() > level:
+        data = data.next_context_data()
+    return data.parms_id()
+
+
+def memory_bytes(matrix: EncryptedMatrix) -> int:
+    """Memoria que ocupan los cifrados de la matriz: size * primos * N coeficientes de 8 bytes"""
+    total = 0
+    for vec in matrix.ciphertexts:
+        ciphertext = vec.ciphertext()[0]
+        total += ciphertext.size() * ciphertext.coeff_modulus_size() * ciphertext.poly_modulus_degree() * 8
+    return total
+
+
+def mod_switch(matrix: EncryptedMatrix, level: int = 0) -> EncryptedMatrix:
+    """Baja todos los cifrados al nivel `level` descartando primos (sin reescalar).
+
+    El valor y la escala no cambian; sólo se pierde la capacidad de hacer más productos.
+    Funciona con el contexto público, así que puede aplicarlo cualquier hospital.
+    """
+    if level > matrix.level:
+        raise ValueError(f"No se puede subir del nivel {matrix.level} al {level}")
+    context = matrix.context
+    evaluator = sealapi.Evaluator(context.seal_context().data)
+    parms_id = level_parms_id(context, level)
+    ciphertexts = []
+    for vec in matrix.ciphertexts:
+        ciphertext = vec.ciphertext()[0]
+        evaluator.mod_switch_to_inplace(ciphertext, parms_id)
+        ciphertexts.append(ckks_vector_from_ciphertext(context, ciphertext, vec.size()))
+    budget = matrix.budget.mod_switch(level) if matrix.budget is not None else None
+    return EncryptedMatrix(matrix.layout, ciphertexts, budget)
+
+
+class CompactUpload:
+    """Cifrados de una matriz serializados para subir: nivel bajo y, si hay clave secreta, con semilla.
+
+    Los blobs tienen el formato de CKKSVector.serialize(), así que el servidor los carga con
+    ts.ckks_vector_from, wire_format o AggregationServer sin cambios.
+    """
+
+    def __init__(self, layout: PackingLayout, scale: float, level: int, ciphertexts: List[bytes]):
+        self.layout = layout
+        self.scale = scale
+        self.level = level
+        self.ciphertexts = ciphertexts
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(blob) for blob in self.ciphertexts)
+
+    def to_matrix(self, context: ts.Context) -> EncryptedMatrix:
+        """Carga en el servidor: SEAL regenera la componente con semilla al deserializar"""
+        return EncryptedMatrix.from_serialized(context, self.layout, self.ciphertexts)
+
+    def __repr__(self) -> str:
+        return (f"CompactUpload(shape={self.layout.shape}, level={self.level}, "
+                f"num_ciphertexts={len(self.ciphertexts)}, nbytes={self.nbytes})")
+
+
+def encrypt_compact(context: ts.Context, matrix: np.ndarray, level: int = 0,
+                    weight: Optional[float] = None) -> CompactUpload:
+    """Cifra (y opcionalmente pondera en claro) una matriz directamente en el nivel `level`.
+
+    `level` es el número de productos que todavía hará el servidor (0 si sólo suma). Con
+    la clave secreta en el contexto se cifra de forma simétrica con semilla: la segunda
+    componente del cifrado se sustituye por la semilla del generador y el tamaño se reduce
+    a la mitad. Sin clave secreta se cifra con la clave pública y se baja de nivel.
+    La escala global tiene que dejar margen en los primos que quedan: con [40, 20, ...]
+    y escala 2**20 en el nivel 0, la suma agregada debe ser menor que 2**19.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.ndim != 2:
+        raise ValueError(f"Se esperaba una matriz 2D, recibida forma {matrix.shape}")
+    if weight is not None:
+        matrix = matrix * weight
+    if not context.has_secret_key():
+        compacted = mod_switch(EncryptedMatrix.encrypt(context, matrix), level)
+        return CompactUpload(compacted.layout, compacted.scale, level, compacted.serialize())
+
+    slots = slot_count(context)
+    layout = PackingLayout(matrix.shape[0], matrix.shape[1], slots)
+    seal_context = context.seal_context().data
+    encoder = sealapi.CKKSEncoder(seal_context)
+    encryptor = sealapi.Encryptor(seal_context, context.secret_key().data)
+    parms_id = level_parms_id(context, level)
+    scale = context.global_scale
+
+    blobs = []
+    for chunk in layout.pack(matrix):
+        plain = sealapi.Plaintext()
+        with instrumentation.stage(instrumentation.ENCODE):
+            # Réplica periódica del bloque en todos los slots, como hace ts.ckks_vector
+            encoder.encode(np.resize(chunk, slots).tolist(), parms_id, scale, plain)
+        with instrumentation.stage(instrumentation.ENCRYPT, ciphertexts=1):
+            seeded = encryptor.encrypt_symmetric(plain)
+        blobs.append(ckks_vector_proto(seal_bytes(seeded), len(chunk), scale))
+    return CompactUpload(layout, scale, level, blobs)
+
+
+# ======= Comparación de tamaños =======
+
+if __name__ == "__main__":
+    from keystore import default_store
+
+    parser = argparse.ArgumentParser(description="Tamaño de subida y memoria del servidor con y sin compactación")
+    parser.add_argument("--rows", type=int, default=448)
+    parser.add_argument("--cols", type=int, default=448)
+    parser.add_argument("--level", type=int, default=0)
+    args = parser.parse_args()
+
+    context = default_store().load_or_create(8192, [40, 20, 20, 20, 40], 2 ** 20)
+    data = np.random.rand(args.rows, args.cols)
+    fresh = EncryptedMatrix.encrypt(context, data)
+    switched = mod_switch(EncryptedMatrix.encrypt(context, data), args.level)
+    upload = encrypt_compact(context, data, args.level)
+    loaded = upload.to_matrix(context)
+
+    rows = [
+        ("cifrado nuevo", sum(len(b) for b in fresh.serialize()), memory_bytes(fresh), fresh),
+        (f"cambio a nivel {args.level}", sum(len(b) for b in switched.serialize()), memory_bytes(switched), switched),
+        (f"semilla, nivel {args.level}", upload.nbytes, memory_bytes(loaded), loaded),
+    ]
+    base_upload, base_memory = rows[0][1], rows[0][2]
+    for name, upload_bytes, server_bytes, matrix in rows:
+        error = np.abs(matrix.decrypt() - data).max()
+        print(f"{name:20s} subida {upload_bytes / 2**20:7.2f} MiB ({base_upload / upload_bytes:4.1f}x)  "
+              f"servidor {server_bytes / 2**20:7.2f} MiB ({base_memory / server_bytes:4.1f}x)  error {error:.2e}")
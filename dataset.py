@@ -0,0 +1,117 @@
+import json
+import os
+import pickle
+import tempfile
+import numpy as np
+import tenseal as ts
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from encrypted_matrix import EncryptedMatrix, PackingLayout, slot_count
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+
+
+class DatasetStore:
+    """Dataset normalizado en disco: un .npy float64 por hospital y un índice JSON.
+
+    Las matrices se abren como memmap, así que leer un hospital o un bloque de filas sólo
+    trae a memoria las páginas que se usan y el consumo de RAM no depende del tamaño total.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                index = json.load(f)
+            if index.get("version") != INDEX_VERSION:
+                raise ValueError(f"Versión de índice no soportada: {index.get('version')}")
+            self._hospitals: List[Dict] = index["hospitals"]
+        else:
+            self._hospitals = []
+
+    @classmethod
+    def from_pickle(cls, pickle_path: str, directory: str) -> "DatasetStore":
+        """Convierte un data.pkl (lista de matrices normalizadas, una por hospital) al formato del store.
+
+        El pickle tiene que cargarse entero una vez; cada matriz se libera en cuanto se escribe.
+        """
+        with open(pickle_path, "rb") as f:
+            normalized_list = pickle.load(f)
+        store = cls(directory)
+        for h in range(len(normalized_list)):
+            store.append(normalized_list[h])
+            normalized_list[h] = None
+        return store
+
+    @classmethod
+    def open_or_convert(cls, directory: str, pickle_path: Optional[str] = None) -> "DatasetStore":
+        """Abre el store; si aún no existe y se da `pickle_path`, lo crea a partir del pickle"""
+        if not os.path.exists(os.path.join(directory, INDEX_FILE)) and pickle_path is not None:
+            return cls.from_pickle(pickle_path, directory)
+        return cls(directory)
+
+    # ======= Escritura =======
+
+    def _save_index(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(dict(version=INDEX_VERSION, hospitals=self._hospitals), f, indent=2)
+        os.replace(tmp_path, self._index_path)
+
+    def append(self, matrix) -> int:
+        """Añade la matriz de un nuevo hospital y devuelve su índice"""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.ndim != 2:
+            raise ValueError(f"Se esperaba una matriz 2D, recibida forma {matrix.shape}")
+        hospital = len(self._hospitals)
+        file_name = f"hospital_{hospital:05d}.npy"
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".npy.tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, os.path.join(self.directory, file_name))
+        self._hospitals.append(dict(file=file_name, shape=list(matrix.shape)))
+        self._save_index()
+        return hospital
+
+    # ======= Lectura =======
+
+    def __len__(self) -> int:
+        return len(self._hospitals)
+
+    def shape(self, hospital: int) -> Tuple[int, int]:
+        return tuple(self._hospitals[hospital]["shape"])
+
+    def load(self, hospital: int) -> np.ndarray:
+        """Matriz del hospital como memmap de sólo lectura"""
+        path = os.path.join(self.directory, self._hospitals[hospital]["file"])
+        matrix = np.load(path, mmap_mode="r")
+        if list(matrix.shape) != self._hospitals[hospital]["shape"]:
+            raise ValueError(f"{path} tiene forma {matrix.shape} y el índice declara {self.shape(hospital)}")
+        return matrix
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for hospital in range(len(self)):
+            yield self.load(hospital)
+
+    def iter_row_blocks(self, hospital: int, rows_per_block: int) -> Iterator[Tuple[int, np.ndarray]]:
+        """Genera (fila inicial, bloque) leyendo del disco sólo las filas de cada bloque"""
+        matrix = self.load(hospital)
+        for start in range(0, matrix.shape[0], rows_per_block):
+            yield start, np.array(matrix[start:start + rows_per_block])
+
+    def iter_slot_chunks(self, hospital: int, layout: PackingLayout) -> Iterator[np.ndarray]:
+        """Bloques listos para codificar, en el orden del layout, leídos del memmap bajo demanda"""
+        matrix = self.load(hospital)
+        if matrix.shape != layout.shape:
+            raise ValueError(f"El hospital {hospital} tiene forma {matrix.shape} y el layout {layout.shape}")
+        for chunk in layout.pack(matrix):
+            yield np.asarray(chunk)
+
+    def encrypt(self, context: ts.Context, hospital: int, weight: Optional[float] = None) -> EncryptedMatrix:
+        """Cifra (y opcionalmente pondera) la matriz de un hospital bloque a bloque desde el disco"""
+        rows, cols = self.shape(hospital)
+        layout = PackingLayout(rows, cols, slot_count(context))
+        return EncryptedMatrix.encrypt_chunks(context, layout, self.iter_slot_chunks(hospital, layout), weight)
@@ -0,0 +1,364 @@
+import math
+from contextlib import contextmanager
+import numpy as np
+import tenseal as ts
+import tenseal.sealapi as sealapi
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import instrumentation
+from error_budget import ErrorBudget, fresh_budget
+from instrumentation import metrics
+from seal_io import ckks_vector_from_ciphertext
+
+
+def slot_count(context: ts.Context) -> int:
+    """Devuelve el número de slots CKKS disponibles en cada cifrado del contexto"""
+    parms = context.seal_context().data.first_context_data().parms()
+    return parms.poly_modulus_degree() // 2
+
+
+@contextmanager
+def auto_rescale_disabled(context: ts.Context):
+    """Desactiva temporalmente el reescalado automático del contexto"""
+    previous = context.auto_rescale
+    context.auto_rescale = False
+    try:
+        yield context
+    finally:
+        context.auto_rescale = previous
+
+
+def weighted_sums(groups: Sequence[Sequence[ts.CKKSVector]], weights: Sequence[float]) -> List[ts.CKKSVector]:
+    """Combinaciones lineales sum_h weights[h] * group[h] de cada grupo con un único reescalado.
+
+    Cada peso se codifica una sola vez para todos los grupos, a la escala del primo q que
+    descarta el reescalado: los productos quedan a escala scale * q, se acumulan sin
+    reescalar y el reescalado final por q devuelve la suma exactamente a la escala de
+    entrada, sin el sesgo de fijar global_scale. Consume un nivel y no modifica las entradas.
+    """
+    if not groups or not groups[0]:
+        raise ValueError("No hay cifrados que sumar")
+    for group in groups:
+        if len(group) != len(weights):
+            raise ValueError(f"Se recibieron {len(group)} cifrados y {len(weights)} pesos")
+    context = groups[0][0].context()
+    seal_context = context.seal_context().data
+    first = groups[0][0].ciphertext()[0]
+    parms_id, scale = first.parms_id(), first.scale
+    data = seal_context.get_context_data(parms_id)
+    if data.chain_index() == 0:
+        raise ValueError("La cadena de módulos está agotada: la suma ponderada necesita un primo para reescalar")
+    prime = data.parms().coeff_modulus()[-1].value()
+
+    encoder = sealapi.CKKSEncoder(seal_context)
+    evaluator = sealapi.Evaluator(seal_context)
+    plains = []
+    with instrumentation.stage(instrumentation.ENCODE):
+        for weight in weights:
+            plain = sealapi.Plaintext()
+            encoder.encode(float(weight), parms_id, float(prime), plain)
+            plains.append(plain)
+
+    results = []
+    for group in groups:
+        total = None
+        for vec, plain in zip(group, plains):
+            ciphertext = vec.ciphertext()[0]
+            if ciphertext.parms_id() != parms_id or ciphertext.scale != scale:
+                raise ValueError("Todos los cifrados deben estar en el mismo nivel y con la misma escala")
+            with instrumentation.stage(instrumentation.PLAIN_MULTIPLY, ciphertexts=1):
+                evaluator.multiply_plain_inplace(ciphertext, plain)
+            if total is None:
+                total = ciphertext
+            else:
+                with instrumentation.stage(instrumentation.ADD, ciphertexts=1):
+                    evaluator.add_inplace(total, ciphertext)
+        with instrumentation.stage(instrumentation.RESCALE, ciphertexts=1):
+            evaluator.rescale_to_next_inplace(total)
+        # scale * q / q: igual a la escala de entrada salvo redondeo en coma flotante
+        total.scale = scale
+        results.append(ckks_vector_from_ciphertext(context, total, group[0].size()))
+    return results
+
+
+def weighted_sum(ciphertexts: Sequence[ts.CKKSVector], weights: Sequence[float]) -> ts.CKKSVector:
+    """Combinación lineal sum_h weights[h] * ciphertexts[h] con un único reescalado (ver weighted_sums)"""
+    return weighted_sums([ciphertexts], weights)[0]
+
+
+class PackingLayout:
+    """Mapa fila/columna -> (cifrado, slot) de una matriz empaquetada en vectores CKKS"""
+
+    def __init__(self, num_rows: int, num_cols: int, slots: int):
+        if num_rows <= 0 or num_cols <= 0:
+            raise ValueError(f"Forma de matriz no válida: ({num_rows}, {num_cols})")
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.slots = slots
+
+        if num_cols <= slots:
+            # Varias filas completas por cifrado
+            self.rows_per_ciphertext = min(slots // num_cols, num_rows)
+            self.segments_per_row = 1
+            self.num_ciphertexts = math.ceil(num_rows / self.rows_per_ciphertext)
+        else:
+            # Filas más anchas que un cifrado: cada fila ocupa varios segmentos
+            self.rows_per_ciphertext = 1
+            self.segments_per_row = math.ceil(num_cols / slots)
+            self.num_ciphertexts = num_rows * self.segments_per_row
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (self.num_rows, self.num_cols)
+
+    def locate(self, row: int, col: int) -> Tuple[int, int]:
+        """Devuelve (índice de cifrado, slot) donde vive el elemento (row, col)"""
+        if not (0 <= row < self.num_rows and 0 <= col < self.num_cols):
+            raise IndexError(f"Posición ({row}, {col}) fuera de la matriz {self.shape}")
+        if self.segments_per_row == 1:
+            index, offset = divmod(row, self.rows_per_ciphertext)
+            return index, offset * self.num_cols + col
+        segment, slot = divmod(col, self.slots)
+        return row * self.segments_per_row + segment, slot
+
+    def chunk_lengths(self) -> List[int]:
+        """Número de slots ocupados por cada cifrado"""
+        if self.segments_per_row == 1:
+            full, rest = divmod(self.num_rows, self.rows_per_ciphertext)
+            lengths = [self.rows_per_ciphertext * self.num_cols] * full
+            if rest:
+                lengths.append(rest * self.num_cols)
+            return lengths
+        last = self.num_cols - (self.segments_per_row - 1) * self.slots
+        return ([self.slots] * (self.segments_per_row - 1) + [last]) * self.num_rows
+
+    def pack(self, matrix: np.ndarray) -> List[np.ndarray]:
+        """Divide la matriz en bloques contiguos, uno por cifrado"""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.shape != self.shape:
+            raise ValueError(f"Se esperaba una matriz {self.shape}, recibida {matrix.shape}")
+        if self.segments_per_row == 1:
+            flat = matrix.reshape(-1)
+            step = self.rows_per_ciphertext * self.num_cols
+            return [flat[i:i + step] for i in range(0, flat.size, step)]
+        return [
+            matrix[row, start:start + self.slots]
+            for row in range(self.num_rows)
+            for start in range(0, self.num_cols, self.slots)
+        ]
+
+    def unpack(self, chunks: Sequence[Sequence[float]]) -> np.ndarray:
+        """Reconstruye la matriz (rows, cols) a partir de los bloques descifrados"""
+        if len(chunks) != self.num_ciphertexts:
+            raise ValueError(f"Se esperaban {self.num_ciphertexts} bloques, recibidos {len(chunks)}")
+        lengths = self.chunk_lengths()
+        flat = np.concatenate([
+            np.asarray(chunk, dtype=np.float64)[:length] for chunk, length in zip(chunks, lengths)
+        ])
+        return flat.reshape(self.shape)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PackingLayout) and (
+            (self.num_rows, self.num_cols, self.slots) == (other.num_rows, other.num_cols, other.slots)
+        )
+
+    def __repr__(self) -> str:
+        return (f"PackingLayout(shape={self.shape}, slots={self.slots}, "
+                f"rows_per_ciphertext={self.rows_per_ciphertext}, "
+                f"num_ciphertexts={self.num_ciphertexts})")
+
+
+class EncryptedMatrix:
+    """Matriz cifrada con varias filas empaquetadas en cada CKKSVector.
+
+    `budget` (ErrorBudget) sigue el nivel, la escala y la cota de error sin descifrar. Lo
+    fijan encrypt() y las operaciones; es None si el origen de los cifrados es desconocido
+    (p. ej. from_serialized sin presupuesto), y entonces no se propaga.
+    """
+
+    def __init__(self, layout: PackingLayout, ciphertexts: List[ts.CKKSVector],
+                 budget: Optional[ErrorBudget] = None):
+        if len(ciphertexts) != layout.num_ciphertexts:
+            raise ValueError(f"El layout requiere {layout.num_ciphertexts} cifrados, recibidos {len(ciphertexts)}")
+        self.layout = layout
+        self.ciphertexts = ciphertexts
+        self.budget = budget
+
+    @classmethod
+    def encrypt(cls, context: ts.Context, matrix: np.ndarray) -> "EncryptedMatrix":
+        """Cifra una matriz (rows, cols) empaquetando tantas filas como quepan en cada cifrado"""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.ndim != 2:
+            raise ValueError(f"Se esperaba una matriz 2D, recibida forma {matrix.shape}")
+        layout = PackingLayout(matrix.shape[0], matrix.shape[1], slot_count(context))
+        with instrumentation.stage(instrumentation.PACK):
+            chunks = [chunk.tolist() for chunk in layout.pack(matrix)]
+        with instrumentation.stage(instrumentation.ENCRYPT, ciphertexts=len(chunks)):
+            ciphertexts = [ts.ckks_vector(context, chunk) for chunk in chunks]
+        return cls(layout, ciphertexts, fresh_budget(context, matrix))
+
+    @classmethod
+    def encrypt_chunks(cls, context: ts.Context, layout: PackingLayout, chunks: Iterable[np.ndarray],
+                       weight: Optional[float] = None) -> "EncryptedMatrix":
+        """Cifra los bloques del layout de uno en uno según los produce `chunks` (p. ej. un memmap),
+        sin materializar la matriz en claro completa"""
+        ciphertexts = []
+        value_bound = 0.0
+        for chunk in chunks:
+            with instrumentation.stage(instrumentation.PACK):
+                values = chunk * weight if weight is not None else np.asarray(chunk)
+                value_bound = max(value_bound, float(np.abs(values).max(initial=0.0)))
+                values = values.tolist()
+            with instrumentation.stage(instrumentation.ENCRYPT, ciphertexts=1):
+                ciphertexts.append(ts.ckks_vector(context, values))
+        return cls(layout, ciphertexts, fresh_budget(context, value_bound))
+
+    @classmethod
+    def zeros(cls, context: ts.Context, layout: PackingLayout) -> "EncryptedMatrix":
+        """Crea una matriz cifrada de ceros con el layout dado, a la escala global del contexto"""
+        return cls(layout, [ts.ckks_vector(context, [0.0] * length) for length in layout.chunk_lengths()],
+                   fresh_budget(context, 0.0))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.layout.shape
+
+    @property
+    def context(self) -> ts.Context:
+        return self.ciphertexts[0].context()
+
+    @property
+    def num_ciphertexts(self) -> int:
+        return len(self.ciphertexts)
+
+    @property
+    def scale(self) -> float:
+        """Escala CKKS actual de los cifrados"""
+        return self.ciphertexts[0].ciphertext()[0].scale
+
+    @property
+    def level(self) -> int:
+        """Índice en la cadena de módulos (0 = último nivel, sin más reescalados posibles)"""
+        seal_context = self.context.seal_context().data
+        return seal_context.get_context_data(self.ciphertexts[0].ciphertext()[0].parms_id()).chain_index()
+
+    @property
+    def estimated_error(self) -> Optional[float]:
+        """Cota del error absoluto según el presupuesto, sin descifrar (None si no se conoce)"""
+        return self.budget.max_error if self.budget is not None else None
+
+    def _check_compatible(self, other: "EncryptedMatrix"):
+        if not isinstance(other, EncryptedMatrix):
+            raise TypeError(f"Operación no soportada con {type(other).__name__}")
+        if self.layout != other.layout:
+            raise ValueError(f"Layouts incompatibles: {self.layout} vs {other.layout}")
+
+    def _added_budget(self, other: "EncryptedMatrix") -> Optional[ErrorBudget]:
+        if self.budget is None or other.budget is None:
+            return None
+        return self.budget.add(other.budget)
+
+    def _multiplied_budget(self, scalar: float) -> Optional[ErrorBudget]:
+        """Presupuesto tras el producto; rechaza el reescalado en el último nivel antes de operar"""
+        rescale = self.context.auto_rescale
+        if rescale and self.budget is None and self.level == 0:
+            raise ValueError("La cadena de módulos está agotada: no quedan primos para reescalar")
+        if self.budget is None:
+            return None
+        return self.budget.multiply(scalar, rescale=rescale)
+
+    def __add__(self, other: "EncryptedMatrix") -> "EncryptedMatrix":
+        self._check_compatible(other)
+        with instrumentation.stage(instrumentation.ADD, ciphertexts=self.num_ciphertexts):
+            return EncryptedMatrix(self.layout, [a + b for a, b in zip(self.ciphertexts, other.ciphertexts)],
+                                   self._added_budget(other))
+
+    def add_(self, other: "EncryptedMatrix") -> "EncryptedMatrix":
+        """Suma en sitio, sin copiar los cifrados"""
+        self._check_compatible(other)
+        budget = self._added_budget(other)
+        with instrumentation.stage(instrumentation.ADD, ciphertexts=self.num_ciphertexts):
+            for a, b in zip(self.ciphertexts, other.ciphertexts):
+                a.add_(b)
+        self.budget = budget
+        return self
+
+    __iadd__ = add_
+
+    def _record_rescales(self):
+        # TenSEAL reescala dentro de mul_ cuando auto_rescale está activo
+        if metrics.enabled and self.context.auto_rescale:
+            metrics.record(instrumentation.RESCALE, count=self.num_ciphertexts, ciphertexts=self.num_ciphertexts)
+
+    def __mul__(self, scalar: float) -> "EncryptedMatrix":
+        budget = self._multiplied_budget(scalar)
+        with instrumentation.stage(instrumentation.PLAIN_MULTIPLY, ciphertexts=self.num_ciphertexts):
+            result = EncryptedMatrix(self.layout, [vec * float(scalar) for vec in self.ciphertexts], budget)
+        self._record_rescales()
+        return result
+
+    __rmul__ = __mul__
+
+    def mul_(self, scalar: float) -> "EncryptedMatrix":
+        """Multiplicación por escalar en sitio, sin copiar los cifrados"""
+        budget = self._multiplied_budget(scalar)
+        with instrumentation.stage(instrumentation.PLAIN_MULTIPLY, ciphertexts=self.num_ciphertexts):
+            for vec in self.ciphertexts:
+                vec.mul_(float(scalar))
+        self.budget = budget
+        self._record_rescales()
+        return self
+
+    __imul__ = mul_
+
+    @staticmethod
+    def weighted_sum(matrices: Sequence["EncryptedMatrix"], weights: Sequence[float]) -> "EncryptedMatrix":
+        """Calcula sum_h weights[h] * matrices[h] con weighted_sums: pesos codificados una vez
+        y un reescalado por cifrado"""
+        if len(matrices) != len(weights):
+            raise ValueError(f"Se recibieron {len(matrices)} matrices y {len(weights)} pesos")
+        if not matrices:
+            raise ValueError("No hay matrices que sumar")
+        layout = matrices[0].layout
+        for matrix in matrices[1:]:
+            matrices[0]._check_compatible(matrix)
+        budgets = [matrix.budget for matrix in matrices]
+        budget = ErrorBudget.weighted_sum(budgets, weights) if None not in budgets else None
+        groups = [[matrix.ciphertexts[i] for matrix in matrices] for i in range(layout.num_ciphertexts)]
+        return EncryptedMatrix(layout, weighted_sums(groups, weights), budget)
+
+    def link_context(self, context: ts.Context):
+        """Asocia todos los cifrados a un contexto (p. ej. el privado para descifrar)"""
+        for vec in self.ciphertexts:
+            vec.link_context(context)
+
+    def decrypt(self, secret_key=None) -> np.ndarray:
+        """Descifra y devuelve la matriz como array NumPy (rows, cols)"""
+        with instrumentation.stage(instrumentation.DECRYPT, ciphertexts=self.num_ciphertexts):
+            if secret_key is None:
+                chunks = [vec.decrypt() for vec in self.ciphertexts]
+            else:
+                chunks = [vec.decrypt(secret_key) for vec in self.ciphertexts]
+        return self.layout.unpack(chunks)
+
+    def serialize(self) -> List[bytes]:
+        """Serializa cada cifrado por separado, en el orden del layout"""
+        with instrumentation.stage(instrumentation.SERIALIZE, ciphertexts=self.num_ciphertexts) as stage:
+            blobs = [vec.serialize() for vec in self.ciphertexts]
+            stage.add_bytes(sum(len(blob) for blob in blobs))
+        return blobs
+
+    @classmethod
+    def from_serialized(cls, context: ts.Context, layout: PackingLayout, blobs: Sequence[bytes],
+                        budget: Optional[ErrorBudget] = None) -> "EncryptedMatrix":
+        """Reconstruye una matriz cifrada a partir de sus cifrados serializados.
+
+        El presupuesto de error no viaja con los cifrados: quien lo conozca (p. ej.
+        ErrorBudget.fresh con la cota de valores acordada) puede pasarlo aquí.
+        """
+        with instrumentation.stage(instrumentation.DESERIALIZE, ciphertexts=len(blobs)):
+            ciphertexts = [ts.ckks_vector_from(context, blob) for blob in blobs]
+        return cls(layout, ciphertexts, budget)
+
+    def __repr__(self) -> str:
+        return f"EncryptedMatrix(shape={self.shape}, num_ciphertexts={self.num_ciphertexts})"
@@ -0,0 +1,232 @@
+import argparse
+import time
+import numpy as np
+import tenseal as ts
+import tenseal.sealapi as sealapi
+from typing import Dict, List, Sequence
+
+import instrumentation
+from encrypted_matrix import EncryptedMatrix, PackingLayout
+from seal_io import ckks_vector_from_ciphertext
+
+# Niveles que consume la varianza: (x^2 ó x * 1/n) y después (* 1/n ó cuadrado de la media)
+STATISTICS_DEPTH = 2
+
+
+# ======= Reducciones con rotaciones =======
+
+class _Reducer:
+    """Evaluador SEAL con las claves de Galois del contexto y contador de rotaciones.
+
+    TenSEAL no expone rotaciones sobre CKKSVector, así que se trabaja con los Ciphertext
+    SEAL que hay debajo y el resultado se vuelve a envolver con ckks_vector_from_ciphertext.
+    """
+
+    def __init__(self, context: ts.Context):
+        if not context.has_galois_keys():
+            raise ValueError("Las estadísticas cifradas requieren claves de Galois (context.generate_galois_keys())")
+        self.evaluator = sealapi.Evaluator(context.seal_context().data)
+        self.galois_keys = context.galois_keys().data
+        self.rotations = 0
+
+    def add(self, a, b):
+        result = sealapi.Ciphertext()
+        self.evaluator.add(a, b, result)
+        return result
+
+    def rotate(self, ciphertext, steps: int):
+        result = sealapi.Ciphertext()
+        with instrumentation.stage(instrumentation.ROTATE, ciphertexts=1):
+            self.evaluator.rotate_vector(ciphertext, steps, self.galois_keys, result)
+        self.rotations += 1
+        return result
+
+    def window_sum(self, terms: Dict[int, object], stride: int):
+        """Suma de ventanas sum_g sum_{i < count_g} x_g[j + i * stride] para {count_g: x_g}.
+
+        Se usa window(x, 2m + b, s) = window(x + rot(x, s), m, 2s) + b * rot(x, 2m * s): en
+        cada paso los términos con la misma mitad se suman antes de rotar, así que las
+        rotaciones se comparten entre grupos y cada uno cuesta a lo sumo 2 * log2(count).
+        Sólo los slots j < stride del resultado son válidos.
+        """
+        result = None
+        while terms:
+            halves: Dict[int, object] = {}
+            tails: Dict[int, object] = {}
+            for count, ciphertext in terms.items():
+                half, odd = divmod(count, 2)
+                if odd:
+                    tails[half] = self.add(tails[half], ciphertext) if half in tails else ciphertext
+                if half:
+                    halves[half] = self.add(halves[half], ciphertext) if half in halves else ciphertext
+            for half, ciphertext in tails.items():
+                tail = self.rotate(ciphertext, 2 * half * stride) if half else ciphertext
+                result = tail if result is None else self.add(result, tail)
+            terms = {half: self.add(ciphertext, self.rotate(ciphertext, stride)) for half, ciphertext in halves.items()}
+            stride *= 2
+        return result
+
+
+def _column_reduce(reducer: _Reducer, layouts: Sequence[PackingLayout], chunks: Sequence[Sequence]) -> List:
+    """Sumas por columna de todas las matrices: un Ciphertext por segmento de fila.
+
+    Con varias filas por cifrado, los cifrados con el mismo número de filas se suman
+    primero (sin rotar) y los grupos se reducen juntos: las rotaciones se comparten entre
+    todas las columnas, cifrados y hospitales.
+    """
+    num_cols, segments = layouts[0].num_cols, layouts[0].segments_per_row
+    if segments > 1:
+        sums = [None] * segments
+        for matrix_chunks in chunks:
+            for index, ciphertext in enumerate(matrix_chunks):
+                segment = index % segments
+                sums[segment] = ciphertext if sums[segment] is None else reducer.add(sums[segment], ciphertext)
+        return sums
+
+    groups: Dict[int, object] = {}
+    for layout, matrix_chunks in zip(layouts, chunks):
+        for ciphertext, length in zip(matrix_chunks, layout.chunk_lengths()):
+            rows = length // num_cols
+            groups[rows] = reducer.add(groups[rows], ciphertext) if rows in groups else ciphertext
+    return [reducer.window_sum(groups, num_cols)]
+
+
+# ======= Estadísticas =======
+
+class EncryptedStatistics:
+    """Sumas, medias y varianzas federadas, por columna y globales, sin descifrar nada local.
+
+    Las sumas se guardan cifradas; medias y varianzas se derivan con TenSEAL a partir de ellas.
+    El producto por 1/n se codifica a la escala global, así que su error relativo es del
+    orden de n / global_scale: para muchas filas conviene una escala de 2**40 o mayor.
+    """
+
+    def __init__(self, num_rows: int, num_cols: int, column_sums: EncryptedMatrix, column_squares: EncryptedMatrix,
+                 total: ts.CKKSVector, total_squares: ts.CKKSVector, rotations: int):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.column_sums = column_sums
+        self.column_squares = column_squares
+        self.total = total
+        self.total_squares = total_squares
+        self.rotations = rotations
+
+    @property
+    def num_values(self) -> int:
+        return self.num_rows * self.num_cols
+
+    def column_mean(self) -> EncryptedMatrix:
+        """Media de cada columna como matriz cifrada (1, cols)"""
+        return self.column_sums * (1.0 / self.num_rows)
+
+    def column_variance(self) -> EncryptedMatrix:
+        """Varianza poblacional de cada columna: E[x^2] - E[x]^2"""
+        means = self.column_mean()
+        squares = self.column_squares * (1.0 / self.num_rows)
+        return EncryptedMatrix(means.layout, [
+            square - mean.square() for square, mean in zip(squares.ciphertexts, means.ciphertexts)
+        ])
+
+    def mean(self) -> ts.CKKSVector:
+        """Media global de todos los valores"""
+        return self.total * (1.0 / self.num_values)
+
+    def variance(self) -> ts.CKKSVector:
+        """Varianza poblacional global"""
+        return self.total_squares * (1.0 / self.num_values) - self.mean().square()
+
+
+def _check_matrices(matrices: Sequence[EncryptedMatrix]):
+    if not matrices:
+        raise ValueError("No hay matrices de las que calcular estadísticas")
+    first = matrices[0]
+    for matrix in matrices[1:]:
+        if matrix.layout.num_cols != first.layout.num_cols or matrix.layout.slots != first.layout.slots:
+            raise ValueError(f"Layouts incompatibles: {first.layout} vs {matrix.layout}")
+        if matrix.level != first.level or matrix.scale != first.scale:
+            raise ValueError("Todas las matrices deben estar en el mismo nivel y con la misma escala")
+    if first.level < STATISTICS_DEPTH:
+        raise ValueError(f"Las medias y varianzas consumen {STATISTICS_DEPTH} niveles y las matrices "
+                         f"están en el nivel {first.level}")
+
+
+def compute_statistics(matrices: Sequence[EncryptedMatrix]) -> EncryptedStatistics:
+    """Estadísticas federadas de las matrices cifradas de todos los hospitales.
+
+    Requiere claves de Galois (rotaciones) y de relinealización (cuadrados) en el contexto.
+    El coste en rotaciones es logarítmico en el número de filas por cifrado y en el de
+    columnas, e independiente del número de hospitales.
+    """
+    _check_matrices(matrices)
+    context = matrices[0].context
+    if not context.has_relin_keys():
+        raise ValueError("Las sumas de cuadrados requieren claves de relinealización (context.generate_relin_keys())")
+    reducer = _Reducer(context)
+    layouts = [matrix.layout for matrix in matrices]
+    num_rows = sum(layout.num_rows for layout in layouts)
+    num_cols, slots = layouts[0].num_cols, layouts[0].slots
+
+    chunks = [[vec.ciphertext()[0] for vec in matrix.ciphertexts] for matrix in matrices]
+    squares = [[vec.square().ciphertext()[0] for vec in matrix.ciphertexts] for matrix in matrices]
+    column_sums = _column_reduce(reducer, layouts, chunks)
+    column_squares = _column_reduce(reducer, layouts, squares)
+
+    result_layout = PackingLayout(1, num_cols, slots)
+    lengths = result_layout.chunk_lengths()
+
+    def wrap_columns(ciphertexts) -> EncryptedMatrix:
+        return EncryptedMatrix(result_layout, [
+            ckks_vector_from_ciphertext(context, ciphertext, length)
+            for ciphertext, length in zip(ciphertexts, lengths)
+        ])
+
+    def global_sum(ciphertexts) -> ts.CKKSVector:
+        # Los segmentos de una fila ancha son independientes: cada uno se suma completo
+        terms: Dict[int, object] = {}
+        for ciphertext, length in zip(ciphertexts, lengths):
+            terms[length] = reducer.add(terms[length], ciphertext) if length in terms else ciphertext
+        return ckks_vector_from_ciphertext(context, reducer.window_sum(terms, 1), 1)
+
+    total, total_squares = global_sum(column_sums), global_sum(column_squares)
+    return EncryptedStatistics(num_rows, num_cols, wrap_columns(column_sums), wrap_columns(column_squares),
+                               total, total_squares, reducer.rotations)
+
+
+# ======= Comparación con las estadísticas en claro =======
+
+if __name__ == "__main__":
+    from keystore import default_store
+
+    parser = argparse.ArgumentParser(description="Estadísticas federadas cifradas frente a las calculadas en claro")
+    parser.add_argument("--hospitals", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=448)
+    parser.add_argument("--cols", type=int, default=30)
+    args = parser.parse_args()
+
+    store = default_store()
+    base = store.load_or_create(16384, [60, 40, 40, 40, 60], 2 ** 40)
+    # El contexto con claves de Galois es siempre público: se descifra con la clave del base
+    context = store.require_galois_keys(store.require_relin_keys(base))
+    secret_key = base.secret_key()
+
+    rng = np.random.default_rng()
+    data = [rng.random((args.rows + h, args.cols)) for h in range(args.hospitals)]
+    matrices = [EncryptedMatrix.encrypt(context, matrix) for matrix in data]
+    stacked = np.concatenate(data)
+
+    start = time.perf_counter()
+    stats = compute_statistics(matrices)
+    elapsed = time.perf_counter() - start
+    print(f"Estadísticas cifradas: {elapsed:.3f} s, {stats.rotations} rotaciones "
+          f"para {sum(m.num_ciphertexts for m in matrices)} cifrados")
+
+    checks = [
+        ("suma por columna", stats.column_sums.decrypt(secret_key)[0], stacked.sum(axis=0)),
+        ("media por columna", stats.column_mean().decrypt(secret_key)[0], stacked.mean(axis=0)),
+        ("varianza por columna", stats.column_variance().decrypt(secret_key)[0], stacked.var(axis=0)),
+        ("suma global", stats.total.decrypt(secret_key)[0], stacked.sum()),
+        ("media global", stats.mean().decrypt(secret_key)[0], stacked.mean()),
+        ("varianza global", stats.variance().decrypt(secret_key)[0], stacked.var()),
+    ]
+    for name, encrypted, plain in checks:
+        print(f"{name:22s} error máximo {np.abs(np.asarray(encrypted) - plain).max():.2e}")
@@ -0,0 +1,203 @@
+import argparse
+import math
+import os
+import numpy as np
+import tenseal as ts
+# Registra los tipos de SEAL (seal::Modulus) que devuelve parms().coeff_modulus()
+import tenseal.sealapi  # noqa: F401
+from typing import Optional, Sequence, Tuple, Union
+
+# Constante empírica del error de codificación + cifrado de CKKS: error máximo ~ C * sqrt(N) / scale.
+# Medida con TenSEAL para N entre 4096 y 16384 (C observado entre 55 y 135).
+FRESH_ERROR_CONSTANT = 160.0
+
+# Seguimiento del presupuesto al cifrar, desactivable con HE_ERROR_BUDGET=0
+enabled = os.environ.get("HE_ERROR_BUDGET", "1") not in ("", "0")
+
+
+def rescale_bias(scale: float, prime: int) -> float:
+    """Sesgo relativo de un reescalado: TenSEAL fija la escala a global_scale aunque divida por q"""
+    return abs(scale / prime - 1.0)
+
+
+class ErrorBudget:
+    """Nivel, escala y cota analítica del error de una matriz cifrada, sin descifrar.
+
+    Se actualiza con cada suma, producto por escalar y reescalado. El error se separa en
+    ruido (independiente entre hospitales: se suma en cuadratura) y sesgo (redondeo de los
+    escalares y sesgo de reescalado: se suma linealmente). value_bound es una cota de
+    |valor| de los datos cifrados, necesaria porque el sesgo es relativo al valor.
+    """
+
+    def __init__(self, primes: Tuple[int, ...], poly_modulus_degree: int, global_scale: float,
+                 level: int, scale: float, value_bound: float, noise: float, bias: float = 0.0):
+        self.primes = primes
+        self.poly_modulus_degree = poly_modulus_degree
+        self.global_scale = global_scale
+        self.level = level
+        self.scale = scale
+        self.value_bound = value_bound
+        self.noise = noise
+        self.bias = bias
+
+    @classmethod
+    def fresh(cls, context: ts.Context, value_bound: float, level: Optional[int] = None,
+              scale: Optional[float] = None) -> "ErrorBudget":
+        """Presupuesto de un cifrado nuevo (por defecto en el nivel superior y a la escala global)"""
+        data = context.seal_context().data.first_context_data()
+        primes = tuple(modulus.value() for modulus in data.parms().coeff_modulus())
+        poly_modulus_degree = data.parms().poly_modulus_degree()
+        level = data.chain_index() if level is None else level
+        scale = context.global_scale if scale is None else scale
+        noise = FRESH_ERROR_CONSTANT * math.sqrt(poly_modulus_degree) / scale
+        return cls(primes, poly_modulus_degree, context.global_scale, level, scale, float(value_bound), noise)
+
+    @property
+    def max_error(self) -> float:
+        """Cota heurística del error absoluto máximo de cualquier slot"""
+        return self.noise + self.bias
+
+    @property
+    def precision_bits(self) -> float:
+        """Bits fraccionarios correctos que cabe esperar: -log2(max_error)"""
+        return -math.log2(self.max_error) if self.max_error > 0 else math.inf
+
+    @property
+    def headroom_bits(self) -> float:
+        """Bits libres entre value_bound * scale y la mitad del módulo del nivel actual.
+
+        Negativo significa que el resultado puede desbordar el módulo y descifrarse como basura.
+        """
+        modulus_bits = sum(math.log2(prime) for prime in self.primes[:self.level + 1]) - 1
+        return modulus_bits - math.log2(max(self.value_bound, 1.0) * self.scale)
+
+    def _derive(self, **changes) -> "ErrorBudget":
+        values = dict(level=self.level, scale=self.scale, value_bound=self.value_bound,
+                      noise=self.noise, bias=self.bias)
+        values.update(changes)
+        return ErrorBudget(self.primes, self.poly_modulus_degree, self.global_scale, **values)
+
+    # ======= Operaciones =======
+
+    def add(self, other: "ErrorBudget") -> "ErrorBudget":
+        """Suma de dos cifrados: TenSEAL baja el de mayor nivel al nivel del otro"""
+        return self._derive(level=min(self.level, other.level),
+                            value_bound=self.value_bound + other.value_bound,
+                            noise=math.hypot(self.noise, other.noise),
+                            bias=self.bias + other.bias)
+
+    def multiply(self, scalar: float, rescale: bool = True) -> "ErrorBudget":
+        """Producto por un escalar codificado a la escala global, con o sin reescalado.
+
+        Con rescale=True consume un primo: falla con ValueError si la cadena está agotada.
+        """
+        scalar = abs(float(scalar))
+        value_bound = self.value_bound * scalar
+        # El escalar se redondea a un entero de la escala global: error <= 0.5 / global_scale
+        bias = self.bias * scalar + self.value_bound * 0.5 / self.global_scale
+        noise = self.noise * scalar
+        if not rescale:
+            return self._derive(scale=self.scale * self.global_scale, value_bound=value_bound,
+                                noise=noise, bias=bias)
+        if self.level == 0:
+            raise ValueError("La cadena de módulos está agotada: no quedan primos para reescalar")
+        prime = self.primes[self.level]
+        # El reescalado añade un error de redondeo del orden de un cifrado nuevo
+        noise += FRESH_ERROR_CONSTANT * math.sqrt(self.poly_modulus_degree) / self.global_scale
+        bias += value_bound * rescale_bias(self.scale, prime)
+        return self._derive(level=self.level - 1, scale=self.global_scale, value_bound=value_bound,
+                            noise=noise, bias=bias)
+
+    def mod_switch(self, level: int) -> "ErrorBudget":
+        """Bajada de nivel sin reescalar: el valor, la escala y el error no cambian"""
+        if level > self.level:
+            raise ValueError(f"No se puede subir del nivel {self.level} al {level}")
+        return self._derive(level=level)
+
+    @staticmethod
+    def weighted_sum(budgets: Sequence["ErrorBudget"], weights: Sequence[float]) -> "ErrorBudget":
+        """Presupuesto de sum_h weights[h] * x_h con los pesos a la escala del primo q que se
+        descarta y un único reescalado: la escala vuelve a la de entrada, sin sesgo"""
+        result = None
+        for budget, weight in zip(budgets, weights):
+            if budget.level == 0:
+                raise ValueError("La cadena de módulos está agotada: no quedan primos para reescalar")
+            weight = abs(float(weight))
+            prime = budget.primes[budget.level]
+            term = budget._derive(value_bound=budget.value_bound * weight, noise=budget.noise * weight,
+                                  bias=budget.bias * weight + budget.value_bound * 0.5 / prime)
+            result = term if result is None else result.add(term)
+        noise = result.noise + FRESH_ERROR_CONSTANT * math.sqrt(result.poly_modulus_degree) / result.scale
+        return result._derive(level=result.level - 1, noise=noise)
+
+    def check(self, target_max_error: float):
+        """Lanza ValueError si la cota de error supera el objetivo o el valor desborda el módulo"""
+        if self.headroom_bits < 0:
+            raise ValueError(f"El valor puede desbordar el módulo del nivel {self.level} "
+                             f"({self.headroom_bits:.1f} bits de margen)")
+        if self.max_error > target_max_error:
+            raise ValueError(f"Error estimado {self.max_error:.2e} mayor que el objetivo {target_max_error:.2e}")
+
+    def __repr__(self) -> str:
+        return (f"ErrorBudget(level={self.level}, scale=2**{math.log2(self.scale):.1f}, "
+                f"value_bound={self.value_bound:.3g}, max_error={self.max_error:.2e}, "
+                f"headroom_bits={self.headroom_bits:.1f})")
+
+
+def fresh_budget(context: ts.Context, values: Union[float, np.ndarray]) -> Optional[ErrorBudget]:
+    """ErrorBudget.fresh para la ruta de cifrado, con la cota de |values|.
+
+    Devuelve None si el seguimiento está desactivado o si no puede calcularse (p. ej. un
+    contexto sin datos SEAL accesibles): la contabilidad nunca impide cifrar.
+    """
+    if not enabled:
+        return None
+    try:
+        return ErrorBudget.fresh(context, float(np.abs(values).max(initial=0.0)))
+    except (TypeError, ValueError, RuntimeError):
+        return None
+
+
+# ======= Cota estimada frente a error medido =======
+
+if __name__ == "__main__":
+    from aggregator import EncryptedAggregator
+    from encrypted_matrix import EncryptedMatrix
+    from keystore import default_store
+
+    parser = argparse.ArgumentParser(description="Cota de error sin descifrar frente al error real de la agregación")
+    parser.add_argument("--hospitals", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--cols", type=int, default=30)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng()
+    data = [rng.random((args.rows, args.cols)) for _ in range(args.hospitals)]
+    weights = rng.random(args.hospitals)
+    weights /= weights.sum()
+    expected = sum(w * m for w, m in zip(weights, data))
+
+    for degree, coeff_mod_bit_sizes, scale_bits in [(8192, [40, 20, 20, 20, 40], 20),
+                                                    (16384, [60, 40, 40, 40, 60], 40)]:
+        context = default_store().load_or_create(degree, coeff_mod_bit_sizes, 2 ** scale_bits)
+        for mode in ("encrypt_then_weight", "weighted_sum"):
+            matrices = [EncryptedMatrix.encrypt(context, matrix) for matrix in data]
+            if mode == "weighted_sum":
+                result = EncryptedMatrix.weighted_sum(matrices, weights)
+            else:
+                aggregator = EncryptedAggregator()
+                for matrix, weight in zip(matrices, weights):
+                    aggregator.add(matrix, weight)
+                result = aggregator.result()
+            error = np.abs(result.decrypt() - expected).max()
+            print(f"{str(coeff_mod_bit_sizes):22s} {mode:20s} estimado {result.budget.max_error:.2e}  "
+                  f"medido {error:.2e}  nivel {result.budget.level}  margen {result.budget.headroom_bits:.0f} bits")
+
+    # Cada producto reescalado consume un primo; el último se rechaza antes de tocar los cifrados
+    matrix = EncryptedMatrix.encrypt(context, data[0])
+    try:
+        while True:
+            matrix.mul_(0.5)
+            print(f"Producto por 0.5: {matrix.budget}")
+    except ValueError as exc:
+        print(f"Rechazado: {exc}")
@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import time
+import numpy as np
+import tenseal as ts
+from typing import Dict, List, Optional, Sequence
+
+import instrumentation
+from encrypted_matrix import EncryptedMatrix, PackingLayout, slot_count
+
+BLOCK_HASH_SIZE = 16
+
+
+def block_hash(chunk: np.ndarray) -> bytes:
+    """Huella del contenido en claro de un bloque (los float64 tal cual)"""
+    return hashlib.blake2b(memoryview(np.ascontiguousarray(chunk, dtype=np.float64)),
+                           digest_size=BLOCK_HASH_SIZE).digest()
+
+
+class MatrixDelta:
+    """Bloques cifrados que cambiaron desde la ronda anterior de un hospital.
+
+    Un bloque es lo que ocupa un cifrado del layout (rows_per_ciphertext filas o un segmento
+    de fila). `full` indica que se envían todos los bloques: primera ronda, cambio de forma
+    o cambio de peso.
+    """
+
+    def __init__(self, layout: PackingLayout, indices: List[int], ciphertexts: List[ts.CKKSVector],
+                 full: bool, hashes: Optional[List[bytes]] = None, weight: Optional[float] = None):
+        if len(indices) != len(ciphertexts):
+            raise ValueError(f"Se recibieron {len(indices)} índices y {len(ciphertexts)} cifrados")
+        if full and len(indices) != layout.num_ciphertexts:
+            raise ValueError(f"Un delta completo requiere {layout.num_ciphertexts} bloques, recibidos {len(indices)}")
+        self.layout = layout
+        self.indices = indices
+        self.ciphertexts = ciphertexts
+        self.full = full
+        self.hashes = hashes
+        self.weight = weight
+
+    @property
+    def num_blocks(self) -> int:
+        return len(self.indices)
+
+    def serialize(self) -> List[bytes]:
+        """Serializa los cifrados de los bloques cambiados, en el orden de `indices`"""
+        with instrumentation.stage(instrumentation.SERIALIZE, ciphertexts=self.num_blocks) as stage:
+            blobs = [vec.serialize() for vec in self.ciphertexts]
+            stage.add_bytes(sum(len(blob) for blob in blobs))
+        return blobs
+
+    @classmethod
+    def from_serialized(cls, context: ts.Context, layout: PackingLayout, indices: Sequence[int],
+                        blobs: Sequence[bytes], full: bool) -> "MatrixDelta":
+        with instrumentation.stage(instrumentation.DESERIALIZE, ciphertexts=len(blobs)):
+            ciphertexts = [ts.ckks_vector_from(context, blob) for blob in blobs]
+        return cls(layout, list(indices), ciphertexts, full)
+
+    def __repr__(self) -> str:
+        return (f"MatrixDelta(shape={self.layout.shape}, blocks={self.num_blocks}/{self.layout.num_ciphertexts}, "
+                f"full={self.full})")
+
+
+# ======= Lado del hospital =======
+
+class IncrementalEncoder:
+    """Recuerda las huellas de los bloques enviados y cifra sólo los que cambian.
+
+    delta() no modifica el estado; commit() lo actualiza una vez que el agregador ha
+    aceptado el delta, de modo que un envío fallido se repite entero en la ronda siguiente.
+    """
+
+    def __init__(self, context: ts.Context):
+        self.context = context
+        self._layout: Optional[PackingLayout] = None
+        self._hashes: Optional[List[bytes]] = None
+        self._weight: Optional[float] = None
+
+    def delta(self, matrix: np.ndarray, weight: Optional[float] = None) -> MatrixDelta:
+        """Cifra (ponderados en claro) los bloques de `matrix` cuyo contenido cambió"""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.ndim != 2:
+            raise ValueError(f"Se esperaba una matriz 2D, recibida forma {matrix.shape}")
+        layout = PackingLayout(matrix.shape[0], matrix.shape[1], slot_count(self.context))
+        chunks = layout.pack(matrix)
+        hashes = [block_hash(chunk) for chunk in chunks]
+        full = self._hashes is None or layout != self._layout or weight != self._weight
+        if full:
+            indices = list(range(len(chunks)))
+        else:
+            indices = [i for i, (new, old) in enumerate(zip(hashes, self._hashes)) if new != old]
+
+        ciphertexts = []
+        for i in indices:
+            with instrumentation.stage(instrumentation.PACK):
+                values = (chunks[i] * weight if weight is not None else chunks[i]).tolist()
+            with instrumentation.stage(instrumentation.ENCRYPT, ciphertexts=1):
+                ciphertexts.append(ts.ckks_vector(self.context, values))
+        return MatrixDelta(layout, indices, ciphertexts, full, hashes, weight)
+
+    def commit(self, delta: MatrixDelta):
+        """Marca el delta como aceptado: sus huellas pasan a ser la referencia"""
+        if delta.hashes is None:
+            raise ValueError("El delta no contiene las huellas de los bloques (¿se deserializó?)")
+        self._layout = delta.layout
+        self._hashes = delta.hashes
+        self._weight = delta.weight
+
+    def reset(self):
+        """Olvida la ronda anterior: el siguiente delta será completo"""
+        self._layout = self._hashes = self._weight = None
+
+
+# ======= Lado del agregador =======
+
+class IncrementalAggregator:
+    """Suma ponderada que se actualiza bloque a bloque con los deltas de los hospitales.
+
+    Guarda la última contribución cifrada de cada hospital por bloque; al llegar un bloque
+    nuevo resta el anterior de la suma y suma el nuevo. Restar exactamente el mismo cifrado
+    cancela también su ruido, así que el error no crece con el número de rondas. A cambio,
+    la memoria es de una matriz cifrada por hospital además de la suma.
+    """
+
+    def __init__(self):
+        self._layout: Optional[PackingLayout] = None
+        self._sum: Optional[List[ts.CKKSVector]] = None
+        self._blocks: Dict[int, List[ts.CKKSVector]] = {}
+        self.blocks_updated = 0
+
+    @property
+    def num_contributions(self) -> int:
+        return len(self._blocks)
+
+    def _check_layout(self, layout: PackingLayout):
+        if self._layout is not None and layout != self._layout:
+            raise ValueError(f"Layouts incompatibles: {self._layout} vs {layout}")
+
+    def apply(self, hospital_id: int, delta: MatrixDelta):
+        """Aplica el delta de un hospital. Toma posesión de sus cifrados"""
+        self._check_layout(delta.layout)
+        blocks = self._blocks.get(hospital_id)
+        if blocks is None and not delta.full:
+            raise ValueError(f"La primera contribución del hospital {hospital_id} debe ser completa")
+        if delta.full and blocks is not None:
+            self.remove(hospital_id)
+            blocks = None
+        self._layout = delta.layout
+
+        if blocks is None:
+            blocks = self._blocks[hospital_id] = list(delta.ciphertexts)
+            if self._sum is None:
+                self._sum = [vec.copy() for vec in blocks]
+            else:
+                with instrumentation.stage(instrumentation.ADD, ciphertexts=len(blocks)):
+                    for total, vec in zip(self._sum, blocks):
+                        total.add_(vec)
+        else:
+            with instrumentation.stage(instrumentation.ADD, ciphertexts=2 * delta.num_blocks):
+                for i, vec in zip(delta.indices, delta.ciphertexts):
+                    self._sum[i].sub_(blocks[i])
+                    self._sum[i].add_(vec)
+                    blocks[i] = vec
+        self.blocks_updated += delta.num_blocks
+
+    def remove(self, hospital_id: int):
+        """Retira toda la contribución de un hospital de la suma"""
+        blocks = self._blocks.pop(hospital_id, None)
+        if blocks is None:
+            raise KeyError(f"El hospital {hospital_id} no ha contribuido")
+        with instrumentation.stage(instrumentation.ADD, ciphertexts=len(blocks)):
+            for total, vec in zip(self._sum, blocks):
+                total.sub_(vec)
+
+    def result(self) -> EncryptedMatrix:
+        """Suma acumulada de la última contribución de cada hospital. La matriz es una copia"""
+        if self._sum is None or not self._blocks:
+            raise RuntimeError("El agregador no ha recibido ninguna contribución")
+        return EncryptedMatrix(self._layout, [vec.copy() for vec in self._sum])
+
+
+# ======= Simulación de rondas =======
+
+if __name__ == "__main__":
+    from keystore import default_store
+
+    parser = argparse.ArgumentParser(description="Agregación incremental frente a reenvío completo por ronda")
+    parser.add_argument("--hospitals", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--cols", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--changed-rows", type=float, default=0.02, help="fracción de filas consecutivas que cambia por ronda")
+    args = parser.parse_args()
+
+    context = default_store().load_or_create(8192, [40, 20, 20, 20, 40], 2 ** 20)
+    rng = np.random.default_rng()
+    data = [rng.random((args.rows, args.cols)) for _ in range(args.hospitals)]
+    weights = rng.random(args.hospitals)
+    weights /= weights.sum()
+
+    encoders = [IncrementalEncoder(context) for _ in range(args.hospitals)]
+    aggregator = IncrementalAggregator()
+    for round_index in range(args.rounds):
+        if round_index:
+            # Cambios agrupados (registros recientes): con filas sueltas al azar casi todos los
+            # bloques de rows_per_ciphertext filas tendrían algún cambio
+            for matrix in data:
+                count = max(1, int(args.changed_rows * args.rows))
+                start = rng.integers(0, args.rows - count + 1)
+                matrix[start:start + count] = rng.random((count, args.cols))
+
+        start = time.perf_counter()
+        uploaded = blocks = 0
+        for h, (encoder, matrix) in enumerate(zip(encoders, data)):
+            delta = encoder.delta(matrix, weights[h])
+            uploaded += sum(len(blob) for blob in delta.serialize())
+            blocks += delta.num_blocks
+            aggregator.apply(h, delta)
+            encoder.commit(delta)
+        incremental_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        full_bytes = 0
+        for h, matrix in enumerate(data):
+            full = EncryptedMatrix.encrypt(context, matrix * weights[h])
+            full_bytes += sum(len(blob) for blob in full.serialize())
+        full_time = time.perf_counter() - start
+
+        expected = sum(w * m for w, m in zip(weights, data))
+        error = np.abs(aggregator.result().decrypt() - expected).max()
+        print(f"Ronda {round_index}: {blocks} bloques, {incremental_time:.3f} s, {uploaded / 2**20:.1f} MiB "
+              f"(completo: {full_time:.3f} s, {full_bytes / 2**20:.1f} MiB), error {error:.2e}")
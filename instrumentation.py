@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# Etapas instrumentadas del pipeline
+# PACK: empaquetado en bloques y conversión a listas de Python; ENCODE: codificación CKKS
+# explícita (sealapi). ts.ckks_vector codifica y cifra en una sola llamada: cuenta como ENCRYPT.
+PACK = "pack"
+ENCODE = "encode"
+ENCRYPT = "encrypt"
+PLAIN_MULTIPLY = "plain_multiply"
+ADD = "add"
+ROTATE = "rotate"
+RESCALE = "rescale"
+SERIALIZE = "serialize"
+DESERIALIZE = "deserialize"
+DECRYPT = "decrypt"
+
+
+class StageStats:
+    """Contadores acumulados de una etapa"""
+
+    __slots__ = ("count", "seconds", "bytes", "ciphertexts")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.ciphertexts = 0
+
+    def to_dict(self) -> Dict:
+        return dict(count=self.count, seconds=self.seconds, bytes=self.bytes, ciphertexts=self.ciphertexts)
+
+
+class _Stage:
+    """Context manager que mide una etapa y permite anotar bytes y cifrados producidos"""
+
+    __slots__ = ("metrics", "name", "ciphertexts", "bytes", "start")
+
+    def __init__(self, metrics: "Metrics", name: str, ciphertexts: int):
+        self.metrics = metrics
+        self.name = name
+        self.ciphertexts = ciphertexts
+        self.bytes = 0
+
+    def add_bytes(self, nbytes: int):
+        self.bytes += nbytes
+
+    def __enter__(self) -> "_Stage":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.start,
+                            nbytes=self.bytes, ciphertexts=self.ciphertexts)
+
+
+class _NullStage:
+    """Etapa vacía devuelta cuando la instrumentación está desactivada"""
+
+    __slots__ = ()
+
+    def add_bytes(self, nbytes: int):
+        pass
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Metrics:
+    """Registro de operaciones, tiempos, bytes y cifrados por etapa del pipeline"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._stats: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name: str, ciphertexts: int = 0):
+        """Mide el bloque `with` como una ejecución de la etapa `name`"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, ciphertexts)
+
+    def record(self, name: str, seconds: float = 0.0, count: int = 1, nbytes: int = 0, ciphertexts: int = 0):
+        """Acumula una medida en la etapa `name`"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = StageStats()
+            stats.count += count
+            stats.seconds += seconds
+            stats.bytes += nbytes
+            stats.ciphertexts += ciphertexts
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in sorted(self._stats.items())}
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """Exporta las métricas como JSON; si se da `path` también se escriben a fichero"""
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, path: Optional[str] = None, prefix: str = "he_pipeline") -> str:
+        """Exporta las métricas en formato de texto de Prometheus (p. ej. para el textfile collector)"""
+        snapshot = self.snapshot()
+        lines = []
+        for metric, field, kind, help_text in (
+            ("operations_total", "count", "counter", "Número de operaciones por etapa"),
+            ("seconds_total", "seconds", "counter", "Tiempo acumulado por etapa"),
+            ("bytes_total", "bytes", "counter", "Bytes producidos por etapa"),
+            ("ciphertexts_total", "ciphertexts", "counter", "Cifrados procesados por etapa"),
+        ):
+            name = f"{prefix}_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for stage, stats in snapshot.items():
+                lines.append(f'{name}{{stage="{stage}"}} {stats[field]}')
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            # Escritura atómica para que el colector nunca lea un fichero a medias
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        return text
+
+
+# Registro global, activable con HE_METRICS=1
+metrics = Metrics(enabled=os.environ.get("HE_METRICS", "0") not in ("", "0"))
+
+
+def enable():
+    metrics.enabled = True
+
+
+def disable():
+    metrics.enabled = False
+
+
+def stage(name: str, ciphertexts: int = 0):
+    """Atajo a metrics.stage sobre el registro global"""
+    if not metrics.enabled:
+        return _NULL_STAGE
+    return _Stage(metrics, name, ciphertexts)
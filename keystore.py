@@ -0,0 +1,167 @@
+import hashlib
+import os
+import tempfile
+import tenseal as ts
+import tenseal.sealapi  # registra los tipos SEAL (Modulus) usados por context_parameters
+from typing import List, Optional, Set
+
+DEFAULT_KEYSTORE_DIR = os.environ.get(
+    "HE_KEYSTORE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "normalization_weighting", "keys")
+)
+
+
+def context_parameters(context: ts.Context):
+    """Devuelve (poly_modulus_degree, coeff_mod_bit_sizes, global_scale) de un contexto CKKS"""
+    parms = context.seal_context().data.key_context_data().parms()
+    bit_sizes = [modulus.bit_count() for modulus in parms.coeff_modulus()]
+    return parms.poly_modulus_degree(), bit_sizes, context.global_scale
+
+
+def parameter_key(poly_modulus_degree: int, coeff_mod_bit_sizes: List[int], global_scale: float) -> str:
+    """Identificador estable de un conjunto de parámetros CKKS"""
+    description = f"ckks:{poly_modulus_degree}:{','.join(map(str, coeff_mod_bit_sizes))}:{float(global_scale)!r}"
+    return hashlib.sha256(description.encode()).hexdigest()[:16]
+
+
+class KeyStore:
+    """Caché en disco de contextos TenSEAL indexada por conjunto de parámetros.
+
+    Las claves de Galois y de relinealización no se generan al crear el contexto:
+    sólo cuando una operación las pide con require_galois_keys / require_relin_keys,
+    y a partir de entonces quedan guardadas junto al contexto.
+    """
+
+    def __init__(self, directory: str = DEFAULT_KEYSTORE_DIR):
+        self.directory = directory
+        # TenSEAL crea siempre claves de relinealización; sólo se persisten las que se han pedido
+        self._relin_requested: Set[str] = set()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def path(self, key: str, galois: bool = False) -> str:
+        return os.path.join(self.directory, f"{key}.galois.ctx" if galois else f"{key}.ctx")
+
+    def load_or_create(self, poly_modulus_degree: int, coeff_mod_bit_sizes: List[int],
+                       global_scale: float) -> ts.Context:
+        """Carga el contexto base guardado para estos parámetros o lo crea (sin claves de Galois)"""
+        key = parameter_key(poly_modulus_degree, coeff_mod_bit_sizes, global_scale)
+        path = self.path(key)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                context = ts.context_from(f.read())
+            if context.has_relin_keys():
+                self._relin_requested.add(key)
+            return context
+
+        context = ts.context(
+            ts.SCHEME_TYPE.CKKS,
+            poly_modulus_degree=poly_modulus_degree,
+            coeff_mod_bit_sizes=coeff_mod_bit_sizes
+        )
+        context.global_scale = global_scale
+        self.save(context)
+        return context
+
+    def from_plan(self, plan) -> ts.Context:
+        """Contexto para un CKKSPlan, con las claves que el plan declara necesarias.
+
+        Si el plan necesita claves de Galois el contexto es público (ver require_galois_keys).
+        """
+        context = self.load_or_create(plan.poly_modulus_degree, plan.coeff_mod_bit_sizes, plan.global_scale)
+        if plan.needs_relin_keys:
+            self.require_relin_keys(context)
+        if plan.needs_galois_keys:
+            context = self.require_galois_keys(context)
+        return context
+
+    def _write(self, path: str, data: bytes):
+        """Escritura atómica con permisos 0600 (el fichero contiene la clave secreta)"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def save(self, context: ts.Context):
+        """Guarda el contexto incluida la clave secreta.
+
+        Las claves de Galois (decenas de MB) van en un fichero aparte para que cargar
+        el contexto base siga costando milisegundos. Ese fichero es un contexto público:
+        al serializar con la clave secreta TenSEAL no guarda las claves de Galois y las
+        regenera al cargar, con lo que la caché no ahorraría nada. Un contexto público
+        (el que devuelve require_galois_keys) no sobrescribe el base.
+        """
+        key = parameter_key(*context_parameters(context))
+        path = self.path(key)
+        if context.has_secret_key() or not os.path.exists(path):
+            self._write(path, context.serialize(
+                save_galois_keys=False,
+                save_secret_key=context.has_secret_key(),
+                save_relin_keys=key in self._relin_requested,
+            ))
+        if context.has_galois_keys():
+            self._write(self.path(key, galois=True), context.serialize(
+                save_galois_keys=True, save_secret_key=False, save_relin_keys=context.has_relin_keys()
+            ))
+
+    def require_galois_keys(self, context: ts.Context) -> ts.Context:
+        """Contexto de evaluación público con claves de Galois: cargadas del disco o generadas y persistidas.
+
+        Siempre es público (claves pública, de relinealización y de Galois, sin la secreta),
+        tanto con la caché caliente como fría: TenSEAL ignora las claves de Galois guardadas
+        si el contexto lleva la secreta. Cifra, suma y rota igual; para descifrar se pasa la
+        clave secreta del contexto base, p. ej. matrix.decrypt(base.secret_key()). El
+        contexto recibido no se modifica; los cifrados existentes pueden asociarse al
+        nuevo con link_context.
+        """
+        if context.has_galois_keys() and context.is_public():
+            return context
+        key = parameter_key(*context_parameters(context))
+        path = self.path(key, galois=True)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return ts.context_from(f.read())
+        if not context.has_secret_key():
+            raise ValueError("Generar claves de Galois requiere un contexto con la clave secreta")
+        evaluation = context.copy()
+        if not evaluation.has_galois_keys():
+            evaluation.generate_galois_keys()
+        self.save(evaluation)
+        evaluation.make_context_public()
+        return evaluation
+
+    def require_relin_keys(self, context: ts.Context) -> ts.Context:
+        """Genera y persiste las claves de relinealización si el contexto aún no las tiene"""
+        key = parameter_key(*context_parameters(context))
+        if not context.has_relin_keys():
+            if not context.has_secret_key():
+                raise ValueError("El contexto público no tiene claves de relinealización: pídelas antes "
+                                 "que las de Galois (require_galois_keys(require_relin_keys(context)))")
+            context.generate_relin_keys()
+        if key not in self._relin_requested:
+            self._relin_requested.add(key)
+            # Un contexto público viene de la caché de Galois, que ya guarda estas claves
+            if context.has_secret_key():
+                self.save(context)
+        return context
+
+    def clear(self):
+        """Borra todos los contextos guardados"""
+        for name in os.listdir(self.directory):
+            if name.endswith(".ctx"):
+                os.unlink(os.path.join(self.directory, name))
+
+
+_default_store: Optional[KeyStore] = None
+
+
+def default_store() -> KeyStore:
+    """Almacén compartido en DEFAULT_KEYSTORE_DIR (configurable con HE_KEYSTORE_DIR)"""
+    global _default_store
+    if _default_store is None:
+        _default_store = KeyStore()
+    return _default_store
@@ -0,0 +1,181 @@
+import hashlib
+import hmac
+from typing import Dict, Iterable, List, Set, Tuple
+
+CHUNK_SIZE = 64 * 1024
+
+# Prefijos de dominio: una hoja nunca puede hacerse pasar por un nodo interno
+_LEAF = b"\x00"
+_NODE = b"\x01"
+
+
+def hash_leaf(chunk: bytes) -> bytes:
+    digest = hashlib.sha3_256(_LEAF)
+    digest.update(chunk)
+    return digest.digest()
+
+
+def hash_node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha3_256(_NODE + left + right).digest()
+
+
+def _parent_level(level: List[bytes]) -> List[bytes]:
+    # Un nodo sin pareja sube tal cual al nivel siguiente (no se duplica)
+    parents = [hash_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        parents.append(level[-1])
+    return parents
+
+
+class MerkleTree:
+    """Árbol de Merkle sobre los hashes de bloques de tamaño fijo de un blob"""
+
+    def __init__(self, leaves: List[bytes], length: int, chunk_size: int = CHUNK_SIZE):
+        if not leaves:
+            leaves = [hash_leaf(b"")]
+        self.chunk_size = chunk_size
+        self.length = length
+        self.levels = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            self.levels.append(_parent_level(self.levels[-1]))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, chunk_size: int = CHUNK_SIZE) -> "MerkleTree":
+        view = memoryview(data)
+        leaves = [hash_leaf(view[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+        return cls(leaves, len(data), chunk_size)
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1][0]
+
+    @property
+    def leaves(self) -> List[bytes]:
+        return self.levels[0]
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self.levels[0])
+
+    def proof(self, index: int) -> List[Tuple[bytes, bool]]:
+        """Hermanos desde la hoja `index` hasta la raíz como (hash, hermano_a_la_izquierda)"""
+        if not 0 <= index < self.num_chunks:
+            raise IndexError(f"Bloque {index} fuera de rango (hay {self.num_chunks})")
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append((level[sibling], sibling < index))
+            index //= 2
+        return path
+
+
+def verify_proof(root: bytes, chunk: bytes, proof: List[Tuple[bytes, bool]]) -> bool:
+    """Comprueba un bloque aislado contra la raíz con su prueba de inclusión"""
+    node = hash_leaf(chunk)
+    for sibling, sibling_is_left in proof:
+        node = hash_node(sibling, node) if sibling_is_left else hash_node(node, sibling)
+    return hmac.compare_digest(node, root)
+
+
+def root_from_leaves(leaves: List[bytes]) -> bytes:
+    level = list(leaves) or [hash_leaf(b"")]
+    while len(level) > 1:
+        level = _parent_level(level)
+    return level[0]
+
+
+class MerkleBuilder:
+    """Construye el árbol en streaming: se le pasan los datos a trozos de cualquier tamaño
+    y sólo se guarda un bloque pendiente y los hashes de las hojas"""
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.length = 0
+        self._leaves: List[bytes] = []
+        self._pending = bytearray()
+
+    def update(self, data: bytes):
+        self.length += len(data)
+        view = memoryview(data)
+        if self._pending:
+            take = min(self.chunk_size - len(self._pending), len(view))
+            self._pending += view[:take]
+            view = view[take:]
+            if len(self._pending) < self.chunk_size:
+                return
+            self._leaves.append(hash_leaf(bytes(self._pending)))
+            self._pending.clear()
+        full = len(view) - len(view) % self.chunk_size
+        for i in range(0, full, self.chunk_size):
+            self._leaves.append(hash_leaf(view[i:i + self.chunk_size]))
+        self._pending += view[full:]
+
+    def finalize(self) -> MerkleTree:
+        leaves = list(self._leaves)
+        if self._pending:
+            leaves.append(hash_leaf(bytes(self._pending)))
+        return MerkleTree(leaves, self.length, self.chunk_size)
+
+
+def tree_from_chunks(blobs: Iterable[bytes], chunk_size: int = CHUNK_SIZE) -> MerkleTree:
+    """Árbol sobre la concatenación de `blobs` (p. ej. los cifrados de una subida) sin concatenarlos"""
+    builder = MerkleBuilder(chunk_size)
+    for blob in blobs:
+        builder.update(blob)
+    return builder.finalize()
+
+
+class MerkleVerifier:
+    """Verificación incremental de una transferencia por bloques.
+
+    El emisor envía primero la lista de hashes de las hojas (32 bytes por bloque), que se
+    valida una vez contra la raíz comprometida. Después cada bloque se comprueba en cuanto
+    llega; los bloques corruptos o ausentes se pueden pedir de nuevo uno a uno.
+    """
+
+    def __init__(self, root: bytes, leaves: List[bytes], length: int, chunk_size: int = CHUNK_SIZE):
+        if not hmac.compare_digest(root_from_leaves(leaves), root):
+            raise ValueError("Los hashes de los bloques no corresponden a la raíz comprometida")
+        expected = max(1, -(-length // chunk_size))
+        if len(leaves) != expected:
+            raise ValueError(f"Se esperaban {expected} bloques para {length} bytes, recibidos {len(leaves)}")
+        self.root = root
+        self.leaves = leaves
+        self.length = length
+        self.chunk_size = chunk_size
+        self._chunks: Dict[int, bytes] = {}
+        self.corrupted: Set[int] = set()
+
+    def add_chunk(self, index: int, chunk: bytes) -> bool:
+        """Verifica y guarda el bloque `index`; devuelve False si no coincide con su hash"""
+        if not 0 <= index < len(self.leaves):
+            raise IndexError(f"Bloque {index} fuera de rango (hay {len(self.leaves)})")
+        if not hmac.compare_digest(hash_leaf(chunk), self.leaves[index]):
+            self.corrupted.add(index)
+            return False
+        self.corrupted.discard(index)
+        self._chunks[index] = chunk
+        return True
+
+    def missing(self) -> List[int]:
+        """Bloques que faltan o llegaron corruptos y hay que retransmitir"""
+        return [i for i in range(len(self.leaves)) if i not in self._chunks]
+
+    @property
+    def complete(self) -> bool:
+        return len(self._chunks) == len(self.leaves)
+
+    def assemble(self) -> bytes:
+        """Blob completo y verificado"""
+        missing = self.missing()
+        if missing:
+            raise ValueError(f"Faltan {len(missing)} bloques por recibir o retransmitir: {missing[:10]}")
+        return b"".join(self._chunks[i] for i in range(len(self.leaves)))
+
+
+def iter_chunks(data: bytes, chunk_size: int = CHUNK_SIZE) -> Iterable[Tuple[int, bytes]]:
+    """(índice, bloque) de un blob en el troceado usado por el árbol"""
+    view = memoryview(data)
+    for index, start in enumerate(range(0, len(data), chunk_size)):
+        yield index, bytes(view[start:start + chunk_size])
@@ -1,8 +1,15 @@
 import tenseal as ts
 import numpy as np
-from typing import List, Tuple, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Optional
 import hashlib
+import hmac
 import random
+import threading
+
+import merkle
+from encrypted_matrix import EncryptedMatrix
+from threshold_decryption import KeyShare, PartialDecryption, combine, deal_key_shares, partial_decrypt, threshold_context
 
 class Hospital:
     def __init__(self, id: int):
@@ -13,6 +20,7 @@ class Hospital:
         self.peer_contexts = {}
         self.zkp_commitments = {}  # {hospital_id: commitment}
         self.zkp_nonces = {}       # {hospital_id: nonce}
+        self.threshold_key_share: Optional[KeyShare] = None
     
     def generate_key_share(self):
         """Genera la parte de la clave del hospital y devuelve su contexto público y compromiso ZKP"""
@@ -27,11 +35,13 @@ class Hospital:
         self.public_context = self.context.copy()
         self.public_context.make_context_public()
         
-        commitment, nonce = ZKPProtocol.create_commitment(self.id, self.public_context)
+        # Se serializa una sola vez: el compromiso se calcula sobre los mismos bytes que se envían
+        serialized_context = self.public_context.serialize(save_public_key=True)
+        commitment, nonce = ZKPProtocol.create_commitment_from_bytes(self.id, serialized_context)
         self.zkp_commitments[self.id] = commitment
         self.zkp_nonces[self.id] = nonce
         
-        return self.public_context.serialize(), commitment, nonce
+        return serialized_context, commitment, nonce
     
     def receive_peer_commitment(self, hospital_id: int, commitment: bytes, nonce: int):
         """Almacena el compromiso ZKP de otro hospital"""
@@ -39,8 +49,14 @@ class Hospital:
             self.zkp_commitments[hospital_id] = commitment
             self.zkp_nonces[hospital_id] = nonce
     
-    def verify_peer_key_share(self, hospital_id: int, serialized_context: bytes):
-        """Verifica el compromiso ZKP de otro hospital"""
+    def verify_peer_key_share(self, hospital_id: int, serialized_context: bytes,
+                              cache: Optional["KeyShareCache"] = None):
+        """Verifica el compromiso ZKP de otro hospital.
+
+        El compromiso se comprueba sobre los bytes recibidos, sin deserializar el contexto.
+        Con un KeyShareCache compartido, el hash y el contexto deserializado de cada hospital
+        se calculan una sola vez para todos los verificadores.
+        """
         if hospital_id == self.id:
             return True  # No necesitamos verificar nuestro propio compromiso
         
@@ -49,16 +65,22 @@ class Hospital:
         if hospital_id not in self.zkp_nonces:
             raise ValueError(f"No se encontró nonce para el hospital {hospital_id}")
         
-        peer_context = ts.context_from(serialized_context)
+        cache = cache or KeyShareCache()
         commitment = self.zkp_commitments[hospital_id]
         nonce = self.zkp_nonces[hospital_id]
         
-        if not ZKPProtocol.verify_commitment(hospital_id, peer_context, nonce, commitment):
+        if not hmac.compare_digest(cache.digest(hospital_id, serialized_context, nonce), commitment):
             raise ValueError(f"Fallo en la verificación ZKP para hospital {hospital_id}")
         
-        self.peer_contexts[hospital_id] = peer_context
+        self.peer_contexts[hospital_id] = cache.context(hospital_id, serialized_context)
         return True
     
+    def partial_decrypt_matrix(self, matrix: EncryptedMatrix, participants: List[int]) -> PartialDecryption:
+        """Parte de descifrado de este hospital para todos los cifrados de la matriz"""
+        if self.threshold_key_share is None:
+            raise RuntimeError(f"El hospital {self.id} no tiene parte de la clave umbral")
+        return partial_decrypt(self.threshold_key_share, matrix, participants)
+
     def combine_public_keys(self):
         """Combina las claves públicas de todos los hospitales verificados"""
         if not self.peer_contexts:
@@ -72,34 +94,84 @@ class Hospital:
         return combined_context
 
 class ZKPProtocol:
+    @staticmethod
+    def commitment_from_root(hospital_id: int, root: bytes, length: int, nonce: int) -> bytes:
+        """Compromiso sobre la raíz de Merkle del contexto serializado"""
+        return hashlib.sha3_256(f"{hospital_id}:{length}:".encode() + root + str(nonce).encode()).digest()
+
+    @staticmethod
+    def commitment_digest(hospital_id: int, context_serialized: bytes, nonce: int) -> bytes:
+        """Hash del compromiso: los bytes se trocean en bloques fijos y se resumen en un árbol de Merkle,
+        de modo que cada bloque puede verificarse (y retransmitirse) por separado"""
+        tree = merkle.MerkleTree.from_bytes(context_serialized)
+        return ZKPProtocol.commitment_from_root(hospital_id, tree.root, tree.length, nonce)
+
+    @staticmethod
+    def create_commitment_from_bytes(hospital_id: int, context_serialized: bytes) -> Tuple[bytes, int]:
+        """Crea un compromiso ZKP sobre un contexto ya serializado"""
+        nonce = random.getrandbits(256)
+        return ZKPProtocol.commitment_digest(hospital_id, context_serialized, nonce), nonce
+
     @staticmethod
     def create_commitment(hospital_id: int, context_with_pk: ts.Context) -> Tuple[bytes, int]:
         """Crea un compromiso ZKP para verificación posterior"""
-        context_serialized = context_with_pk.serialize(save_public_key=True)
-        nonce = random.getrandbits(256)
-        data_to_hash = (
-            f"{hospital_id}".encode() + 
-            context_serialized + 
-            str(nonce).encode()
-        )
-        commitment = hashlib.sha3_256(data_to_hash).digest()
-        return commitment, nonce
+        return ZKPProtocol.create_commitment_from_bytes(hospital_id, context_with_pk.serialize(save_public_key=True))
+
+    @staticmethod
+    def verify_serialized(hospital_id: int, context_serialized: bytes, nonce: int, commitment: bytes) -> bool:
+        """Verifica un compromiso ZKP directamente sobre los bytes recibidos"""
+        computed = ZKPProtocol.commitment_digest(hospital_id, context_serialized, nonce)
+        return hmac.compare_digest(computed, commitment)
 
     @staticmethod
     def verify_commitment(hospital_id: int, context_with_pk: ts.Context, nonce: int, commitment: bytes) -> bool:
         """Verifica un compromiso ZKP"""
         context_serialized = context_with_pk.serialize(save_public_key=True)
-        data_to_hash = (
-            f"{hospital_id}".encode() + 
-            context_serialized + 
-            str(nonce).encode()
-        )
-        computed = hashlib.sha3_256(data_to_hash).digest()
-        return computed == commitment
+        return ZKPProtocol.verify_serialized(hospital_id, context_serialized, nonce, commitment)
+
+class KeyShareCache:
+    """Hashes y contextos de las claves compartidas, calculados una sola vez para todos los hospitales.
+
+    Los hashes se indexan por (hospital, nonce) y los contextos por hospital, así que
+    N hospitales verificando N-1 pares cuestan N hashes y N deserializaciones en lugar de N².
+    Cada entrada guarda los bytes de los que salió: si otro verificador presenta bytes
+    distintos para el mismo hospital, la caché lanza ValueError en lugar de devolver el
+    resultado de los primeros. Comparar bytes es mucho más barato que volver a hashearlos.
+    """
+
+    def __init__(self):
+        self._digests: Dict[Tuple[int, int], Tuple[bytes, bytes]] = {}
+        self._contexts: Dict[int, Tuple[bytes, ts.Context]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _check_bytes(hospital_id: int, cached: bytes, serialized_context: bytes):
+        if cached is not serialized_context and cached != serialized_context:
+            raise ValueError(f"Se recibieron dos contextos distintos del hospital {hospital_id}")
+
+    def digest(self, hospital_id: int, serialized_context: bytes, nonce: int) -> bytes:
+        key = (hospital_id, nonce)
+        entry = self._digests.get(key)
+        if entry is None:
+            digest = ZKPProtocol.commitment_digest(hospital_id, serialized_context, nonce)
+            with self._lock:
+                entry = self._digests.setdefault(key, (serialized_context, digest))
+        self._check_bytes(hospital_id, entry[0], serialized_context)
+        return entry[1]
+
+    def context(self, hospital_id: int, serialized_context: bytes) -> ts.Context:
+        entry = self._contexts.get(hospital_id)
+        if entry is None:
+            context = ts.context_from(serialized_context)
+            with self._lock:
+                entry = self._contexts.setdefault(hospital_id, (serialized_context, context))
+        self._check_bytes(hospital_id, entry[0], serialized_context)
+        return entry[1]
 
 class FederatedLearningSystem:
-    def __init__(self, num_hospitals: int, threshold: int = None):
+    def __init__(self, num_hospitals: int, threshold: int = None, max_workers: Optional[int] = None):
         self.num_hospitals = num_hospitals
+        self.max_workers = max_workers
         self.threshold = threshold if threshold else (num_hospitals // 2 + 1)
         self.hospitals = [Hospital(i) for i in range(num_hospitals)]
         self.combined_context = None
@@ -131,15 +203,24 @@ class FederatedLearningSystem:
             raise RuntimeError("No en fase de compartición de claves")
         
         print("\nIniciando verificación de claves compartidas...")
-        for hospital in self.hospitals:
+        cache = KeyShareCache()
+        
+        def verify_all(hospital: Hospital) -> int:
             for h_id, serialized_ctx, _, _ in self.key_shares:
-                try:
-                    if h_id != hospital.id:
-                        hospital.verify_peer_key_share(h_id, serialized_ctx)
-                        print(f"Hospital {hospital.id} verificó con éxito la clave del hospital {h_id}")
-                except ValueError as e:
-                    print(f"Error en verificación: {str(e)}")
-                    raise
+                if h_id != hospital.id:
+                    hospital.verify_peer_key_share(h_id, serialized_ctx, cache)
+            return hospital.id
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Un hash y una deserialización por hospital, en paralelo y antes de las N×N comprobaciones
+            list(executor.map(lambda share: cache.digest(share[0], share[1], share[3]), self.key_shares))
+            list(executor.map(lambda share: cache.context(share[0], share[1]), self.key_shares))
+            try:
+                for h_id in executor.map(verify_all, self.hospitals):
+                    print(f"Hospital {h_id} verificó con éxito las claves de {len(self.key_shares) - 1} hospitales")
+            except ValueError as e:
+                print(f"Error en verificación: {str(e)}")
+                raise
         
         self.phase = "verification"
         print("Verificación de claves completada")
@@ -173,6 +254,26 @@ class FederatedLearningSystem:
             raise RuntimeError("Sistema no está listo para cifrar")
         return ts.ckks_vector(self.combined_context, data.tolist())
     
+    def distribute_threshold_keys(self, context: ts.Context) -> ts.Context:
+        """Reparte la clave secreta de `context` entre los hospitales (umbral t de n).
+
+        Devuelve el contexto público con el que cifrar; la clave secreta completa no
+        debe conservarse después del reparto.
+        """
+        shares = deal_key_shares(context, self.num_hospitals, self.threshold)
+        for hospital, share in zip(self.hospitals, shares):
+            hospital.threshold_key_share = share
+        public_context = context.copy()
+        public_context.make_context_public()
+        return public_context
+    
+    def threshold_decrypt_matrix(self, matrix: EncryptedMatrix, hospital_ids: List[int]) -> np.ndarray:
+        """Descifrado umbral: cada hospital devuelve sus partes de toda la matriz en una sola llamada"""
+        if len(hospital_ids) < self.threshold:
+            raise PermissionError(f"Se necesitan al menos {self.threshold} hospitales para descifrar")
+        partials = [self.hospitals[h_id].partial_decrypt_matrix(matrix, hospital_ids) for h_id in hospital_ids]
+        return combine(matrix, partials, self.threshold)
+    
     def decrypt_data(self, encrypted_data: ts.CKKSVector, hospital_ids: List[int]) -> np.ndarray:
         """Descifrado colaborativo (simplificado)"""
         if len(hospital_ids) < self.threshold:
@@ -196,35 +297,33 @@ if __name__ == "__main__":
     # 2. Verificar claves compartidas
     fl_system.verify_key_shares()
     
-    # 3. Combinar claves públicas
-    fl_system.combine_keys()
+    # 3. Reparto de la clave umbral: el repartidor crea el contexto y sólo se conserva el público
+    dealer_context = threshold_context(THRESHOLD, num_contributions=NUM_HOSPITALS)
+    public_context = fl_system.distribute_threshold_keys(dealer_context)
+    del dealer_context
+    print(f"\nClave repartida entre {NUM_HOSPITALS} hospitales (umbral {THRESHOLD})")
     
     # Generar datos de prueba
     num_rows, num_cols = 2, 2  # Matriz pequeña para prueba
     data_samples = [np.random.rand(num_rows, num_cols) for _ in range(NUM_HOSPITALS)]
     
-    # Cada hospital cifra sus datos
+    # Cada hospital cifra sus datos con el contexto público y se suman cifrados
     print("\n=== Cifrado de datos ===")
-    encrypted_data = []
+    encrypted_sum = None
     for hospital, data in zip(fl_system.hospitals, data_samples):
-        encrypted_matrix = []
-        for row in data:
-            encrypted_row = fl_system.encrypt_data(row)
-            encrypted_matrix.append(encrypted_row)
-        encrypted_data.append(encrypted_matrix)
+        encrypted = EncryptedMatrix.encrypt(public_context, data)
+        encrypted_sum = encrypted if encrypted_sum is None else encrypted_sum.add_(encrypted)
         print(f"Datos del hospital {hospital.id} cifrados correctamente")
     
-    # Ejemplo de descifrado colaborativo
-    print("\n=== Intento de descifrado ===")
+    # Descifrado umbral de la suma: cada hospital aporta su parte, nadie tiene la clave completa
+    print("\n=== Descifrado umbral ===")
+    decrypted = fl_system.threshold_decrypt_matrix(encrypted_sum, [0, 1])
+    print("Descifrado exitoso con 2 hospitales:")
+    print(decrypted)
+    print("\nValor original:", sum(data_samples))
+    print(f"Error máximo: {np.max(np.abs(decrypted - sum(data_samples))):.8f}")
+    
     try:
-        # Intentar descifrar con el umbral requerido de hospitales
-        decrypted_sample = fl_system.decrypt_data(encrypted_data[0][0], [0, 1])
-        print("Descifrado exitoso con 2 hospitales:")
-        print(decrypted_sample)
-        
-        # Verificar contra el valor original
-        print("\nValor original:", data_samples[0][0])
-        error = np.max(np.abs(decrypted_sample - data_samples[0][0]))
-        print(f"Error máximo: {error:.8f}")
+        fl_system.threshold_decrypt_matrix(encrypted_sum, [0])
     except PermissionError as e:
-        print("Error de descifrado:", str(e))
\ No newline at end of file
+        print("Descifrado con 1 hospital rechazado:", str(e))
@@ -1,10 +1,19 @@
+import time
 import tenseal as ts
 import numpy as np
-from typing import Optional
+from typing import Iterable, Iterator, List, Optional, Union
+
+from encrypted_matrix import EncryptedMatrix
+
+ChainItem = Union[ts.CKKSVector, EncryptedMatrix]
 
 class Hospital:
-    def __init__(self, id: int):
+    def __init__(self, id: int, poly_modulus_degree: int = 16384, coeff_mod_bit_sizes: Optional[List[int]] = None,
+                 global_scale: float = 2**75):
         self.id = id
+        self.poly_modulus_degree = poly_modulus_degree
+        self.coeff_mod_bit_sizes = coeff_mod_bit_sizes or [40, 20, 20, 40]
+        self.global_scale = global_scale
         self.context = None
         self.public_context = None
         self.secret_key = None
@@ -13,10 +22,10 @@ class Hospital:
         """Genera par de claves para el hospital"""
         self.context = ts.context(
             ts.SCHEME_TYPE.CKKS,
-            poly_modulus_degree = 16384,
-            coeff_mod_bit_sizes = [40, 20, 20, 40]
+            poly_modulus_degree = self.poly_modulus_degree,
+            coeff_mod_bit_sizes = self.coeff_mod_bit_sizes
         )
-        self.context.global_scale = 2**75
+        self.context.global_scale = self.global_scale
         self.secret_key = self.context.secret_key()
         
         # Contexto público para compartir
@@ -25,16 +34,22 @@ class Hospital:
         
         return self.public_context.serialize()
     
-    def encrypt(self, data: np.ndarray, previous_encrypted: Optional[ts.CKKSVector] = None) -> ts.CKKSVector:
-        """Encripta datos, opcionalmente sobre una encriptación previa"""
+    def encrypt(self, data: np.ndarray, previous_encrypted: Optional[ChainItem] = None) -> ChainItem:
+        """Encripta datos, opcionalmente sobre una encriptación previa.
+
+        Un vector se cifra como CKKSVector y una matriz como EncryptedMatrix. La capa sobre
+        una encriptación previa se añade en memoria, asociando el cifrado recibido al contexto
+        de este hospital (sin serializar ni deserializar); el hospital anterior cede el cifrado.
+        """
         if previous_encrypted is None:
+            data = np.asarray(data, dtype=np.float64)
+            if data.ndim == 2:
+                return EncryptedMatrix.encrypt(self.context, data)
             return ts.ckks_vector(self.context, data.tolist())
-        else:
-            # Creamos un nuevo vector cifrado con el mismo contexto
-            re_encrypted = ts.ckks_vector_from(self.context, previous_encrypted.serialize())
-            return re_encrypted
+        previous_encrypted.link_context(self.context)
+        return previous_encrypted
     
-    def decrypt_layer(self, encrypted_data: ts.CKKSVector): # -> np.ndarray:
+    def decrypt_layer(self, encrypted_data: ChainItem): # -> np.ndarray:
         """Descifra una capa de encriptación"""
         #encrypted_data.link_context(self.context)
         return np.array(encrypted_data.decrypt())
@@ -69,24 +84,42 @@ class ChainEncryptionSystem:
         
         self.chain_encrypted_data = current_encrypted
         return current_encrypted
+
+    def chain_encrypt_stream(self, items: Iterable[np.ndarray]) -> Iterator[ChainItem]:
+        """Encriptación en cadena de un flujo de vectores o matrices, elemento a elemento.
+
+        Es un generador: cada elemento pasa por todos los hospitales en memoria (sin
+        serializar) y se entrega antes de leer el siguiente, así que sólo hay un elemento
+        vivo a la vez. No hay solapamiento entre hospitales: sólo el primero hace trabajo
+        real (cifrar), las capas de los demás son un link_context casi gratuito, y TenSEAL
+        no libera el GIL, así que repartir las etapas en hilos no aceleraría nada. El
+        rendimiento es el del cifrado del primer hospital.
+        """
+        self.encryption_order = [hospital.id for hospital in self.hospitals]
+        for item in items:
+            current_encrypted = None
+            for i, hospital in enumerate(self.hospitals):
+                current_encrypted = hospital.encrypt(item if i == 0 else None, previous_encrypted=current_encrypted)
+            yield current_encrypted
     
-    def chain_decrypt(self, encrypted_data: ts.CKKSVector) -> np.ndarray:
-        """Descifrado en cadena en orden inverso (sin recifrar innecesario)"""
-        current_data = encrypted_data
+    def chain_decrypt(self, encrypted_data: ChainItem) -> np.ndarray:
+        """Descifrado en cadena en orden inverso (sin recifrar innecesario).
+
+        Las capas de los hospitales posteriores al primero sólo asocian el cifrado a su
+        contexto (link_context) y no lo modifican: se retiran sin trabajo, y el descifrado
+        real lo hace el hospital que cifró, con su clave secreta.
+        """
+        origin_id = self.encryption_order[0] if self.encryption_order else self.hospitals[0].id
+        origin = next(hospital for hospital in self.hospitals if hospital.id == origin_id)
 
         print("\nIniciando descifrado en cadena:")
         for i, hospital in enumerate(reversed(self.hospitals)):
-            if isinstance(current_data, ts.CKKSVector):
-                current_data.link_context(hospital.context)
-                decrypted = hospital.decrypt_layer(current_data)
-            else:
-                decrypted = current_data 
-            
-            print(f"Capa {len(self.hospitals)-i} descifrada por Hospital {hospital.id}")
-            current_data = decrypted
-
-        return np.array(current_data)
-
+            if hospital is not origin:
+                print(f"Capa {len(self.hospitals)-i} retirada por Hospital {hospital.id}")
+        encrypted_data.link_context(origin.context)
+        decrypted = origin.decrypt_layer(encrypted_data)
+        print(f"Capa 1 descifrada por Hospital {origin.id}")
+        return decrypted
 
 
 if __name__ == "__main__":
@@ -108,4 +141,15 @@ if __name__ == "__main__":
     
     # 4. Verificar precisión
     error = np.max(np.abs(SAMPLE_DATA - decrypted))
-    print(f"\nError máximo: {error:.10f}")
\ No newline at end of file
+    print(f"\nError máximo: {error:.10f}")
+    
+    # 5. Flujo de matrices, elemento a elemento
+    NUM_ITEMS = 8
+    matrices = [np.random.rand(64, 64) for _ in range(NUM_ITEMS)]
+    start = time.time()
+    encrypted_stream = list(ces.chain_encrypt_stream(iter(matrices)))
+    elapsed = time.time() - start
+    print(f"\nFlujo: {NUM_ITEMS} matrices por {NUM_HOSPITALS} hospitales en {elapsed:.4f} s "
+          f"({NUM_ITEMS / elapsed:.1f} matrices/s)")
+    error = max(np.abs(ces.chain_decrypt(item) - matrix).max() for item, matrix in zip(encrypted_stream, matrices))
+    print(f"Error máximo del flujo: {error:.10f}")
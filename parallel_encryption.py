@@ -0,0 +1,161 @@
+import argparse
+import os
+import time
+import numpy as np
+import tenseal as ts
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import instrumentation
+from encrypted_matrix import EncryptedMatrix, PackingLayout, slot_count
+from error_budget import fresh_budget
+
+# Contexto público deserializado una sola vez en cada proceso trabajador
+_worker_context = None
+
+
+def _init_worker(serialized_context: bytes):
+    """Inicializador del pool: deserializa el contexto público en el trabajador"""
+    global _worker_context
+    _worker_context = ts.context_from(serialized_context)
+
+
+def _encrypt_block(chunks: List[np.ndarray]) -> List[bytes]:
+    """Cifra un bloque de filas empaquetadas y devuelve los cifrados serializados"""
+    return [ts.ckks_vector(_worker_context, chunk.tolist()).serialize() for chunk in chunks]
+
+
+class ParallelEncryptor:
+    """Cifrado de matrices en paralelo por bloques de cifrados con un pool de procesos.
+
+    Con los métodos de arranque spawn/forkserver (macOS, y el de por defecto desde
+    Python 3.14) cada trabajador reimporta el script principal: quien lo use desde un
+    script debe lanzar el trabajo bajo `if __name__ == "__main__":`.
+    """
+
+    def __init__(self, context: ts.Context, max_workers: Optional[int] = None, chunk_size: int = 8):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size debe ser positivo, recibido {chunk_size}")
+        self.context = context
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.slots = slot_count(context)
+        self._executor = None
+
+    def __enter__(self) -> "ParallelEncryptor":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Sólo se envía la clave pública: los trabajadores no necesitan claves secretas ni de Galois
+            serialized = self.context.serialize(
+                save_public_key=True,
+                save_secret_key=False,
+                save_galois_keys=False,
+                save_relin_keys=False,
+            )
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(serialized,),
+            )
+        return self._executor
+
+    def close(self):
+        """Libera el pool de procesos"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _blocks(self, chunks: List[np.ndarray]) -> List[List[np.ndarray]]:
+        return [chunks[i:i + self.chunk_size] for i in range(0, len(chunks), self.chunk_size)]
+
+    def encrypt_serialized_many(self, matrices: Sequence[np.ndarray]) -> List[Tuple[PackingLayout, List[bytes]]]:
+        """Cifra varias matrices (p. ej. una por hospital) repartiendo todos sus bloques entre los trabajadores"""
+        matrices = [np.asarray(matrix, dtype=np.float64) for matrix in matrices]
+        layouts, futures = [], []
+        for matrix in matrices:
+            if matrix.ndim != 2:
+                raise ValueError(f"Se esperaba una matriz 2D, recibida forma {matrix.shape}")
+            layout = PackingLayout(matrix.shape[0], matrix.shape[1], self.slots)
+            layouts.append(layout)
+
+        if self.max_workers == 1:
+            # Camino serie: mismo layout, mismo orden y mismas etapas medidas, sin procesos auxiliares
+            results = []
+            for layout, matrix in zip(layouts, matrices):
+                with instrumentation.stage(instrumentation.PACK):
+                    chunks = [chunk.tolist() for chunk in layout.pack(matrix)]
+                with instrumentation.stage(instrumentation.ENCRYPT, ciphertexts=len(chunks)) as stage:
+                    blobs = [ts.ckks_vector(self.context, chunk).serialize() for chunk in chunks]
+                    stage.add_bytes(sum(len(blob) for blob in blobs))
+                results.append((layout, blobs))
+            return results
+
+        executor = self._get_executor()
+        for layout, matrix in zip(layouts, matrices):
+            futures.append([executor.submit(_encrypt_block, block) for block in self._blocks(layout.pack(matrix))])
+
+        # Los bloques se reensamblan en el orden de envío, no en el de finalización.
+        # Las métricas de los trabajadores no se ven desde aquí: se mide la espera del proceso principal.
+        results = []
+        num_ciphertexts = sum(layout.num_ciphertexts for layout in layouts)
+        with instrumentation.stage(instrumentation.ENCRYPT, ciphertexts=num_ciphertexts) as stage:
+            for layout, matrix_futures in zip(layouts, futures):
+                blobs = [blob for future in matrix_futures for blob in future.result()]
+                stage.add_bytes(sum(len(blob) for blob in blobs))
+                results.append((layout, blobs))
+        return results
+
+    def encrypt_serialized(self, matrix: np.ndarray) -> Tuple[PackingLayout, List[bytes]]:
+        """Cifra una matriz y devuelve su layout y los cifrados serializados"""
+        return self.encrypt_serialized_many([matrix])[0]
+
+    def encrypt_many(self, matrices: Sequence[np.ndarray]) -> List[EncryptedMatrix]:
+        """Cifra varias matrices y las devuelve como EncryptedMatrix ligadas al contexto local,
+        con el mismo presupuesto de error que EncryptedMatrix.encrypt"""
+        matrices = [np.asarray(matrix, dtype=np.float64) for matrix in matrices]
+        if self.max_workers == 1:
+            # Sin procesos auxiliares no hace falta pasar por la serialización
+            return [EncryptedMatrix.encrypt(self.context, matrix) for matrix in matrices]
+        return [
+            EncryptedMatrix.from_serialized(self.context, layout, blobs, fresh_budget(self.context, matrix))
+            for matrix, (layout, blobs) in zip(matrices, self.encrypt_serialized_many(matrices))
+        ]
+
+    def encrypt(self, matrix: np.ndarray) -> EncryptedMatrix:
+        """Cifra una matriz en paralelo"""
+        return self.encrypt_many([matrix])[0]
+
+
+# ======= Cifrado serie frente a paralelo =======
+
+if __name__ == "__main__":
+    from keystore import default_store
+
+    parser = argparse.ArgumentParser(description="Cifrado de las matrices de varios hospitales en serie y en paralelo")
+    parser.add_argument("--hospitals", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=448)
+    parser.add_argument("--cols", type=int, default=448)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    context = default_store().load_or_create(8192, [40, 20, 20, 20, 40], 2 ** 20)
+    data = np.random.rand(args.hospitals, args.rows, args.cols)
+
+    start = time.perf_counter()
+    serial = [EncryptedMatrix.encrypt(context, matrix) for matrix in data]
+    serial_time = time.perf_counter() - start
+
+    with ParallelEncryptor(context, max_workers=args.workers) as encryptor:
+        start = time.perf_counter()
+        parallel = encryptor.encrypt_many(data)
+        parallel_time = time.perf_counter() - start
+        workers = encryptor.max_workers
+
+    error = max(np.abs(matrix.decrypt() - expected).max() for matrix, expected in zip(parallel, data))
+    print(f"Serie: {serial_time:.2f} s, paralelo ({workers} procesos): {parallel_time:.2f} s "
+          f"({serial_time / parallel_time:.1f}x), error máximo {error:.2e}")
@@ -0,0 +1,142 @@
+import math
+import tenseal as ts
+import tenseal.sealapi as sealapi
+from typing import List, Tuple
+
+from encrypted_matrix import PackingLayout
+from error_budget import FRESH_ERROR_CONSTANT, rescale_bias
+
+# Máximo de bits del módulo de coeficientes para 128 bits de seguridad (HomomorphicEncryption.org)
+MAX_COEFF_MODULUS_BITS = {
+    4096: 109,
+    8192: 218,
+    16384: 438,
+    32768: 881,
+}
+
+MIN_PRIME_BITS = 20
+MAX_PRIME_BITS = 60
+
+
+class CKKSPlan:
+    """Parámetros CKKS elegidos por el planificador y estimaciones asociadas"""
+
+    def __init__(self, poly_modulus_degree: int, coeff_mod_bit_sizes: List[int], scale_bits: int,
+                 estimated_max_error: float, needs_galois_keys: bool, needs_relin_keys: bool,
+                 layout: PackingLayout):
+        self.poly_modulus_degree = poly_modulus_degree
+        self.coeff_mod_bit_sizes = coeff_mod_bit_sizes
+        self.scale_bits = scale_bits
+        self.estimated_max_error = estimated_max_error
+        self.needs_galois_keys = needs_galois_keys
+        self.needs_relin_keys = needs_relin_keys
+        self.layout = layout
+
+    @property
+    def global_scale(self) -> float:
+        return 2.0 ** self.scale_bits
+
+    @property
+    def slots(self) -> int:
+        return self.poly_modulus_degree // 2
+
+    @property
+    def num_ciphertexts(self) -> int:
+        """Cifrados necesarios por matriz con empaquetado de filas"""
+        return self.layout.num_ciphertexts
+
+    @property
+    def total_coeff_bits(self) -> int:
+        return sum(self.coeff_mod_bit_sizes)
+
+    def make_context(self) -> ts.Context:
+        """Crea el contexto TenSEAL y genera sólo las claves que el plan necesita"""
+        context = ts.context(
+            ts.SCHEME_TYPE.CKKS,
+            poly_modulus_degree=self.poly_modulus_degree,
+            coeff_mod_bit_sizes=self.coeff_mod_bit_sizes
+        )
+        context.global_scale = self.global_scale
+        if self.needs_galois_keys:
+            context.generate_galois_keys()
+        if self.needs_relin_keys:
+            context.generate_relin_keys()
+        return context
+
+    def __repr__(self) -> str:
+        return (f"CKKSPlan(poly_modulus_degree={self.poly_modulus_degree}, "
+                f"coeff_mod_bit_sizes={self.coeff_mod_bit_sizes}, global_scale=2**{self.scale_bits}, "
+                f"estimated_max_error={self.estimated_max_error:.3e}, "
+                f"galois_keys={self.needs_galois_keys}, relin_keys={self.needs_relin_keys}, "
+                f"ciphertexts_per_matrix={self.num_ciphertexts})")
+
+
+def estimate_max_error(poly_modulus_degree: int, coeff_mod_bit_sizes: List[int], scale_bits: int,
+                       num_hospitals: int, depth: int, max_abs_value: float = 1.0) -> float:
+    """Cota heurística del error absoluto máximo tras agregar num_hospitals contribuciones.
+
+    Los errores de cifrado de cada hospital son independientes y crecen como sqrt(H);
+    cada reescalado añade un error de redondeo del mismo orden que un cifrado nuevo.
+    Además TenSEAL fija la escala a global_scale tras reescalar por un primo q != global_scale,
+    lo que introduce un sesgo relativo |global_scale / q - 1| por cada reescalado.
+    """
+    scale = 2.0 ** scale_bits
+    fresh = FRESH_ERROR_CONSTANT * math.sqrt(poly_modulus_degree) / scale
+    error = fresh * (math.sqrt(num_hospitals) + depth)
+    if depth:
+        primes = sealapi.CoeffModulus.Create(poly_modulus_degree, coeff_mod_bit_sizes)
+        rescale_primes = [prime.value() for prime in primes[1:1 + depth]]
+        bias = sum(rescale_bias(scale, prime) for prime in rescale_primes)
+        error += bias * num_hospitals * max_abs_value
+    return error
+
+
+def plan_parameters(shape: Tuple[int, int], num_hospitals: int, depth: int = 0,
+                    target_max_error: float = 1e-3, max_abs_value: float = 1.0,
+                    needs_rotations: bool = False, needs_relinearization: bool = False) -> CKKSPlan:
+    """Elige el contexto CKKS seguro más pequeño que cumple el error objetivo.
+
+    shape: forma (rows, cols) de cada matriz.
+    depth: número de multiplicaciones encadenadas (cada una consume un primo intermedio).
+    max_abs_value: cota de los valores de entrada; la suma puede llegar a num_hospitals * max_abs_value.
+    needs_rotations / needs_relinearization: si la carga usa rotaciones o productos cifrado x cifrado.
+    """
+    if num_hospitals <= 0:
+        raise ValueError(f"num_hospitals debe ser positivo, recibido {num_hospitals}")
+    if depth < 0:
+        raise ValueError(f"depth no puede ser negativo, recibido {depth}")
+    if target_max_error <= 0:
+        raise ValueError(f"target_max_error debe ser positivo, recibido {target_max_error}")
+
+    # Bits para la parte entera del resultado agregado (más el signo)
+    integer_bits = max(1, math.ceil(math.log2(max_abs_value * num_hospitals + 1))) + 1
+
+    for degree, max_bits in sorted(MAX_COEFF_MODULUS_BITS.items()):
+        for scale_bits in range(MIN_PRIME_BITS, MAX_PRIME_BITS - integer_bits + 1):
+            first_bits = scale_bits + integer_bits
+            # Primo especial >= el mayor de los demás para que el cambio de clave no domine el ruido
+            coeff_mod_bit_sizes = [first_bits] + [scale_bits] * depth + [first_bits]
+            if sum(coeff_mod_bit_sizes) > max_bits:
+                break
+            try:
+                error = estimate_max_error(degree, coeff_mod_bit_sizes, scale_bits, num_hospitals, depth,
+                                           max_abs_value)
+            except RuntimeError:
+                # SEAL no encuentra tantos primos de scale_bits bits congruentes con 1 mod 2N
+                continue
+            if error > target_max_error:
+                continue
+            return CKKSPlan(
+                poly_modulus_degree=degree,
+                coeff_mod_bit_sizes=coeff_mod_bit_sizes,
+                scale_bits=scale_bits,
+                estimated_max_error=error,
+                needs_galois_keys=needs_rotations,
+                needs_relin_keys=needs_relinearization,
+                layout=PackingLayout(shape[0], shape[1], degree // 2),
+            )
+
+    raise ValueError(
+        f"No hay parámetros seguros para depth={depth}, target_max_error={target_max_error} "
+        f"con {num_hospitals} hospitales"
+    )
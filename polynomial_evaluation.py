@@ -0,0 +1,309 @@
+import argparse
+import functools
+import math
+import time
+import numpy as np
+import tenseal as ts
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from encrypted_matrix import EncryptedMatrix
+from parameter_planner import CKKSPlan, plan_parameters
+
+# Coeficientes menores que esto (relativo al mayor) no se evalúan: ahorran multiplicaciones
+# en funciones pares/impares, cuyos coeficientes alternos son ruido numérico
+COEFFICIENT_TOLERANCE = 1e-12
+
+Encrypted = Union[ts.CKKSVector, ts.CKKSTensor]
+
+
+# ======= División de series de Chebyshev =======
+
+def _split(coefficients: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """p = q * T_n + r con grado(r) < n, para grado(p) < 2n.
+
+    Usa T_{n+j} = 2 T_n T_j - T_{n-j}: el cociente es 2 * c_{n+j} (c_n para j = 0) y cada
+    término alto resta su coeficiente de r en la posición 2n - i.
+    """
+    quotient = coefficients[n:].copy()
+    quotient[1:] *= 2
+    remainder = coefficients[:n].copy()
+    for i in range(n + 1, len(coefficients)):
+        remainder[2 * n - i] -= coefficients[i]
+    return quotient, remainder
+
+
+def _trim(coefficients: np.ndarray) -> np.ndarray:
+    tolerance = COEFFICIENT_TOLERANCE * max(1.0, np.abs(coefficients).max(initial=0.0))
+    nonzero = np.flatnonzero(np.abs(coefficients) > tolerance)
+    return coefficients[:nonzero[-1] + 1] if nonzero.size else coefficients[:1]
+
+
+# ======= Recuento simbólico de profundidad =======
+
+class _Counter:
+    def __init__(self):
+        self.nonscalar = 0
+        self.scalar = 0
+
+
+class _Symbolic:
+    """Sustituto de un cifrado que sólo registra su profundidad multiplicativa.
+
+    El motor ejecuta exactamente el mismo código con estos objetos que con cifrados
+    reales, así que la profundidad y las multiplicaciones informadas son las que se usan.
+    """
+
+    def __init__(self, depth: int, counter: _Counter):
+        self.depth = depth
+        self.counter = counter
+
+    def __add__(self, other) -> "_Symbolic":
+        return _Symbolic(max(self.depth, getattr(other, "depth", 0)), self.counter)
+
+    __sub__ = __add__
+
+    def __mul__(self, other) -> "_Symbolic":
+        if isinstance(other, _Symbolic):
+            self.counter.nonscalar += 1
+            return _Symbolic(max(self.depth, other.depth) + 1, self.counter)
+        self.counter.scalar += 1
+        return _Symbolic(self.depth + 1, self.counter)
+
+
+# ======= Motor baby-step giant-step =======
+
+def _add(a, b):
+    """Suma de operandos que pueden ser constantes (float) o cifrados"""
+    if isinstance(a, float):
+        a, b = b, a
+    if isinstance(a, float):
+        return a + b
+    if isinstance(b, float):
+        return a if b == 0.0 else a + b
+    return a + b
+
+
+def _mul(a, b):
+    if isinstance(a, float):
+        a, b = b, a
+    if isinstance(a, float):
+        return a * b
+    if isinstance(b, float):
+        return a if b == 1.0 else a * b
+    return a * b
+
+
+class _Evaluation:
+    """Evaluación de sum_j c_j T_j(y) partiendo p = q * T_{k 2^i} + r hasta grado < k.
+
+    Las potencias pequeñas T_1 .. T_{k-1} (baby steps) se combinan con coeficientes
+    escalares en las hojas; las grandes T_k, T_2k, T_4k, ... (giant steps) se obtienen
+    con T_2n = 2 T_n^2 - 1. Con k ~ sqrt(grado) el número de productos cifrado x cifrado
+    es O(sqrt(grado)). Para grados 2^m - 1 la profundidad sobre y es ceil(log2(grado + 1)) + 1
+    (los coeficientes de las hojas son productos por escalar), y el cambio de intervalo de
+    ChebyshevApproximation._map suma otro nivel salvo en [-1, 1]: 6 para grado 15 y 7 para
+    grado 31. La profundidad exacta de cualquier serie la da ChebyshevApproximation.cost().
+    """
+
+    def __init__(self, y, baby_steps: int):
+        self.baby_steps = baby_steps
+        self._powers: Dict[int, object] = {1: y}
+
+    def power(self, i: int):
+        """T_i(y), calculado bajo demanda con profundidad ceil(log2(i))"""
+        if i not in self._powers:
+            half = i // 2
+            if i % 2 == 0:
+                square = self.power(half) * self.power(half)
+                self._powers[i] = (square + square) - 1.0
+            else:
+                product = self.power(half + 1) * self.power(half)
+                self._powers[i] = (product + product) - self.power(1)
+        return self._powers[i]
+
+    def leaf(self, coefficients: np.ndarray):
+        result = float(coefficients[0])
+        tolerance = COEFFICIENT_TOLERANCE * max(1.0, np.abs(coefficients).max())
+        for j in range(1, len(coefficients)):
+            if abs(coefficients[j]) > tolerance:
+                result = _add(result, _mul(self.power(j), float(coefficients[j])))
+        return result
+
+    def evaluate(self, coefficients: np.ndarray):
+        coefficients = _trim(coefficients)
+        if len(coefficients) <= self.baby_steps:
+            return self.leaf(coefficients)
+        n = self.baby_steps
+        while 2 * n < len(coefficients):
+            n *= 2
+        quotient, remainder = _split(coefficients, n)
+        return _add(_mul(self.evaluate(quotient), self.power(n)), self.evaluate(remainder))
+
+
+def baby_steps_for(degree: int) -> int:
+    """Potencia de 2 cercana a sqrt(grado + 1): equilibra baby steps y productos de las hojas"""
+    return max(2, 2 ** round(math.log2(math.sqrt(degree + 1))))
+
+
+class PolynomialCost:
+    """Profundidad y multiplicaciones que consume evaluar una aproximación"""
+
+    def __init__(self, degree: int, depth: int, nonscalar_multiplications: int, scalar_multiplications: int):
+        self.degree = degree
+        self.depth = depth
+        self.nonscalar_multiplications = nonscalar_multiplications
+        self.scalar_multiplications = scalar_multiplications
+
+    def __repr__(self) -> str:
+        return (f"PolynomialCost(degree={self.degree}, depth={self.depth}, "
+                f"nonscalar_multiplications={self.nonscalar_multiplications}, "
+                f"scalar_multiplications={self.scalar_multiplications})")
+
+
+# ======= Aproximaciones de Chebyshev =======
+
+class ChebyshevApproximation:
+    """Serie de Chebyshev sum_j c_j T_j(y) de una función en el intervalo [a, b].
+
+    y = (2x - a - b) / (b - a) lleva el intervalo a [-1, 1]; fuera de él la aproximación
+    diverge rápidamente, así que el intervalo tiene que cubrir todos los valores cifrados.
+    """
+
+    def __init__(self, coefficients: np.ndarray, interval: Tuple[float, float], name: str = "polynomial",
+                 max_error: Optional[float] = None):
+        low, high = interval
+        if not low < high:
+            raise ValueError(f"Intervalo no válido: {interval}")
+        self.coefficients = _trim(np.asarray(coefficients, dtype=np.float64))
+        self.interval = (float(low), float(high))
+        self.name = name
+        self.max_error = max_error
+
+    @classmethod
+    def fit(cls, func: Callable[[np.ndarray], np.ndarray], interval: Tuple[float, float], degree: int,
+            name: str = "polynomial") -> "ChebyshevApproximation":
+        """Interpola `func` en los nodos de Chebyshev y mide el error máximo en el intervalo"""
+        low, high = interval
+        coefficients = np.polynomial.chebyshev.chebinterpolate(
+            lambda t: func((t * (high - low) + (high + low)) / 2), degree)
+        approximation = cls(coefficients, interval, name)
+        x = np.linspace(low, high, 4097)
+        approximation.max_error = float(np.abs(approximation(x) - func(x)).max())
+        return approximation
+
+    @property
+    def degree(self) -> int:
+        return len(self.coefficients) - 1
+
+    def _map(self, x):
+        # Producto por escalar (un nivel) sólo si el intervalo no es ya [-1, 1]
+        low, high = self.interval
+        alpha, beta = 2.0 / (high - low), -(high + low) / (high - low)
+        return _add(_mul(x, alpha), beta)
+
+    def _evaluate(self, x):
+        evaluation = _Evaluation(self._map(x), baby_steps_for(self.degree))
+        return evaluation.evaluate(self.coefficients)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Evaluación en claro, para comprobar la aproximación"""
+        low, high = self.interval
+        return np.polynomial.chebyshev.chebval((2 * np.asarray(x) - low - high) / (high - low), self.coefficients)
+
+    def cost(self) -> PolynomialCost:
+        """Profundidad y multiplicaciones exactas de evaluate, sin cifrar nada"""
+        counter = _Counter()
+        result = self._evaluate(_Symbolic(0, counter))
+        depth = getattr(result, "depth", 0)
+        return PolynomialCost(self.degree, depth, counter.nonscalar, counter.scalar)
+
+    @property
+    def depth(self) -> int:
+        return self.cost().depth
+
+    def evaluate(self, encrypted: Union[Encrypted, EncryptedMatrix]) -> Union[Encrypted, EncryptedMatrix]:
+        """Evalúa la aproximación sobre un CKKSVector, un CKKSTensor o una EncryptedMatrix.
+
+        Requiere claves de relinealización y `depth` primos intermedios libres en el cifrado.
+        """
+        if isinstance(encrypted, EncryptedMatrix):
+            return EncryptedMatrix(encrypted.layout, [self.evaluate(vec) for vec in encrypted.ciphertexts])
+        if not encrypted.context().has_relin_keys() and self.degree > 1:
+            raise ValueError("Evaluar polinomios cifrados requiere claves de relinealización")
+        result = self._evaluate(encrypted)
+        if isinstance(result, float):
+            # Polinomio constante: cifrado * 0 + c conserva la forma y el nivel
+            return encrypted * 0.0 + result
+        return result
+
+    def plan(self, shape: Tuple[int, int], num_hospitals: int, extra_depth: int = 0, **kwargs) -> CKKSPlan:
+        """Contexto CKKS más pequeño con profundidad suficiente para agregar y evaluar.
+
+        target_max_error se refiere a la entrada: el polinomio lo amplifica aproximadamente
+        por su derivada máxima en el intervalo (unas 500 veces para inverse_sqrt).
+        """
+        return plan_parameters(shape, num_hospitals, depth=self.depth + extra_depth,
+                               needs_relinearization=True, **kwargs)
+
+    def __repr__(self) -> str:
+        error = f", max_error={self.max_error:.2e}" if self.max_error is not None else ""
+        return f"ChebyshevApproximation({self.name}, degree={self.degree}, interval={self.interval}{error})"
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+# Funciones de normalización habituales: (función, intervalo, grado)
+NORMALIZATION_FUNCTIONS: Dict[str, Tuple[Callable, Tuple[float, float], int]] = {
+    "sigmoid": (_sigmoid, (-8.0, 8.0), 15),
+    "tanh": (np.tanh, (-4.0, 4.0), 15),
+    # Recorte suave a [0, 1]; el pico de la derivada limita la precisión cerca de 0 y 1
+    "clip01": (lambda x: np.clip(x, 0.0, 1.0), (-1.0, 2.0), 31),
+    # 1 / std a partir de la varianza cifrada, para varianzas en [0.01, 1]
+    "inverse_sqrt": (lambda x: 1.0 / np.sqrt(x), (0.01, 1.0), 31),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def approximation(name: str) -> ChebyshevApproximation:
+    """Aproximación precalculada (y cacheada) de una de NORMALIZATION_FUNCTIONS"""
+    if name not in NORMALIZATION_FUNCTIONS:
+        raise ValueError(f"Función desconocida {name!r}; disponibles: {sorted(NORMALIZATION_FUNCTIONS)}")
+    func, interval, degree = NORMALIZATION_FUNCTIONS[name]
+    return ChebyshevApproximation.fit(func, interval, degree, name)
+
+
+def depth_report(names: Optional[List[str]] = None) -> str:
+    """Tabla de profundidad y multiplicaciones de las aproximaciones, para dimensionar el contexto"""
+    lines = [f"{'función':14s} {'grado':>5s} {'prof.':>5s} {'mult.':>5s} {'escal.':>6s} {'error máx.':>10s}"]
+    for name in names or sorted(NORMALIZATION_FUNCTIONS):
+        approx = approximation(name)
+        cost = approx.cost()
+        lines.append(f"{name:14s} {cost.degree:5d} {cost.depth:5d} {cost.nonscalar_multiplications:5d} "
+                     f"{cost.scalar_multiplications:6d} {approx.max_error:10.2e}")
+    return "\n".join(lines)
+
+
+# ======= Comprobación frente a la evaluación en claro =======
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluación cifrada de aproximaciones de Chebyshev")
+    parser.add_argument("--function", choices=sorted(NORMALIZATION_FUNCTIONS), default="sigmoid")
+    parser.add_argument("--size", type=int, default=4096)
+    args = parser.parse_args()
+
+    print(depth_report())
+    approx = approximation(args.function)
+    plan = approx.plan((1, args.size), num_hospitals=1, target_max_error=1e-4)
+    print(f"\n{approx}\n{approx.cost()}\n{plan}")
+
+    context = plan.make_context()
+    low, high = approx.interval
+    x = np.random.uniform(low, high, args.size)
+    start = time.perf_counter()
+    result = approx.evaluate(ts.ckks_vector(context, x.tolist()))
+    elapsed = time.perf_counter() - start
+    func = NORMALIZATION_FUNCTIONS[args.function][0]
+    error = np.abs(np.asarray(result.decrypt()) - func(x)).max()
+    print(f"Evaluación cifrada: {elapsed:.3f} s, error máximo frente a la función {error:.2e}")
@@ -0,0 +1,96 @@
+import numpy as np
+import tenseal as ts
+from typing import List, Optional, Sequence, Union
+
+from encrypted_matrix import EncryptedMatrix, PackingLayout
+
+NORMALIZATIONS = (None, "minmax", "zscore")
+
+MatrixStack = Union[np.ndarray, Sequence[np.ndarray], Sequence[Sequence[Sequence[float]]]]
+
+
+def as_stack(matrices: MatrixStack) -> np.ndarray:
+    """Convierte una matriz o una lista de matrices en un array (hospitales, filas, columnas)
+    float64 contiguo. Si ya lo es, no se copia."""
+    stack = np.ascontiguousarray(matrices, dtype=np.float64)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+    if stack.ndim != 3:
+        raise ValueError(f"Se esperaba una matriz o una pila de matrices, recibida forma {stack.shape}")
+    return stack
+
+
+def _reduce_axes(axis: Optional[int]):
+    """Ejes de la pila sobre los que se calculan los estadísticos de cada hospital"""
+    if axis is None:
+        return (1, 2)
+    if axis not in (0, 1):
+        raise ValueError(f"axis debe ser None, 0 (por columna) o 1 (por fila), recibido {axis}")
+    return axis + 1
+
+
+def normalize_and_weight(matrices: MatrixStack, weights: Optional[Sequence[float]] = None,
+                         normalization: Optional[str] = None, axis: Optional[int] = None,
+                         out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Normaliza y pondera la matriz de cada hospital en una sola pasada vectorizada.
+
+    La normalización se calcula por hospital: sobre toda la matriz (axis=None), por columna
+    (axis=0) o por fila (axis=1). Normalización y peso se combinan en un único factor y
+    desplazamiento por hospital, de modo que el resultado es stack * factor + desplazamiento
+    sin arrays intermedios del tamaño de los datos. Con out=stack se trabaja en sitio.
+    """
+    if normalization not in NORMALIZATIONS:
+        raise ValueError(f"Normalización no soportada: {normalization} (disponibles: minmax, zscore)")
+    stack = as_stack(matrices)
+    num_hospitals = stack.shape[0]
+
+    if weights is None:
+        factor = np.ones((num_hospitals, 1, 1))
+    else:
+        factor = np.asarray(weights, dtype=np.float64).reshape(-1, 1, 1).copy()
+        if factor.shape[0] != num_hospitals:
+            raise ValueError(f"Se recibieron {num_hospitals} matrices y {factor.shape[0]} pesos")
+    offset = None
+
+    if normalization is not None:
+        axes = _reduce_axes(axis)
+        if normalization == "minmax":
+            center = stack.min(axis=axes, keepdims=True)
+            spread = stack.max(axis=axes, keepdims=True) - center
+        else:
+            center = stack.mean(axis=axes, keepdims=True)
+            spread = stack.std(axis=axes, keepdims=True)
+        # Las columnas/filas constantes quedan en 0 en lugar de dividir por cero
+        spread[spread == 0] = 1.0
+        factor = factor / spread
+        offset = -center * factor
+
+    if out is None:
+        out = np.empty_like(stack)
+    elif out.shape != stack.shape or out.dtype != np.float64:
+        raise ValueError(f"out debe ser float64 con forma {stack.shape}, recibido {out.dtype} {out.shape}")
+    np.multiply(stack, factor, out=out)
+    if offset is not None:
+        np.add(out, offset, out=out)
+    return out
+
+
+def slot_chunks(matrices: MatrixStack, slots: int) -> List[List[np.ndarray]]:
+    """Bloques listos para codificar de cada hospital: vistas contiguas de la pila, sin copias"""
+    stack = as_stack(matrices)
+    layout = PackingLayout(stack.shape[1], stack.shape[2], slots)
+    return [layout.pack(matrix) for matrix in stack]
+
+
+def encrypt_stack(context: ts.Context, matrices: MatrixStack, weights: Optional[Sequence[float]] = None,
+                  normalization: Optional[str] = None, axis: Optional[int] = None) -> List[EncryptedMatrix]:
+    """Prepara la pila de matrices (normalización + ponderación) y cifra la de cada hospital"""
+    stack = as_stack(matrices)
+    if weights is not None or normalization is not None:
+        stack = normalize_and_weight(stack, weights, normalization, axis)
+    return [EncryptedMatrix.encrypt(context, matrix) for matrix in stack]
+
+
+def plain_weighted_sum(matrices: MatrixStack, weights: Sequence[float]) -> np.ndarray:
+    """Suma ponderada en claro de la pila, como referencia para medir el error"""
+    return np.tensordot(np.asarray(weights, dtype=np.float64), as_stack(matrices), axes=1)
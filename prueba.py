@@ -1,9 +1,7 @@
-import pickle
+from dataset import DatasetStore
 
-file_path = open("/home/enotari/Escritorio/data.pkl", "rb")
+dataset = DatasetStore.open_or_convert("/home/enotari/Escritorio/data", "/home/enotari/Escritorio/data.pkl")
 
-normalized_list = pickle.load(file_path)
-
-for elem in normalized_list[:15]:
-    print(elem)
+for h in range(min(15, len(dataset))):
+    print(dataset.load(h))
     print("-------------------")
@@ -1,34 +1,31 @@
 import time
 import numpy as np
 import tenseal as ts
+from parameter_planner import plan_parameters
+from keystore import default_store
+from preprocessing import normalize_and_weight, plain_weighted_sum
 
 # ======= Configuración inicial =======
 NUM_HOSPITALS =2
 num_rows = 448
 num_cols = 448
+TARGET_MAX_ERROR = 1e-4
 
 # ======= Ponderaciones =======
 weights = np.random.dirichlet(np.ones(NUM_HOSPITALS))
 print(f"WEIGHTS {weights}")
 
 # ======= Contexto común =======
-context = ts.context(
-    ts.SCHEME_TYPE.CKKS,
-    poly_modulus_degree=8192,
-    coeff_mod_bit_sizes=[40, 20, 20, 20, 40]
-)
-context.global_scale = 2**20
-context.generate_galois_keys()
-context.generate_relin_keys()
+# Sólo hay sumas de cifrados (la ponderación es en claro): profundidad 0, sin claves de Galois ni relin
+plan = plan_parameters((num_rows, num_cols), NUM_HOSPITALS, depth=0, target_max_error=TARGET_MAX_ERROR)
+print(f"PLAN {plan}")
+context = default_store().from_plan(plan)
 
 public_context = context.copy()
 public_context.make_context_public()
 
 # ======= Matrices normalizadas =======
-normalized_list = [
-    np.random.rand(num_rows, num_cols).tolist()
-    for _ in range(NUM_HOSPITALS)
-]
+normalized_list = np.random.rand(NUM_HOSPITALS, num_rows, num_cols)
 #print(f"NORMALIZED LIST {normalized_list}")
 
 # ======= TIEMPO TOTAL CIFRADO (ponderación - cifrado - suma) =======
@@ -36,9 +33,7 @@ total_start = time.time()
 
 # ======= Ponderación en claro =======
 plain_sum_start = time.time()
-plain_sum = np.zeros((num_rows, num_cols))
-for h, matrix in enumerate(normalized_list):
-    plain_sum += np.array(matrix) * weights[h]
+plain_sum = plain_weighted_sum(normalized_list, weights)
 plain_sum_end = time.time()
 
 #print(f"PLAIN_SUM {plain_sum}")
@@ -46,11 +41,10 @@ plain_sum_end = time.time()
 # ======= Cifrado de matrices ya ponderadas =======
 encrypt_start = time.time()
 encrypted_data = []
-for h, matrix in enumerate(normalized_list):
+for matrix in normalize_and_weight(normalized_list, weights):
     encrypted_matrix = []
     for row in matrix:
-        weighted_row = [val * weights[h] for val in row]
-        vec = ts.ckks_tensor(public_context, weighted_row)
+        vec = ts.ckks_tensor(public_context, row.tolist())
         encrypted_matrix.append(vec)
     encrypted_data.append(encrypted_matrix)
 encrypt_end = time.time()
@@ -1,89 +1,79 @@
 import time
 import numpy as np
-import tenseal as ts
+from parameter_planner import plan_parameters
+from keystore import default_store
+from parallel_encryption import ParallelEncryptor
+from preprocessing import normalize_and_weight, plain_weighted_sum
 
 # ======= Configuración inicial =======
 NUM_HOSPITALS =2
+NUM_WORKERS = None  # None = todos los núcleos
 num_rows = 448
 num_cols = 448
-
-# ======= Ponderaciones =======
-weights = np.random.dirichlet(np.ones(NUM_HOSPITALS))
-print(f"WEIGHTS {weights}")
-
-# ======= Contexto común =======
-context = ts.context(
-    ts.SCHEME_TYPE.CKKS,
-    poly_modulus_degree=8192,
-    coeff_mod_bit_sizes=[40, 20, 20, 20, 40]
-)
-context.global_scale = 2**20
-context.generate_galois_keys()
-context.generate_relin_keys()
-
-public_context = context.copy()
-public_context.make_context_public()
-
-# ======= Matrices normalizadas =======
-normalized_list = [
-    np.random.rand(num_rows, num_cols).tolist()
-    for _ in range(NUM_HOSPITALS)
-]
-#print(f"NORMALIZED LIST {normalized_list}")
-
-# ======= TIEMPO TOTAL CIFRADO (ponderación - cifrado - suma) =======
-total_start = time.time()
-
-# ======= Ponderación en claro =======
-plain_sum_start = time.time()
-plain_sum = np.zeros((num_rows, num_cols))
-for h, matrix in enumerate(normalized_list):
-    plain_sum += np.array(matrix) * weights[h]
-plain_sum_end = time.time()
-
-#print(f"PLAIN_SUM {plain_sum}")
-
-# ======= Cifrado de matrices ya ponderadas =======
-encrypt_start = time.time()
-encrypted_data = []
-for h, matrix in enumerate(normalized_list):
-    encrypted_matrix = []
-    for row in matrix:
-        weighted_row = [val * weights[h] for val in row]
-        vec = ts.ckks_vector(public_context, weighted_row)
-        encrypted_matrix.append(vec)
-    encrypted_data.append(encrypted_matrix)
-encrypt_end = time.time()
-
-# ======= Suma de matrices cifradas ponderadas =======
-encrypted_sum_start = time.time()
-encrypted_sum = [vec.copy() for vec in encrypted_data[0]]  
-for matrix in encrypted_data[1:]:
-    for i in range(num_rows):
-        encrypted_sum[i] += matrix[i]
-encrypted_sum_end = time.time()
-
-total_end = time.time()
-
-# ======= Desencriptar resultado =======
-for vec in encrypted_sum:
-    vec.link_context(context)  
-decrypted_result = [vec.decrypt() for vec in encrypted_sum]
-decrypted_result_np = np.array(decrypted_result)
-
-#print(f"MATRIZ RESULTANTE {decrypted_result}")
-
-# ======= Comparación con resultado en claro =======
-max_error = np.max(np.abs(decrypted_result_np - plain_sum))
-mean_error = np.mean(np.abs(decrypted_result_np - plain_sum))
-
-print("\n########## RESULTADOS (Ponderar - Cifrar - Sumar) ##########")
-print(f"Tiempo ponderación (en claro):   {plain_sum_end - plain_sum_start:.8f} s")
-print(f"Tiempo cifrado (ya ponderado):   {encrypt_end - encrypt_start:.4f} s")
-print(f"Tiempo suma cifrada:             {encrypted_sum_end - encrypted_sum_start:.4f} s")
-print(f"Tiempo total:                    {total_end - total_start:.4f} s")
-
-print(f"\nMáximo error absoluto:           {max_error:.8f}")
-print(f"Error medio absoluto:            {mean_error:.8f}")
-
-
+TARGET_MAX_ERROR = 1e-4
+
+# Bajo spawn/forkserver (macOS, Python >= 3.14) cada trabajador del pool reimporta este
+# módulo: el trabajo sólo se lanza desde el proceso principal
+if __name__ == "__main__":
+    # ======= Ponderaciones =======
+    weights = np.random.dirichlet(np.ones(NUM_HOSPITALS))
+    print(f"WEIGHTS {weights}")
+
+    # ======= Contexto común =======
+    # Sólo hay sumas de cifrados (la ponderación es en claro): profundidad 0, sin claves de Galois ni relin
+    plan = plan_parameters((num_rows, num_cols), NUM_HOSPITALS, depth=0, target_max_error=TARGET_MAX_ERROR)
+    print(f"PLAN {plan}")
+    context = default_store().from_plan(plan)
+
+    public_context = context.copy()
+    public_context.make_context_public()
+
+    # ======= Matrices normalizadas =======
+    normalized_list = np.random.rand(NUM_HOSPITALS, num_rows, num_cols)
+    #print(f"NORMALIZED LIST {normalized_list}")
+
+    # ======= TIEMPO TOTAL CIFRADO (ponderación - cifrado - suma) =======
+    total_start = time.time()
+
+    # ======= Ponderación en claro =======
+    plain_sum_start = time.time()
+    plain_sum = plain_weighted_sum(normalized_list, weights)
+    plain_sum_end = time.time()
+
+    #print(f"PLAIN_SUM {plain_sum}")
+
+    # ======= Cifrado de matrices ya ponderadas =======
+    encrypt_start = time.time()
+    weighted_list = normalize_and_weight(normalized_list, weights)
+    with ParallelEncryptor(public_context, max_workers=NUM_WORKERS) as encryptor:
+        encrypted_data = encryptor.encrypt_many(weighted_list)
+    encrypt_end = time.time()
+
+    # ======= Suma de matrices cifradas ponderadas =======
+    encrypted_sum_start = time.time()
+    encrypted_sum = encrypted_data[0]
+    for matrix in encrypted_data[1:]:
+        encrypted_sum += matrix
+    encrypted_sum_end = time.time()
+
+    total_end = time.time()
+
+    # ======= Desencriptar resultado =======
+    encrypted_sum.link_context(context)
+    decrypted_result_np = encrypted_sum.decrypt()
+
+    #print(f"MATRIZ RESULTANTE {decrypted_result}")
+
+    # ======= Comparación con resultado en claro =======
+    max_error = np.max(np.abs(decrypted_result_np - plain_sum))
+    mean_error = np.mean(np.abs(decrypted_result_np - plain_sum))
+
+    print("\n########## RESULTADOS (Ponderar - Cifrar - Sumar) ##########")
+    print(f"Tiempo ponderación (en claro):   {plain_sum_end - plain_sum_start:.8f} s")
+    print(f"Tiempo cifrado (ya ponderado):   {encrypt_end - encrypt_start:.4f} s")
+    print(f"Tiempo suma cifrada:             {encrypted_sum_end - encrypted_sum_start:.4f} s")
+    print(f"Tiempo total:                    {total_end - total_start:.4f} s")
+    print(f"Cifrados por hospital:           {encrypted_sum.num_ciphertexts}")
+
+    print(f"\nMáximo error absoluto:           {max_error:.8f}")
+    print(f"Error medio absoluto:            {mean_error:.8f}")
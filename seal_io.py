@@ -0,0 +1,183 @@
+import os
+import struct
+import tempfile
+import threading
+import numpy as np
+import tenseal as ts
+import tenseal.sealapi as sealapi
+from typing import Optional, Sequence, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Serialización binaria de SEAL: cabecera de 16 bytes
+#   magic, tamaño de cabecera, versión mayor, versión menor, modo de compresión, reservado, tamaño total
+SEAL_HEADER = struct.Struct("<HBBBBHQ")
+SEAL_COMPR_NONE = 0
+SEAL_COMPR_ZSTD = 2
+# Plaintext: parms_id, coeff_count, scale
+PLAINTEXT_META = struct.Struct("<4QQd")
+# Ciphertext: parms_id, is_ntt_form, size, poly_modulus_degree, coeff_modulus_size, scale, correction_factor
+CIPHERTEXT_META = struct.Struct("<4Q?QQQdQ")
+DYN_ARRAY_SIZE = struct.Struct("<Q")
+
+
+_buffers = threading.local()
+
+
+def _memory_file() -> Optional[Tuple[int, str]]:
+    """(fd, ruta) de un fichero en memoria (memfd) reutilizado por hilo y proceso, o None sin memfd.
+
+    Se comprueba el pid porque un proceso hijo creado con fork heredaría el del padre.
+    """
+    if not hasattr(os, "memfd_create"):
+        return None
+    entry = getattr(_buffers, "entry", None)
+    if entry is None or entry[0] != os.getpid():
+        fd = os.memfd_create("seal_io", os.MFD_CLOEXEC)
+        entry = _buffers.entry = (os.getpid(), fd, f"/proc/self/fd/{fd}")
+    return entry[1:]
+
+
+def seal_bytes(obj) -> bytes:
+    """Serialización SEAL (tal cual, posiblemente comprimida) de un Ciphertext/Plaintext/SecretKey.
+
+    Los objetos SEAL sólo pueden guardarse a una ruta: se usa un fichero en memoria
+    reutilizado (memfd, en Linux) y, si no hay, un temporal por llamada.
+    """
+    buffer = _memory_file()
+    if buffer is not None:
+        fd, path = buffer
+        obj.save(path)
+        return os.pread(fd, os.fstat(fd).st_size, 0)
+    fd, path = tempfile.mkstemp(suffix=".seal")
+    os.close(fd)
+    try:
+        obj.save(path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(path)
+
+
+def _seal_load(obj, seal_context, data: bytes):
+    """obj.load desde bytes, por el mismo fichero en memoria que seal_bytes"""
+    buffer = _memory_file()
+    if buffer is not None:
+        fd, path = buffer
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, data, 0)
+        obj.load(seal_context, path)
+        return
+    fd, path = tempfile.mkstemp(suffix=".seal")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        obj.load(seal_context, path)
+    finally:
+        os.unlink(path)
+
+
+def seal_payload(obj) -> bytes:
+    """Cuerpo descomprimido de la serialización SEAL de un objeto, sin la cabecera"""
+    data = seal_bytes(obj)
+    header = SEAL_HEADER.unpack_from(data)
+    if header[4] == SEAL_COMPR_NONE:
+        return data[SEAL_HEADER.size:]
+    if header[4] != SEAL_COMPR_ZSTD:
+        raise ValueError(f"Modo de compresión SEAL no soportado: {header[4]}")
+    if zstandard is None:
+        raise ImportError("Leer los objetos SEAL comprimidos requiere el paquete 'zstandard'")
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data[SEAL_HEADER.size:])
+
+
+def _dyn_array(payload: bytes, offset: int) -> np.ndarray:
+    """Datos de un DynArray<uint64> serializado (con su propia cabecera SEAL) a partir de `offset`"""
+    offset += SEAL_HEADER.size
+    (count,) = DYN_ARRAY_SIZE.unpack_from(payload, offset)
+    return np.frombuffer(payload, dtype=np.uint64, count=count, offset=offset + DYN_ARRAY_SIZE.size)
+
+
+def plaintext_array(plain) -> Tuple[Tuple[int, ...], np.ndarray]:
+    """(parms_id, coeficientes RNS aplanados) de un Plaintext o de los datos de una SecretKey"""
+    payload = seal_payload(plain)
+    meta = PLAINTEXT_META.unpack_from(payload)
+    return meta[:4], _dyn_array(payload, PLAINTEXT_META.size)
+
+
+def ciphertext_arrays(ciphertext) -> Tuple[Tuple[int, ...], float, np.ndarray]:
+    """(parms_id, escala, polinomios (size, k, N)) de un Ciphertext en forma NTT"""
+    payload = seal_payload(ciphertext)
+    meta = CIPHERTEXT_META.unpack_from(payload)
+    parms_id, is_ntt_form, size, degree, num_moduli, scale = meta[:4], meta[4], meta[5], meta[6], meta[7], meta[8]
+    if not is_ntt_form:
+        raise ValueError("Se esperaba un cifrado CKKS en forma NTT")
+    return parms_id, scale, _dyn_array(payload, CIPHERTEXT_META.size).reshape(size, num_moduli, degree)
+
+
+_header_template: Optional[Tuple[int, ...]] = None
+
+
+def _seal_header(compression: int, size: int) -> bytes:
+    """Cabecera SEAL con la versión de la biblioteca enlazada, leída una vez de un objeto vacío"""
+    global _header_template
+    if _header_template is None:
+        _header_template = SEAL_HEADER.unpack_from(seal_bytes(sealapi.Plaintext()))
+    return SEAL_HEADER.pack(*_header_template[:4], compression, 0, size)
+
+
+def load_plaintext(seal_context, parms_id: Sequence[int], scale: float, coeffs: np.ndarray) -> "sealapi.Plaintext":
+    """Construye un Plaintext SEAL (forma NTT) con los coeficientes RNS dados"""
+    coeffs = np.ascontiguousarray(coeffs, dtype=np.uint64).reshape(-1)
+    array = DYN_ARRAY_SIZE.pack(coeffs.size) + coeffs.tobytes()
+    array = _seal_header(SEAL_COMPR_NONE, SEAL_HEADER.size + len(array)) + array
+    body = PLAINTEXT_META.pack(*parms_id, coeffs.size, scale) + array
+    data = _seal_header(SEAL_COMPR_NONE, SEAL_HEADER.size + len(body)) + body
+    plain = sealapi.Plaintext()
+    _seal_load(plain, seal_context, data)
+    return plain
+
+
+def coeff_moduli(seal_context, parms_id: Sequence[int]) -> np.ndarray:
+    """Primos RNS del nivel identificado por parms_id"""
+    parms = seal_context.get_context_data(list(parms_id)).parms()
+    return np.array([modulus.value() for modulus in parms.coeff_modulus()], dtype=np.uint64)
+
+
+# ======= Vuelta a objetos TenSEAL =======
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def ckks_vector_proto(seal_blob: bytes, size: int, scale: float) -> bytes:
+    """Mensaje CKKSVectorProto (sizes=1, ciphertexts=2, scale=3) alrededor de un cifrado SEAL serializado.
+
+    TenSEAL carga el cifrado con Ciphertext::load de SEAL, así que `seal_blob` puede ser
+    también un cifrado simétrico con semilla: la segunda componente se regenera al cargar.
+    """
+    sizes = _varint(size)
+    return (
+        b"\x0a" + _varint(len(sizes)) + sizes
+        + b"\x12" + _varint(len(seal_blob)) + seal_blob
+        + b"\x19" + struct.pack("<d", scale)
+    )
+
+
+def ckks_vector_from_ciphertext(context: ts.Context, ciphertext, size: int) -> ts.CKKSVector:
+    """Envuelve un Ciphertext SEAL en un CKKSVector de `size` elementos.
+
+    TenSEAL no tiene constructor desde un Ciphertext, así que se serializa el mensaje
+    protobuf del vector a mano y se deserializa.
+    """
+    return ts.ckks_vector_from(context, ckks_vector_proto(seal_bytes(ciphertext), size, ciphertext.scale))
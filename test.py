@@ -1,55 +1,42 @@
 import time
-import pickle
 import numpy as np
-import tenseal as ts
 from copy import deepcopy  
+from keystore import default_store
+from aggregator import EncryptedAggregator
+from preprocessing import encrypt_stack
+from dataset import DatasetStore
 
 NUM_HOSPITALS = 100
 
-# Cargar el fichero
-fichero = open("/home/enotari/Escritorio/data.pkl", "rb")
-normalized_list = pickle.load(fichero)
+# Abrir el dataset en disco (memmap); la primera vez se convierte desde data.pkl
+dataset = DatasetStore.open_or_convert("/home/enotari/Escritorio/data", "/home/enotari/Escritorio/data.pkl")
 
 print("\n########## SIMULACIÓN CLIENTE ##########\n")
 
 # Crear contexto CKKS para cifrado homomórfico
-context = ts.context(
-    ts.SCHEME_TYPE.CKKS,
+# Contexto cacheado en disco; sólo hay sumas y productos por escalar, sin claves de Galois
+context = default_store().load_or_create(
     poly_modulus_degree=8192,
-    coeff_mod_bit_sizes=[40, 20, 20, 20, 40]
+    coeff_mod_bit_sizes=[40, 20, 20, 20, 40],
+    global_scale=2**20
 )
-context.generate_galois_keys()
-context.generate_relin_keys()
-context.global_scale = 2**20
 
 # Medir tiempos
 total_start = time.time()
 
 # Encriptación
 encrypt_start = time.time()
-encrypted_data = []
 
 num_rows = 8
 num_cols = 8
 
-normalized_list = [
-    [
-        [float(h * num_rows * num_cols + i * num_cols + j + 1) for j in range(num_cols)]
-        for i in range(num_rows)
-    ]
-    for h in range(NUM_HOSPITALS)
-]
+normalized_list = np.arange(1, NUM_HOSPITALS * num_rows * num_cols + 1, dtype=np.float64).reshape(
+    NUM_HOSPITALS, num_rows, num_cols
+)
 
 #print("normalized_list = ", normalized_list)
 
-for matrix in normalized_list[:NUM_HOSPITALS]:
-    encrypted_matrix = []
-    for row in matrix:
-        row = np.asarray(row).flatten().astype(np.float64)
-        #print(f"[Encrypt]: {row}")
-        encrypted_row = ts.ckks_vector(context, row.tolist())
-        encrypted_matrix.append(encrypted_row)
-    encrypted_data.append(encrypted_matrix)
+encrypted_data = encrypt_stack(context, normalized_list[:NUM_HOSPITALS])
 encrypt_end = time.time()
 
 # Desencriptación
@@ -57,12 +44,7 @@ decrypt_start = time.time()
 decrypted_data = []
 
 for encrypted_matrix in encrypted_data:
-    decrypted_matriz = []
-    for enc_row in encrypted_matrix:
-        decrypted_row = enc_row.decrypt()
-        #print(f"[Decrypt]: {decrypted_row}")
-        decrypted_matriz.append(decrypted_row)
-    decrypted_data.append(decrypted_matriz)
+    decrypted_data.append(encrypted_matrix.decrypt())
 decrypt_end = time.time()
 
 total_end = time.time()
@@ -79,25 +61,21 @@ print("\n----- Ponderación con datos cifrados -----")
 
 encrypted_subset = encrypted_data[:NUM_HOSPITALS]
 
-num_rows_per_matrix = len(encrypted_subset[0])
-#print(f"\nNum matrix = {num_rows_per_matrix}")
+num_ciphertexts_per_matrix = encrypted_subset[0].num_ciphertexts
+#print(f"\nNum cifrados = {num_ciphertexts_per_matrix}")
 
 ponderation_encrypted_start = time.time()
 
-# Inicializar suma ponderada con la primera matriz
-encrypted_sum = [
-    vec * (1 / NUM_HOSPITALS) for vec in deepcopy(encrypted_subset[0])
-]
-
-# Acumular el resto de las matrices ponderadas
-for matrix in encrypted_subset[1:]:
-    for i, vec in enumerate(matrix):
-        encrypted_sum[i] += vec * (1 / NUM_HOSPITALS)
+# Acumular cada matriz ponderada según llega; el agregador toma posesión de ella
+aggregator = EncryptedAggregator()
+for matrix in encrypted_subset:
+    aggregator.add(matrix, 1 / NUM_HOSPITALS)
+encrypted_sum = aggregator.result()
 
 ponderation_encrypted_end = time.time()
 
 # Desencriptar resultados
-decrypted = [vec.decrypt() for vec in encrypted_sum]
+decrypted = encrypted_sum.decrypt()
 
 # print("\nMatriz ponderada (desencriptada para comprobación):")
 # for row in decrypted:
@@ -0,0 +1,322 @@
+import argparse
+import math
+import time
+import numpy as np
+import tenseal as ts
+import tenseal.sealapi as sealapi
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from encrypted_matrix import EncryptedMatrix
+from error_budget import FRESH_ERROR_CONSTANT
+from parameter_planner import MAX_COEFF_MODULUS_BITS, MAX_PRIME_BITS
+from seal_io import ciphertext_arrays, coeff_moduli, load_plaintext, plaintext_array
+
+# Seguridad estadística del enmascaramiento: el ruido añadido supera en 2**40 al ruido del cifrado
+SMUDGING_SECURITY_BITS = 40
+# Error máximo (en unidades de los datos) que puede añadir el enmascaramiento al resultado
+DEFAULT_MAX_SMUDGING_ERROR = 1e-4
+
+
+# ======= Aritmética modular vectorizada =======
+
+def _mulmod(a: np.ndarray, b: np.ndarray, moduli: np.ndarray) -> np.ndarray:
+    """a * b mod q elemento a elemento, con a, b < q < 2**62 en uint64.
+
+    El producto no cabe en 64 bits, así que b se procesa por trozos de (64 - bits(q)) bits:
+    con primos de 40 bits son dos pasadas y con primos de 60 bits, quince.
+    """
+    q = moduli.reshape(-1, 1)
+    bits = int(moduli.max()).bit_length()
+    step = 64 - bits
+    if step >= bits:
+        return (a * b) % q
+    mask = np.uint64((1 << step) - 1)
+    a = a % q
+    result = np.zeros(np.broadcast(a, b).shape, dtype=np.uint64)
+    for shift in range(((bits - 1) // step) * step, -1, -step):
+        chunk = (b >> np.uint64(shift)) & mask
+        result = ((result << np.uint64(step)) % q + (a * chunk) % q) % q
+    return result
+
+
+def _addmod(a: np.ndarray, b: np.ndarray, moduli: np.ndarray) -> np.ndarray:
+    q = moduli.reshape(-1, 1)
+    return (a + b) % q
+
+
+def lagrange_coefficients(participants: Sequence[int], moduli: np.ndarray) -> Dict[int, np.ndarray]:
+    """Coeficientes de Lagrange en x=0 de cada participante, módulo cada primo RNS"""
+    xs = [hospital_id + 1 for hospital_id in participants]
+    coefficients = {}
+    for hospital_id, xi in zip(participants, xs):
+        values = []
+        for q in (int(m) for m in moduli):
+            num, den = 1, 1
+            for xj in xs:
+                if xj != xi:
+                    num = num * xj % q
+                    den = den * (xj - xi) % q
+            values.append(num * pow(den, -1, q) % q)
+        coefficients[hospital_id] = np.array(values, dtype=np.uint64)
+    return coefficients
+
+
+# ======= Reparto de la clave =======
+
+class KeyShare:
+    """Parte Shamir (t de n) de la clave secreta de un hospital, en forma NTT y por primo RNS"""
+
+    def __init__(self, hospital_id: int, threshold: int, moduli: np.ndarray, share: np.ndarray):
+        self.hospital_id = hospital_id
+        self.threshold = threshold
+        self.moduli = moduli
+        self.share = share
+
+    def __repr__(self) -> str:
+        return f"KeyShare(hospital_id={self.hospital_id}, threshold={self.threshold}, moduli={len(self.moduli)})"
+
+
+def deal_key_shares(context: ts.Context, num_hospitals: int, threshold: int) -> List[KeyShare]:
+    """Reparte la clave secreta del contexto en partes Shamir t de n.
+
+    TenSEAL no permite generar la clave de forma distribuida, así que el reparto lo hace
+    quien crea el contexto (dealer), que después debe quedarse sólo con el contexto público
+    (make_context_public). Los polinomios aleatorios se generan de forma vectorizada para
+    todos los coeficientes y primos a la vez.
+    """
+    if not 1 <= threshold <= num_hospitals:
+        raise ValueError(f"Umbral {threshold} no válido para {num_hospitals} hospitales")
+    if not context.has_secret_key():
+        raise ValueError("El contexto no contiene la clave secreta que se quiere repartir")
+    seal_context = context.seal_context().data
+    parms_id, secret = plaintext_array(context.secret_key().data)
+    moduli = coeff_moduli(seal_context, parms_id)
+    secret = secret.reshape(len(moduli), -1)
+
+    rng = np.random.default_rng()
+    q = moduli.reshape(-1, 1)
+    coefficients = [rng.integers(0, q, size=secret.shape, dtype=np.uint64) for _ in range(threshold - 1)]
+
+    shares = []
+    for hospital_id in range(num_hospitals):
+        x = hospital_id + 1
+        # Horner: s + a1*x + a2*x^2 + ... mod q
+        value = np.zeros_like(secret)
+        for coefficient in reversed(coefficients):
+            value = _addmod(_mulmod(value, np.uint64(x), moduli), coefficient, moduli)
+        value = _addmod(_mulmod(value, np.uint64(x), moduli), secret, moduli)
+        shares.append(KeyShare(hospital_id, threshold, moduli, value))
+    return shares
+
+
+# ======= Descifrado parcial y combinación =======
+
+class PartialDecryption:
+    """Partes de descifrado de un hospital para todos los cifrados de una matriz"""
+
+    def __init__(self, hospital_id: int, participants: Tuple[int, ...], shares: np.ndarray):
+        self.hospital_id = hospital_id
+        self.participants = participants
+        self.shares = shares
+
+
+def _matrix_polynomials(matrix: EncryptedMatrix):
+    """(parms_id, escala, polinomios (num_cifrados, 2, k, N)) de todos los cifrados de la matriz"""
+    parms_id, scale, polys = None, None, []
+    for vec in matrix.ciphertexts:
+        (ciphertext,) = vec.ciphertext()
+        ct_parms_id, ct_scale, data = ciphertext_arrays(ciphertext)
+        if data.shape[0] != 2:
+            raise ValueError(f"El descifrado umbral requiere cifrados relinealizados (tamaño 2), recibido {data.shape[0]}")
+        if parms_id is not None and ct_parms_id != parms_id:
+            raise ValueError("Todos los cifrados de la matriz deben estar en el mismo nivel")
+        parms_id, scale = ct_parms_id, ct_scale
+        polys.append(data)
+    return parms_id, scale, np.stack(polys)
+
+
+def _smudging_noise(seal_context, parms_id, count: int, bits: int, rng) -> np.ndarray:
+    """Ruido de enmascaramiento en forma NTT: vectores gaussianos codificados a escala 2**bits"""
+    encoder = sealapi.CKKSEncoder(seal_context)
+    noise = []
+    for _ in range(count):
+        plain = sealapi.Plaintext()
+        encoder.encode(rng.standard_normal(encoder.slot_count()).tolist(), list(parms_id), 2.0 ** bits, plain)
+        noise.append(plaintext_array(plain)[1])
+    return np.stack(noise)
+
+
+def smudging_error(bits: int, scale: float, num_participants: int) -> float:
+    """Error máximo que añade al resultado el enmascaramiento de todos los participantes.
+
+    Cada parte suma ruido gaussiano de desviación 2**bits en cada slot (a la escala del
+    cifrado): la suma tiene desviación sqrt(participantes) * 2**bits y se toma 6 sigmas.
+    """
+    return 6.0 * math.sqrt(num_participants) * 2.0 ** bits / scale
+
+
+def smudging_bits_for(matrix: EncryptedMatrix, security_bits: int = SMUDGING_SECURITY_BITS) -> int:
+    """Bits de enmascaramiento seguros para la matriz: cota del ruido del cifrado + security_bits.
+
+    El ruido se toma del presupuesto de error de la matriz (o, sin él, de la cota de un
+    cifrado nuevo), en las mismas unidades que el enmascaramiento: valor * escala. Lanza
+    ValueError si el módulo del nivel actual no deja sitio para el valor y ese
+    enmascaramiento. La precisión del resultado la comprueba partial_decrypt (smudging_error).
+    """
+    seal_context = matrix.context.seal_context().data
+    parms_id, scale, polys = _matrix_polynomials(matrix)
+    if matrix.budget is not None:
+        noise = matrix.budget.noise * scale
+        value_bound = matrix.budget.value_bound
+    else:
+        noise = FRESH_ERROR_CONSTANT * math.sqrt(polys.shape[-1])
+        value_bound = 1.0
+    bits = math.ceil(math.log2(max(noise, 1.0))) + security_bits
+    modulus_bits = sum(math.log2(int(q)) for q in coeff_moduli(seal_context, parms_id))
+    # Margen para la suma de las partes de todos los participantes y el signo
+    needed_bits = max(bits, math.log2(max(value_bound, 1.0) * scale)) + 8
+    if needed_bits > modulus_bits:
+        raise ValueError(f"El módulo del nivel actual ({modulus_bits:.0f} bits) no admite el valor y un "
+                         f"enmascaramiento seguro de {bits} bits")
+    return bits
+
+
+def threshold_context(num_participants: int, poly_modulus_degree: int = 8192,
+                      max_error: float = DEFAULT_MAX_SMUDGING_ERROR, value_bits: int = 10,
+                      num_contributions: int = 1) -> ts.Context:
+    """Contexto CKKS con escala suficiente para el descifrado umbral con enmascaramiento seguro.
+
+    La escala se elige para que smudging_error de smudging_bits_for no supere max_error al
+    descifrar la suma de num_contributions cifrados nuevos (el ruido crece en cuadratura),
+    y el módulo de datos para que quepan valores de hasta 2**value_bits.
+    Con escalas tan grandes el contexto sólo admite sumas, no productos reescalados.
+    """
+    if poly_modulus_degree not in MAX_COEFF_MODULUS_BITS:
+        raise ValueError(f"poly_modulus_degree {poly_modulus_degree} no soportado")
+    noise_bits = math.ceil(math.log2(FRESH_ERROR_CONSTANT * math.sqrt(poly_modulus_degree * num_contributions)))
+    bits = noise_bits + SMUDGING_SECURITY_BITS
+    scale_bits = bits + math.ceil(math.log2(6.0 * math.sqrt(num_participants) / max_error))
+    data_primes = math.ceil((scale_bits + value_bits + 8) / MAX_PRIME_BITS)
+    coeff_mod_bit_sizes = [MAX_PRIME_BITS] * (data_primes + 1)
+    if sum(coeff_mod_bit_sizes) > MAX_COEFF_MODULUS_BITS[poly_modulus_degree]:
+        raise ValueError(f"Una escala de 2**{scale_bits} no cabe con poly_modulus_degree {poly_modulus_degree}")
+    context = ts.context(ts.SCHEME_TYPE.CKKS, poly_modulus_degree, coeff_mod_bit_sizes=coeff_mod_bit_sizes)
+    context.global_scale = 2.0 ** scale_bits
+    return context
+
+
+def partial_decrypt(key_share: KeyShare, matrix: EncryptedMatrix, participants: Sequence[int],
+                    smudging_bits: Optional[int] = None,
+                    max_error: float = DEFAULT_MAX_SMUDGING_ERROR) -> PartialDecryption:
+    """Parte de descifrado de un hospital para toda la matriz en una sola llamada.
+
+    Calcula d = c1 * (lambda_i * s_i) + e para todos los cifrados a la vez, donde lambda_i es
+    el coeficiente de Lagrange del hospital en el conjunto `participants`; así el combinador
+    sólo suma partes y el ruido e no se multiplica por lambda_i. Cada hospital añade ruido
+    de 2**smudging_bits (en unidades de la escala del cifrado). Por defecto se usa
+    smudging_bits_for(matrix); con menos bits la parte deja ver el ruido del cifrado y,
+    a través de él, información sobre la parte de la clave: cualquier valor menor, y 0
+    (sin enmascaramiento), es inseguro y sólo sirve para pruebas.
+
+    Lanza ValueError si el enmascaramiento añadiría al resultado un error mayor que
+    max_error para la escala del cifrado: threshold_context crea contextos con escala suficiente.
+    """
+    participants = tuple(sorted(participants))
+    if key_share.hospital_id not in participants:
+        raise ValueError(f"El hospital {key_share.hospital_id} no está entre los participantes {participants}")
+    if len(participants) < key_share.threshold:
+        raise PermissionError(f"Se necesitan al menos {key_share.threshold} hospitales para descifrar")
+    seal_context = matrix.context.seal_context().data
+    parms_id, scale, polys = _matrix_polynomials(matrix)
+    if smudging_bits is None:
+        smudging_bits = smudging_bits_for(matrix)
+    if smudging_bits > 0 and smudging_error(smudging_bits, scale, len(participants)) > max_error:
+        raise ValueError(f"Un enmascaramiento de {smudging_bits} bits a escala 2**{math.log2(scale):.0f} añade "
+                         f"un error de hasta {smudging_error(smudging_bits, scale, len(participants)):.1e} "
+                         f"(máximo {max_error:.1e}): usa una escala mayor (threshold_context)")
+    num_moduli = polys.shape[2]
+    moduli = key_share.moduli[:num_moduli]
+
+    lagrange = lagrange_coefficients(participants, moduli)[key_share.hospital_id]
+    scaled_share = _mulmod(key_share.share[:num_moduli], lagrange.reshape(-1, 1), moduli)
+    shares = _mulmod(polys[:, 1], scaled_share, moduli)
+    if smudging_bits > 0:
+        noise = _smudging_noise(seal_context, parms_id, len(polys), smudging_bits, np.random.default_rng())
+        shares = _addmod(shares, noise.reshape(shares.shape), moduli)
+    return PartialDecryption(key_share.hospital_id, participants, shares)
+
+
+def combine(matrix: EncryptedMatrix, partials: Sequence[PartialDecryption], threshold: int) -> np.ndarray:
+    """Reconstruye la matriz en claro a partir de las partes de descifrado: m = c0 + sum_i d_i"""
+    if len(partials) < threshold:
+        raise PermissionError(f"Se necesitan al menos {threshold} partes de descifrado, recibidas {len(partials)}")
+    participants = {partial.participants for partial in partials}
+    if len(participants) != 1 or set(next(iter(participants))) != {p.hospital_id for p in partials}:
+        raise ValueError("Las partes de descifrado no corresponden al mismo conjunto de participantes")
+    seal_context = matrix.context.seal_context().data
+    parms_id, scale, polys = _matrix_polynomials(matrix)
+    moduli = coeff_moduli(seal_context, parms_id)
+
+    plain = polys[:, 0]
+    for partial in partials:
+        plain = _addmod(plain, partial.shares, moduli)
+
+    encoder = sealapi.CKKSEncoder(seal_context)
+    chunks = [
+        encoder.decode_double(load_plaintext(seal_context, parms_id, scale, coeffs))[:length]
+        for coeffs, length in zip(plain, matrix.layout.chunk_lengths())
+    ]
+    return matrix.layout.unpack(chunks)
+
+
+def threshold_decrypt(matrix: EncryptedMatrix, key_shares: Sequence[KeyShare],
+                      smudging_bits: Optional[int] = None,
+                      max_error: float = DEFAULT_MAX_SMUDGING_ERROR) -> np.ndarray:
+    """Descifrado completo con los hospitales de `key_shares`: una parte por hospital y matriz"""
+    participants = [share.hospital_id for share in key_shares]
+    partials = [partial_decrypt(share, matrix, participants, smudging_bits, max_error) for share in key_shares]
+    return combine(matrix, partials, key_shares[0].threshold)
+
+
+# ======= Comparación con el descifrado con una sola clave =======
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Descifrado umbral frente a descifrado con una sola clave")
+    parser.add_argument("--hospitals", type=int, default=5)
+    parser.add_argument("--threshold", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=448)
+    parser.add_argument("--cols", type=int, default=448)
+    parser.add_argument("--smudging-bits", type=int, default=None,
+                        help="Por defecto, el tamaño seguro de smudging_bits_for; 0 desactiva el enmascaramiento")
+    args = parser.parse_args()
+
+    # El enmascaramiento seguro cuesta unos 2**(bits - escala) de precisión: hace falta una escala grande
+    context = threshold_context(args.threshold)
+    data = np.random.rand(args.rows, args.cols)
+    matrix = EncryptedMatrix.encrypt(context, data)
+    smudging_bits = smudging_bits_for(matrix) if args.smudging_bits is None else args.smudging_bits
+    print(f"Cifrados por matriz: {matrix.num_ciphertexts}, escala 2**{math.log2(context.global_scale):.0f}, "
+          f"enmascaramiento de {smudging_bits} bits")
+
+    start = time.perf_counter()
+    key_shares = deal_key_shares(context, args.hospitals, args.threshold)
+    print(f"Reparto de la clave ({args.threshold} de {args.hospitals}): {time.perf_counter() - start:.4f} s")
+
+    start = time.perf_counter()
+    single = matrix.decrypt()
+    single_time = time.perf_counter() - start
+
+    participants = [share.hospital_id for share in key_shares[:args.threshold]]
+    start = time.perf_counter()
+    partials = [partial_decrypt(share, matrix, participants, smudging_bits)
+                for share in key_shares[:args.threshold]]
+    partial_time = time.perf_counter() - start
+    start = time.perf_counter()
+    result = combine(matrix, partials, args.threshold)
+    combine_time = time.perf_counter() - start
+
+    print(f"Descifrado con una clave:       {single_time:.4f} s (error {np.abs(single - data).max():.2e})")
+    print(f"Partes de descifrado:           {partial_time / args.threshold:.4f} s por hospital")
+    print(f"Combinación:                    {combine_time:.4f} s")
+    print(f"Descifrado umbral (total):      {partial_time + combine_time:.4f} s "
+          f"(error {np.abs(result - data).max():.2e})")
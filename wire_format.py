@@ -0,0 +1,234 @@
+import math
+import struct
+import tenseal as ts
+from typing import BinaryIO, Iterable, Iterator, Optional, Tuple
+
+import instrumentation
+from encrypted_matrix import EncryptedMatrix, PackingLayout
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Formato de contenedor de una matriz cifrada:
+#   cabecera fija (HEADER) + num_ciphertexts bloques [longitud uint32][cifrado serializado]
+MAGIC = b"HEMX"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHIIIIdI")
+CHUNK_LENGTH = struct.Struct("<I")
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZSTD = 1
+COMPRESSION_LZ4 = 2
+COMPRESSION_CODES = {"none": COMPRESSION_NONE, "zstd": COMPRESSION_ZSTD, "lz4": COMPRESSION_LZ4}
+
+# Tamaño máximo de un bloque, comprimido o no: un cifrado CKKS de N=32768 con los 881 bits
+# de módulo permitidos ocupa unos 7 MiB serializado
+MAX_CHUNK_LENGTH = 32 * 2 ** 20
+# Slots de un cifrado CKKS (poly_modulus_degree / 2) con N <= 32768, y cifrados por matriz:
+# un límite a lo que una cabecera puede hacer reservar antes de recibir nada
+MAX_SLOTS = 2 ** 14
+MAX_CIPHERTEXTS = 2 ** 20
+
+
+class WireFormatError(ValueError):
+    """Contenedor mal formado, truncado o de una versión no soportada"""
+
+
+def _check_compression(code: int):
+    if code == COMPRESSION_ZSTD and zstandard is None:
+        raise ImportError("La compresión zstd requiere el paquete 'zstandard'")
+    if code == COMPRESSION_LZ4 and lz4 is None:
+        raise ImportError("La compresión lz4 requiere el paquete 'lz4'")
+    if code not in COMPRESSION_CODES.values():
+        raise WireFormatError(f"Código de compresión desconocido: {code}")
+
+
+def _compress(code: int, data: bytes) -> bytes:
+    if code == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    if code == COMPRESSION_LZ4:
+        return lz4.frame.compress(data)
+    return data
+
+
+def _decompress(code: int, data: bytes, max_length: int) -> bytes:
+    if code == COMPRESSION_ZSTD:
+        if zstandard.frame_content_size(data) > max_length:
+            raise WireFormatError(f"El bloque descomprimido supera {max_length} bytes")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_length)
+    if code == COMPRESSION_LZ4:
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        data = decompressor.decompress(data, max_length=max_length)
+        if not decompressor.eof:
+            raise WireFormatError(f"Bloque lz4 truncado o mayor de {max_length} bytes descomprimido")
+    return data
+
+
+def encode_header(layout: PackingLayout, scale: float, level: int, compression: str = "none") -> bytes:
+    """Cabecera del contenedor para una matriz con este layout"""
+    if compression not in COMPRESSION_CODES:
+        raise ValueError(f"Compresión no soportada: {compression}")
+    code = COMPRESSION_CODES[compression]
+    _check_compression(code)
+    return HEADER.pack(
+        MAGIC, VERSION, code, 0,
+        layout.num_rows, layout.num_cols, layout.slots, layout.num_ciphertexts,
+        scale, level
+    )
+
+
+def decode_header(data: bytes) -> Tuple[int, PackingLayout, float, int]:
+    """Valida una cabecera y devuelve (código de compresión, layout, escala, nivel)"""
+    magic, version, compression, _, num_rows, num_cols, slots, num_ciphertexts, scale, level = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise WireFormatError(f"Firma no válida: {magic!r}")
+    if version != VERSION:
+        raise WireFormatError(f"Versión de formato no soportada: {version}")
+    _check_compression(compression)
+    if not 0 < slots <= MAX_SLOTS or slots & (slots - 1):
+        raise WireFormatError(f"Número de slots no válido: {slots}")
+    if num_rows == 0 or num_cols == 0:
+        raise WireFormatError(f"Forma de matriz no válida: ({num_rows}, {num_cols})")
+    if not 0 < num_ciphertexts <= MAX_CIPHERTEXTS:
+        raise WireFormatError(f"Número de cifrados no válido: {num_ciphertexts} (máximo {MAX_CIPHERTEXTS})")
+    if not math.isfinite(scale) or scale <= 0:
+        raise WireFormatError(f"Escala no válida: {scale}")
+    layout = PackingLayout(num_rows, num_cols, slots)
+    if layout.num_ciphertexts != num_ciphertexts:
+        raise WireFormatError(
+            f"La cabecera declara {num_ciphertexts} cifrados y el layout requiere {layout.num_ciphertexts}"
+        )
+    return compression, layout, scale, level
+
+
+def encode_chunk(compression: int, serialized_ciphertext: bytes) -> bytes:
+    """Bloque [longitud][cifrado comprimido] listo para escribir"""
+    payload = _compress(compression, serialized_ciphertext)
+    return CHUNK_LENGTH.pack(len(payload)) + payload
+
+
+def check_chunk_length(length: int, max_length: int = MAX_CHUNK_LENGTH):
+    """Rechaza una longitud de bloque declarada antes de leer o reservar nada"""
+    if length > max_length:
+        raise WireFormatError(f"Bloque de {length} bytes, el máximo es {max_length}")
+
+
+def decode_chunk(compression: int, payload: bytes, max_length: int = MAX_CHUNK_LENGTH) -> bytes:
+    """Cifrado serializado a partir de la carga útil de un bloque (sin la longitud)"""
+    try:
+        return _decompress(compression, payload, max_length)
+    except WireFormatError:
+        raise
+    except Exception as e:
+        # zstandard y lz4 señalan los datos corruptos con sus propias excepciones (ZstdError, RuntimeError)
+        raise WireFormatError(f"Bloque comprimido no válido: {e}") from e
+
+
+def deserialize_chunk(context: ts.Context, blob: bytes) -> ts.CKKSVector:
+    """ts.ckks_vector_from que señala un cifrado corrupto con WireFormatError"""
+    try:
+        return ts.ckks_vector_from(context, blob)
+    except Exception as e:
+        raise WireFormatError(f"Cifrado serializado no válido: {e}") from e
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise WireFormatError(f"Contenedor truncado: se esperaban {size} bytes, leídos {len(data)}")
+    return data
+
+
+class MatrixWriter:
+    """Escritor en streaming: la cabecera primero y después cada cifrado según se produce"""
+
+    def __init__(self, stream: BinaryIO, layout: PackingLayout, scale: float, level: int,
+                 compression: str = "none"):
+        header = encode_header(layout, scale, level, compression)
+        self.stream = stream
+        self.layout = layout
+        self.compression = COMPRESSION_CODES[compression]
+        self.chunks_written = 0
+        self.bytes_written = 0
+        self._write(header)
+
+    def _write(self, data: bytes):
+        self.stream.write(data)
+        self.bytes_written += len(data)
+
+    def write_chunk(self, serialized_ciphertext: bytes):
+        """Escribe un cifrado serializado, en el orden del layout"""
+        if self.chunks_written >= self.layout.num_ciphertexts:
+            raise WireFormatError(f"El layout sólo tiene {self.layout.num_ciphertexts} cifrados")
+        self._write(encode_chunk(self.compression, serialized_ciphertext))
+        self.chunks_written += 1
+
+    def write_chunks(self, serialized_ciphertexts: Iterable[bytes]):
+        for blob in serialized_ciphertexts:
+            self.write_chunk(blob)
+
+    def close(self):
+        """Comprueba que se han escrito todos los cifrados del layout"""
+        if self.chunks_written != self.layout.num_ciphertexts:
+            raise WireFormatError(
+                f"Se escribieron {self.chunks_written} de {self.layout.num_ciphertexts} cifrados"
+            )
+        self.stream.flush()
+
+
+class MatrixReader:
+    """Lector en streaming: expone la cabecera y devuelve los cifrados de uno en uno"""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.compression, self.layout, self.scale, self.level = decode_header(_read_exact(stream, HEADER.size))
+        self.chunks_read = 0
+
+    def read_chunk(self) -> Optional[bytes]:
+        """Devuelve el siguiente cifrado serializado o None si ya se han leído todos"""
+        if self.chunks_read == self.layout.num_ciphertexts:
+            return None
+        (length,) = CHUNK_LENGTH.unpack(_read_exact(self.stream, CHUNK_LENGTH.size))
+        check_chunk_length(length)
+        payload = _read_exact(self.stream, length)
+        self.chunks_read += 1
+        return decode_chunk(self.compression, payload)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            blob = self.read_chunk()
+            if blob is None:
+                return
+            yield blob
+
+    def read_ciphertexts(self, context: ts.Context) -> Iterator[ts.CKKSVector]:
+        """Deserializa los cifrados de uno en uno según llegan"""
+        for blob in self:
+            with instrumentation.stage(instrumentation.DESERIALIZE, ciphertexts=1):
+                vec = deserialize_chunk(context, blob)
+            yield vec
+
+
+def write_matrix(stream: BinaryIO, matrix: EncryptedMatrix, compression: str = "none") -> int:
+    """Escribe una matriz cifrada serializando cada cifrado justo antes de escribirlo"""
+    writer = MatrixWriter(stream, matrix.layout, matrix.scale, matrix.level, compression)
+    for vec in matrix.ciphertexts:
+        with instrumentation.stage(instrumentation.SERIALIZE, ciphertexts=1) as stage:
+            blob = vec.serialize()
+            stage.add_bytes(len(blob))
+        writer.write_chunk(blob)
+    writer.close()
+    return writer.bytes_written
+
+
+def read_matrix(stream: BinaryIO, context: ts.Context) -> EncryptedMatrix:
+    """Lee un contenedor completo y reconstruye la matriz cifrada"""
+    reader = MatrixReader(stream)
+    return EncryptedMatrix(reader.layout, list(reader.read_ciphertexts(context)))